@@ -0,0 +1,114 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8
+'''Micro-benchmark of the key file parser.
+
+Writes a synthetic directory of key files and reports how many keys per
+second DNSSECKey parses them, next to the regex-per-tag parser the tool
+used before.
+'''
+
+import sys
+import os
+import re
+import argparse
+import base64
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from dnssec_rollover_tool import DNSSECKey
+
+KEY_TEMPLATE = '''; This is a {keytype}-signing key, keyid {keyid}, for {zone}.
+; Created: {created:%Y%m%d%H%M%S} ({created:%a %b %d %H:%M:%S %Y})
+; Publish: {publish:%Y%m%d%H%M%S} ({publish:%a %b %d %H:%M:%S %Y})
+; Activate: {activate:%Y%m%d%H%M%S} ({activate:%a %b %d %H:%M:%S %Y})
+; Inactive: {inactive:%Y%m%d%H%M%S} ({inactive:%a %b %d %H:%M:%S %Y})
+; Delete: {delete:%Y%m%d%H%M%S} ({delete:%a %b %d %H:%M:%S %Y})
+{zone}. IN DNSKEY {flags} 3 8 {key}
+'''
+
+class LegacyKey:
+    '''Parser as implemented before the single-pass parser'''
+    def __init__(self, keyfile):
+        with open(keyfile) as filedesc:
+            for line in filedesc:
+                matchresult = re.match(
+                    r"^; This is a (\w+)-signing key, keyid (\d+), for (.*)$",
+                    line)
+                if matchresult:
+                    self.keytype = matchresult.group(1)
+                    continue
+                for tag in ('Created', 'Publish', 'Activate', 'Revoke',
+                            'Inactive', 'Delete'):
+                    matchresult = re.match(
+                        "^; " + tag + r": (\d{14}).*", line)
+                    if matchresult:
+                        setattr(self, tag.lower(), datetime.strptime(
+                            matchresult.group(1), "%Y%m%d%H%M%S"))
+                        break
+
+def write_keys(directory, count):
+    '''Write count synthetic key files, return their paths'''
+    keyfiles = []
+    base = datetime(2015, 6, 1)
+    for index in range(count):
+        created = base + timedelta(minutes=index)
+        keyid = index % 65536
+        keytype = 'key' if index % 4 == 0 else 'zone'
+        keyfile = os.path.join(
+            directory,
+            'Kzone{0}.example.+008+{1:05d}.key'.format(index, keyid))
+        with open(keyfile, 'w') as filedesc:
+            filedesc.write(KEY_TEMPLATE.format(
+                keytype=keytype,
+                keyid=keyid,
+                zone='zone{0}.example'.format(index),
+                created=created,
+                publish=created,
+                activate=created + timedelta(days=1),
+                inactive=created + timedelta(days=30),
+                delete=created + timedelta(days=40),
+                flags=257 if keytype == 'key' else 256,
+                key=base64.b64encode(os.urandom(260)).decode('ascii')))
+        keyfiles.append(keyfile)
+    return keyfiles
+
+def measure(parser, keyfiles):
+    '''Return keys per second parsed by parser'''
+    start = time.perf_counter()
+    for keyfile in keyfiles:
+        parser(keyfile)
+    return len(keyfiles) / (time.perf_counter() - start)
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(
+        description='Benchmark key file parsing')
+    argparser.add_argument(
+        '-c',
+        '--count',
+        help='Number of key files to generate.',
+        type=int,
+        default=100000
+    )
+    argparser.add_argument(
+        '-d',
+        '--directory',
+        help='Directory to generate the key files in. '
+        'A temporary directory by default.',
+        type=str
+    )
+    args = argparser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.directory) as directory:
+        keyfiles = write_keys(directory, args.count)
+        # warm the page cache so both parsers read from memory
+        measure(LegacyKey, keyfiles[:1000])
+        legacy = measure(LegacyKey, keyfiles)
+        current = measure(DNSSECKey, keyfiles)
+    print('keys:         {0}'.format(args.count))
+    print('legacy:       {0:10.0f} keys/s'.format(legacy))
+    print('single-pass:  {0:10.0f} keys/s'.format(current))
+    print('speedup:      {0:10.2f}x'.format(current / legacy))
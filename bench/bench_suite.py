@@ -0,0 +1,954 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8
+'''End-to-end benchmark of key loading, rollovers and key listings.
+
+Generates a synthetic tree of key directories, puts stub dig,
+dnssec-keygen, dnssec-settime, dnssec-dsfromkey and sendmail executables
+with configurable latency first in PATH, serves the zones from stand-in
+authoritative servers on loopback addresses and measures run time,
+subprocess counts, DNS queries and peak memory of
+
+  getkeys   loading the keys of every zone
+  rollover  ZSK and KSK rollovers of every zone (DNSSECRollover) through
+            the dig resolver
+  native    the rollovers through the native resolver, its asyncio
+            prefetch and an empty answer cache
+  cached    the rollovers through the native resolver with the answers
+            left in the cache by the native stage
+  print     the text key listing of every zone (print path)
+
+With --algorithm the zone list asks for another algorithm than the one
+of the generated keys, so the rollover stages start an algorithm
+rollover in every zone.
+
+Each stage runs in a process of its own. Results are appended to a JSON
+lines file and compared with the last run of the same parameters.
+
+The stub tools are small scripts calling run_stub of this module with
+the interpreter running the benchmark.
+'''
+
+import sys
+import os
+import argparse
+import base64
+import calendar
+import hashlib
+import json
+import random
+import re
+import shutil
+import socket
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+from collections import Counter
+
+BENCH_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+TOOL_DIRECTORY = os.path.join(BENCH_DIRECTORY, '..')
+
+STUB_TOOLS = (
+    'dig', 'dnssec-keygen', 'dnssec-settime', 'dnssec-dsfromkey', 'sendmail')
+
+ALGORITHM = 13
+ALGORITHM_NAME = 'ECDSAP256SHA256'
+ALGORITHMS = {
+    'RSASHA1': 5,
+    'NSEC3RSASHA1': 7,
+    'RSASHA256': 8,
+    'RSASHA512': 10,
+    'ECDSAP256SHA256': 13,
+    'ECDSAP384SHA384': 14,
+    'ED25519': 15,
+    'ED448': 16
+}
+RSA_ALGORITHMS = (5, 7, 8, 10)
+# public key sizes in octets of the other algorithms
+PUBLIC_KEY_SIZES = {13: 64, 14: 96, 15: 32, 16: 57}
+RSA_BITS = 2048
+ZSK_INTERVAL = 30*86400
+KSK_INTERVAL = 180*86400
+RESIGN_INTERVAL = 5*86400
+DS_TTL = 3600
+# refresh, retry and expire: keys are due for a successor this long
+# after activation
+SOA_TIMERS = (7200, 3600, 1209600)
+DUE_AFTER = SOA_TIMERS[2] + 3*(SOA_TIMERS[0] + SOA_TIMERS[1])
+
+TIMING_TAGS = ('Created', 'Publish', 'Activate', 'Revoke', 'Inactive',
+               'Delete')
+SETTIME_TAGS = {
+    '-P': 'Publish',
+    '-A': 'Activate',
+    '-R': 'Revoke',
+    '-I': 'Inactive',
+    '-D': 'Delete'
+}
+
+def format_time(timestamp):
+    '''Key file representation of epoch seconds'''
+    gmtime = time.gmtime(timestamp)
+    return time.strftime('%Y%m%d%H%M%S', gmtime) + \
+        time.strftime(' (%a %b %d %H:%M:%S %Y)', gmtime)
+
+def key_tag(rdata):
+    '''Key tag of DNSKEY RDATA (RFC 4034 Appendix B)'''
+    accumulator = 0
+    for index, octet in enumerate(rdata):
+        accumulator += octet if index & 1 else octet << 8
+    return (accumulator + (accumulator >> 16 & 0xffff)) & 0xffff
+
+def name_wire(name):
+    '''Domain name in wire format, lower case'''
+    return b''.join(
+        bytes([len(x)]) + x.lower().encode('ascii')
+        for x in name.rstrip('.').split('.') if x) + b'\0'
+
+def make_public_key(algorithm, bits = None):
+    '''Made-up public key of algorithm, RSA keys of bits bits with
+    exponent 65537'''
+    if algorithm in RSA_ALGORITHMS:
+        return b'\x03\x01\x00\x01' + os.urandom((bits or RSA_BITS) // 8)
+    return os.urandom(PUBLIC_KEY_SIZES.get(algorithm, 64))
+
+def public_key_bits(rdata):
+    '''Key size of RSA DNSKEY RDATA as given to dnssec-keygen -b, None
+    for other algorithms'''
+    if rdata[3] not in RSA_ALGORITHMS:
+        return None
+    if rdata[4]:
+        return len(rdata[5 + rdata[4]:]) * 8
+    return len(rdata[7 + struct.unpack('!H', rdata[5:7])[0]:]) * 8
+
+def write_key(directory, zone, ksk, timing, algorithm = ALGORITHM,
+              existing = None, bits = None):
+    '''Write key and private key file of a new key with timing given as
+    {tag: epoch seconds}, return the key file name without .key. Key
+    tags in existing are avoided.'''
+    while True:
+        rdata = bytes([1, 1 if ksk else 0, 3, algorithm]) + \
+            make_public_key(algorithm, bits)
+        keyid = key_tag(rdata)
+        if not existing or keyid not in existing:
+            break
+    if existing is not None:
+        existing.add(keyid)
+    name = 'K{0}.+{1:03d}+{2:05d}'.format(zone, algorithm, keyid)
+    path = os.path.join(directory, name)
+    public_key = base64.b64encode(rdata[4:]).decode('ascii')
+    timing_lines = [
+        (x, format_time(timing[x])) for x in TIMING_TAGS if x in timing]
+    with open(path + '.key', 'w') as filedesc:
+        filedesc.write(
+            '; This is a {0}-signing key, keyid {1}, for {2}.\n'.format(
+                'key' if ksk else 'zone', keyid, zone) +
+            ''.join('; {0}: {1}\n'.format(*x) for x in timing_lines) +
+            '{0}. IN DNSKEY {1} 3 {2} {3}\n'.format(
+                zone, 257 if ksk else 256, algorithm, public_key))
+    with open(path + '.private', 'w') as filedesc:
+        filedesc.write(
+            'Private-key-format: v1.3\n'
+            'Algorithm: {0} ({1})\n'
+            'PrivateKey: {2}\n'.format(
+                algorithm, dict((y, x) for x, y in ALGORITHMS.items())
+                .get(algorithm, 'UNKNOWN'),
+                base64.b64encode(os.urandom(32)).decode('ascii')) +
+            ''.join('{0}: {1}\n'.format(x[0], x[1][:14])
+                    for x in timing_lines))
+    return name
+
+def zone_name(index):
+    '''Name of synthetic zone number index'''
+    return 'z{0}.bench.example'.format(index)
+
+def generate(workdir, zones, zones_per_dir, history, due, seed):
+    '''Write keys of zones into workdir/keys, zones_per_dir zones per
+    directory, with up to history retired keys per key type. A fraction
+    due of the zones needs new keys. DS answers of the stub dig go to
+    workdir/answers. Return number of keys written.'''
+    rng = random.Random(seed)
+    now = int(time.time())
+    keys = 0
+    os.makedirs(os.path.join(workdir, 'answers'))
+    with open(os.path.join(workdir, 'zones.txt'), 'w') as zone_list:
+        for index in range(zones):
+            zone = zone_name(index)
+            subdirectory = 'd{0:04d}'.format(index // zones_per_dir)
+            directory = os.path.join(workdir, 'keys', subdirectory)
+            if index % zones_per_dir == 0:
+                os.makedirs(directory)
+            zone_list.write('{0} {1} {2}\n'.format(
+                zone, subdirectory, ALGORITHM_NAME))
+            existing = set()
+            is_due = rng.random() < due
+            for ksk, interval in ((False, ZSK_INTERVAL),
+                                  (True, KSK_INTERVAL)):
+                if is_due:
+                    activate = now - rng.randint(DUE_AFTER + 3600, interval)
+                else:
+                    activate = now - rng.randint(0, DUE_AFTER // 2)
+                # retired keys, the oldest ones past their delete time
+                for generation in range(rng.randint(0, history), 0, -1):
+                    inactive = activate - (generation - 1)*interval
+                    write_key(directory, zone, ksk, {
+                        'Created': inactive - interval - 86400,
+                        'Publish': inactive - interval - 86400,
+                        'Activate': inactive - interval,
+                        'Inactive': inactive,
+                        'Delete': inactive + 2*DUE_AFTER
+                    }, existing = existing)
+                    keys += 1
+                name = write_key(directory, zone, ksk, {
+                    'Created': activate - 86400,
+                    'Publish': activate - 86400,
+                    'Activate': activate
+                }, existing = existing)
+                keys += 1
+                if ksk:
+                    with open(os.path.join(directory, name + '.key')) as f:
+                        rdata = dnskey_rdata(f.read())
+                    with open(os.path.join(
+                            workdir, 'answers', zone + '.ds'), 'w') as f:
+                        f.write('\n'.join(
+                            '{0}. {1} IN {2}'.format(zone, DS_TTL, x)
+                            for x in ds_records(zone, rdata)) + '\n')
+    return keys
+
+def dnskey_rdata(key_file_content):
+    '''DNSKEY RDATA of a key file'''
+    fields = re.search(
+        r'^\S+\s+IN\s+DNSKEY\s+(\d+)\s+(\d+)\s+(\d+)\s+(.*)$',
+        key_file_content, re.M).groups()
+    flags = int(fields[0])
+    return bytes([flags >> 8, flags & 0xff, int(fields[1]), int(fields[2])]) \
+        + base64.b64decode(''.join(fields[3].split()))
+
+def ds_records(zone, rdata, digest_types = (1, 2)):
+    '''DS RDATA of DNSKEY RDATA, "DS tag algorithm type digest"'''
+    return ['DS {0} {1} {2} {3}'.format(
+        key_tag(rdata), rdata[3], x,
+        hashlib.new({1: 'sha1', 2: 'sha256', 4: 'sha384'}[x],
+                    name_wire(zone) + rdata).hexdigest().upper())
+        for x in digest_types]
+
+# stub tools
+
+def stub_dig(arguments):
+    '''dig +trace answering SOA with fixed timers and DS from the
+    generated answers'''
+    rtype, name = arguments[-2].upper(), arguments[-1].rstrip('.')
+    if rtype == 'SOA':
+        print('{0}. 3600 IN SOA ns.{0}. hostmaster.{0}. 1 {1} {2} {3} '
+              '3600'.format(name, *SOA_TIMERS))
+    elif rtype == 'DS':
+        try:
+            with open(os.path.join(
+                    os.environ['BENCH_WORKDIR'], 'answers',
+                    name + '.ds')) as filedesc:
+                sys.stdout.write(filedesc.read())
+        except OSError:
+            pass
+
+def parse_time(value, now):
+    '''Epoch seconds of a dnssec-keygen time, YYYYMMDDHHMMSS or +offset'''
+    if value.startswith('+'):
+        return now + int(value[1:])
+    return calendar.timegm(time.strptime(value, '%Y%m%d%H%M%S'))
+
+def stub_keygen(arguments):
+    '''dnssec-keygen writing a key of the requested algorithm, size and
+    timing, a successor (-S) of the algorithm and size of its
+    predecessor'''
+    options = {}
+    zone = None
+    index = 0
+    while index < len(arguments):
+        if arguments[index] in ('-G', '-q'):
+            options[arguments[index]] = True
+            index += 1
+        elif arguments[index].startswith('-'):
+            options[arguments[index]] = arguments[index + 1]
+            index += 2
+        else:
+            zone = arguments[index].rstrip('.')
+            index += 1
+    now = int(time.time())
+    directory = options.get('-K', '.')
+    prepublish = int(options.get('-i', 0))
+    if '-S' in options:
+        with open(options['-S']) as filedesc:
+            predecessor = filedesc.read()
+        zone = re.search(r'for (\S+?)\.?\n', predecessor).group(1)
+        rdata = dnskey_rdata(predecessor)
+        ksk = rdata[1] & 1
+        algorithm = rdata[3]
+        bits = public_key_bits(rdata)
+        activate = parse_time(re.search(
+            r'^; Inactive: (\d{14})', predecessor, re.M).group(1), now)
+    else:
+        ksk = options.get('-f') == 'KSK'
+        algorithm = options.get('-a', ALGORITHM_NAME)
+        algorithm = int(algorithm) if algorithm.isdigit() \
+            else ALGORITHMS[algorithm.upper()]
+        bits = int(options.get('-b', RSA_BITS))
+        activate = parse_time(options.get('-A', '+0'), now)
+    timing = {'Created': now}
+    if '-G' not in options:
+        timing['Publish'] = parse_time(options['-P'], now) \
+            if '-P' in options else activate - prepublish
+        timing['Activate'] = activate
+    print(write_key(directory, zone, ksk, timing, algorithm, bits=bits))
+
+def stub_settime(arguments):
+    '''dnssec-settime for absolute times and none'''
+    keyfile = arguments[-1]
+    changes = dict(
+        (SETTIME_TAGS[x], y) for x, y in zip(arguments, arguments[1:])
+        if x in SETTIME_TAGS)
+    for path, prefix in ((keyfile, '; '),
+                         (keyfile[:-4] + '.private', '')):
+        with open(path) as filedesc:
+            lines = [x for x in filedesc
+                     if not any(x.startswith(prefix + y + ':')
+                                for y in changes)]
+        for tag, value in changes.items():
+            if value != 'none':
+                timestamp = calendar.timegm(
+                    time.strptime(value, '%Y%m%d%H%M%S'))
+                lines.insert(-1 if prefix else len(lines),
+                             prefix + tag + ': ' +
+                             (format_time(timestamp) if prefix else value) +
+                             '\n')
+        with open(path, 'w') as filedesc:
+            filedesc.write(''.join(lines))
+
+def stub_dsfromkey(arguments):
+    '''dnssec-dsfromkey printing SHA-1 and SHA-256 DS records'''
+    with open(arguments[-1]) as filedesc:
+        content = filedesc.read()
+    zone = re.search(r'^(\S+)\s+IN\s+DNSKEY', content, re.M).group(1)
+    digest_types = [int(x[1:]) for x in arguments[:-1] if x[1:].isdigit()]
+    for record in ds_records(
+            zone.rstrip('.'), dnskey_rdata(content), digest_types or (1, 2)):
+        print(zone + ' IN ' + record)
+
+def stub_sendmail(_arguments):
+    '''sendmail discarding the message'''
+    sys.stdin.read()
+
+STUBS = {
+    'dig': stub_dig,
+    'dnssec-keygen': stub_keygen,
+    'dnssec-settime': stub_settime,
+    'dnssec-dsfromkey': stub_dsfromkey,
+    'sendmail': stub_sendmail
+}
+
+def run_stub(tool, arguments):
+    '''Log the call, wait the configured latency and act as tool'''
+    log = os.environ.get('BENCH_CALL_LOG')
+    if log:
+        descriptor = os.open(log, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+        os.write(descriptor, (tool + '\n').encode('ascii'))
+        os.close(descriptor)
+    latency = os.environ.get(
+        'BENCH_LATENCY_' + tool.upper().replace('-', '_'),
+        os.environ.get('BENCH_LATENCY'))
+    if latency:
+        time.sleep(float(latency))
+    STUBS[tool](arguments)
+
+STUB_TEMPLATE = '''#!{python}
+import sys
+sys.path.insert(0, {directory!r})
+from bench_suite import run_stub
+run_stub({tool!r}, sys.argv[1:])
+'''
+
+def install_stubs(bin_directory):
+    '''Write the stub tools into bin_directory'''
+    os.makedirs(bin_directory, exist_ok=True)
+    for tool in STUB_TOOLS:
+        path = os.path.join(bin_directory, tool)
+        with open(path, 'w') as filedesc:
+            filedesc.write(STUB_TEMPLATE.format(
+                python=sys.executable, directory=BENCH_DIRECTORY, tool=tool))
+        os.chmod(path, 0o755)
+
+# stand-in authoritative servers
+
+RR_TYPES = {'A': 1, 'NS': 2, 'SOA': 6, 'DS': 43}
+
+def encode_rdata(rtype, rdata):
+    '''Wire format of RDATA in presentation format'''
+    if rtype == 'A':
+        return socket.inet_aton(rdata)
+    if rtype == 'NS':
+        return name_wire(rdata)
+    if rtype == 'SOA':
+        fields = rdata.split()
+        return name_wire(fields[0]) + name_wire(fields[1]) + \
+            struct.pack('!IIIII', *[int(x) for x in fields[2:]])
+    fields = rdata.split()
+    return struct.pack('!HBB', *[int(x) for x in fields[:3]]) + \
+        bytes.fromhex(fields[3])
+
+class StandInServers:
+    '''UDP servers on loopback addresses sharing one port: the root
+    delegating example., example. delegating bench.example. and
+    bench.example. delegating the generated zones with their DS records
+    to the last address, which serves their SOA records'''
+    addresses = ('127.0.0.1', '127.0.0.2', '127.0.0.3', '127.0.0.4')
+    ttl = 3600
+
+    def __init__(self, workdir):
+        self.zones = dict((x, {}) for x in self.addresses)
+        self.add_zone(0, '.', ['example.'])
+        self.add_zone(1, 'example.', ['bench.example.'])
+        with open(os.path.join(workdir, 'zones.txt')) as filedesc:
+            children = [x.split()[0] + '.' for x in filedesc]
+        self.add_zone(2, 'bench.example.', children)
+        for child in children:
+            self.add_zone(3, child, [])
+            try:
+                with open(os.path.join(
+                        workdir, 'answers',
+                        child.rstrip('.') + '.ds')) as filedesc:
+                    self.zones[self.addresses[2]]['bench.example.'][
+                        (child, 'DS')] = [
+                            ' '.join(x.split()[4:]) for x in filedesc]
+            except OSError:
+                pass
+        self.counts = dict((x, 0) for x in self.addresses)
+        self.sockets = []
+        self.port = 0
+        for address in self.addresses:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind((address, self.port))
+            sock.settimeout(0.1)
+            self.port = sock.getsockname()[1]
+            self.sockets.append((address, sock))
+        self.stopped = threading.Event()
+        self.threads = [
+            threading.Thread(target=self.serve, args=x, daemon=True)
+            for x in self.sockets]
+        for thread in self.threads:
+            thread.start()
+    def add_zone(self, index, origin, children):
+        '''Zone at address number index with SOA, NS and glue records,
+        delegating children to the next address'''
+        nsname = 'ns.' + origin.lstrip('.')
+        records = {
+            (origin, 'SOA'): ['{0} hostmaster.{1} 1 {2} {3} {4} 3600'.format(
+                nsname, origin.lstrip('.'), *SOA_TIMERS)],
+            (origin, 'NS'): [nsname],
+            (nsname, 'A'): [self.addresses[index]]
+        }
+        for child in children:
+            records[(child, 'NS')] = ['ns.' + child]
+            records[('ns.' + child, 'A')] = [self.addresses[index + 1]]
+        self.zones[self.addresses[index]][origin] = records
+    @property
+    def queries(self):
+        '''Number of queries received since the last reset'''
+        return sum(self.counts.values())
+    def reset(self):
+        for address in self.addresses:
+            self.counts[address] = 0
+    def serve(self, address, sock):
+        while not self.stopped.is_set():
+            try:
+                query, client = sock.recvfrom(65535)
+            except socket.timeout:
+                continue
+            self.counts[address] += 1
+            response = self.respond(address, query)
+            if response:
+                sock.sendto(response, client)
+    def respond(self, address, query):
+        '''Authoritative answer, referral or REFUSED, None for
+        unparseable queries'''
+        try:
+            msgid = struct.unpack_from('!H', query)[0]
+            labels = []
+            offset = 12
+            while query[offset]:
+                labels.append(query[offset + 1:offset + 1 + query[offset]]
+                              .decode('ascii').lower())
+                offset += query[offset] + 1
+            rtype_number = struct.unpack_from('!H', query, offset + 1)[0]
+        except (IndexError, struct.error, UnicodeDecodeError):
+            return
+        question = query[12:offset + 5]
+        names = ['.'.join(labels[x:]) + '.' for x in range(len(labels))] + \
+            ['.']
+        rtype = dict((y, x) for x, y in RR_TYPES.items()).get(rtype_number)
+        zones = self.zones[address]
+        # DS records are served by the parent zone
+        origins = [x for x in names if x in zones and
+                   not (rtype == 'DS' and x == names[0])]
+        if not origins:
+            return struct.pack('!HHHHHH', msgid, 0x8005, 1, 0, 0, 0) + \
+                question
+        origin = origins[0]
+        records = zones[origin]
+        for name in reversed(names[:names.index(origin)]):
+            if (name, 'NS') in records and \
+                    not (rtype == 'DS' and name == names[0]):
+                nsnames = records[(name, 'NS')]
+                return self.message(
+                    msgid, question, False, [],
+                    [(name, 'NS', x) for x in nsnames],
+                    [(x, 'A', y) for x in nsnames
+                     for y in records.get((x, 'A'), ())])
+        answer = [(names[0], rtype, x)
+                  for x in records.get((names[0], rtype), ())]
+        return self.message(
+            msgid, question, True, answer,
+            [] if answer else
+            [(origin, 'SOA', x) for x in records[(origin, 'SOA')]], [])
+    def message(self, msgid, question, authoritative, answer, authority,
+                additional):
+        '''Response of (name, type, rdata) records'''
+        wire = struct.pack(
+            '!HHHHHH', msgid, 0x8400 if authoritative else 0x8000, 1,
+            len(answer), len(authority), len(additional)) + question
+        for name, rtype, rdata in answer + authority + additional:
+            encoded = encode_rdata(rtype, rdata)
+            wire += name_wire(name) + struct.pack(
+                '!HHIH', RR_TYPES[rtype], 1, self.ttl, len(encoded)) + \
+                encoded
+        return wire
+    def close(self):
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join()
+        for _address, sock in self.sockets:
+            sock.close()
+
+# stages, run in a process of their own
+
+def read_zones(workdir, keys_directory, algorithm = None, bits = None):
+    '''(zone, directory, algorithm, bits) of the generated zone list,
+    algorithm and bits replace those of the list if given'''
+    with open(os.path.join(workdir, 'zones.txt')) as filedesc:
+        return [(x[0], os.path.join(keys_directory, x[1]),
+                 algorithm or x[2], bits)
+                for x in (y.split() for y in filedesc)]
+
+def stage_getkeys(tool, _workdir, zones, _jobs):
+    '''Load the keys of all zones'''
+    return {'keys': sum(len(tool.getkeys(x[1], x[0])) for x in zones)}
+
+def rollover(tool, zones, jobs):
+    '''ZSK and KSK rollovers of zones through DNSSECKey.resolver,
+    notifications through sendmail'''
+    user = __import__('pwd').getpwuid(os.getuid()).pw_name
+    tool.DNSSECKey.ds_cache = tool.DSCache()
+    tool.Notifier.sendmail = shutil.which('sendmail')
+    tool.DNSSECRollover.notifier = tool.Notifier(None, None)
+    args = argparse.Namespace(
+        zskroll=[ZSK_INTERVAL, RESIGN_INTERVAL],
+        kskroll=[KSK_INTERVAL, RESIGN_INTERVAL],
+        email=('bench@localhost', 'hostmaster@localhost'),
+        owner=user,
+        enrich=set(),
+        format='text',
+        listing=False,
+        selection=None,
+        jobs=jobs)
+    reports = tool.process_zones(
+        args, zones,
+        dict((x[0], tool.ZoneContext(x[0], tool.DNSSECKey.resolver, *x[2:]))
+             for x in zones),
+        tool.datetime.now())
+    tool.DNSSECRollover.notifier.flush([x[0] for x in zones])
+    return {'keys': sum(x.keys or 0 for x in reports),
+            'errors': sum(1 for x in reports if x.error)}
+
+def stage_rollover(tool, _workdir, zones, jobs):
+    '''ZSK and KSK rollovers of all zones through the dig resolver'''
+    tool.DNSSECKey.resolver = tool.DigResolver()
+    return rollover(tool, zones, jobs)
+
+def native_resolver(tool, workdir):
+    '''Native resolver asking the stand-in servers, with the answer cache
+    in the state directory'''
+    resolver = tool.DNSResolver(
+        StandInServers.addresses[:1], int(os.environ['BENCH_DNS_PORT']))
+    state_directory = os.path.join(workdir, 'state')
+    os.makedirs(state_directory, exist_ok=True)
+    resolver.answer_cache = tool.AnswerCache(
+        os.path.join(state_directory, 'dns-cache.sqlite'))
+    return resolver
+
+def stage_native(tool, workdir, zones, jobs):
+    '''ZSK and KSK rollovers of all zones through the native resolver'''
+    tool.DNSSECKey.resolver = native_resolver(tool, workdir)
+    return rollover(tool, zones, jobs)
+
+def stage_print(tool, _workdir, zones, jobs):
+    '''Text listing of all zones sorted by publish time with locally
+    computed DS records'''
+    args = argparse.Namespace(
+        zskroll=None,
+        kskroll=None,
+        enrich={'ds'},
+        format='text',
+        listing=True,
+        selection=tool.KeySelection(
+            [('publish', False), ('type', False), ('status', False)]),
+        jobs=jobs)
+    reports = tool.process_zones(
+        args, zones,
+        dict((x[0], tool.ZoneContext(x[0], None, *x[2:])) for x in zones),
+        tool.datetime.now())
+    return {'errors': sum(1 for x in reports if x.error)}
+
+STAGES = {
+    'getkeys': stage_getkeys,
+    'rollover': stage_rollover,
+    'native': stage_native,
+    'cached': stage_native,
+    'print': stage_print
+}
+# stages changing the keys, run on a copy
+ROLLOVER_STAGES = ('rollover', 'native', 'cached')
+# stages asking the stand-in servers
+DNS_STAGES = ('native', 'cached')
+
+def run_stage(stage, workdir, keys_directory, jobs, algorithm, bits):
+    '''Run stage in this process, print its measurements as JSON'''
+    import resource
+    sys.path.insert(0, TOOL_DIRECTORY)
+    import dnssec_rollover_tool
+    zones = read_zones(workdir, keys_directory, algorithm, bits)
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        start = time.perf_counter()
+        try:
+            result = STAGES[stage](
+                dnssec_rollover_tool, workdir, zones, jobs)
+        finally:
+            seconds = time.perf_counter() - start
+            sys.stdout = stdout
+    result.update(
+        seconds=seconds,
+        start_rss_kb=start_rss,
+        max_rss_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+    print(json.dumps(result))
+
+def measure(stage, workdir, jobs, environment, algorithm = None,
+            bits = None, servers = None):
+    '''Run stage in a child process on a copy of the keys if it changes
+    them, return its measurements with the subprocess counts and the
+    queries to the stand-in servers, whose port is in the environment.
+    The native stage starts with an empty answer cache, the cached stage
+    with the one of the native stage, which is run first if it has not
+    been.'''
+    state_directory = os.path.join(workdir, 'state')
+    if stage == 'native':
+        shutil.rmtree(state_directory, ignore_errors=True)
+    elif stage == 'cached' and not os.path.isdir(state_directory):
+        measure('native', workdir, jobs, environment, algorithm, bits,
+                servers)
+    keys_directory = os.path.join(workdir, 'keys')
+    if stage in ROLLOVER_STAGES:
+        keys_directory = os.path.join(workdir, 'rollover-keys')
+        shutil.rmtree(keys_directory, ignore_errors=True)
+        shutil.copytree(os.path.join(workdir, 'keys'), keys_directory)
+    if servers:
+        servers.reset()
+    call_log = environment['BENCH_CALL_LOG']
+    open(call_log, 'w').close()
+    command = [sys.executable, os.path.abspath(__file__),
+               '--stage', stage, '--workdir', workdir,
+               '--keys', keys_directory, '--jobs', str(jobs)]
+    if algorithm:
+        command += ['--algorithm', algorithm]
+    if bits:
+        command += ['--bits', str(bits)]
+    try:
+        output = subprocess.check_output(command, env=environment)
+    finally:
+        if stage in ROLLOVER_STAGES:
+            shutil.rmtree(keys_directory, ignore_errors=True)
+    result = json.loads(output.decode('utf-8').strip().split('\n')[-1])
+    with open(call_log) as filedesc:
+        calls = Counter(x.strip() for x in filedesc)
+    result['subprocesses'] = dict((x, calls.get(x, 0)) for x in STUB_TOOLS)
+    if stage in DNS_STAGES:
+        result['queries'] = servers.queries
+    return result
+
+def git_commit():
+    '''Commit of the tool tree, None if unknown'''
+    try:
+        return subprocess.check_output(
+            ['git', '-C', TOOL_DIRECTORY, 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def previous_result(results, parameters):
+    '''Last stored result of a run with the same parameters'''
+    previous = None
+    try:
+        with open(results) as filedesc:
+            for line in filedesc:
+                result = json.loads(line)
+                if result['parameters'] == parameters:
+                    previous = result
+    except (OSError, ValueError):
+        pass
+    return previous
+
+def change(current, previous):
+    '''Relative change in percent'''
+    if not previous:
+        return 0.0 if not current else float('inf')
+    return (current - previous) * 100.0 / previous
+
+def report(stages, previous, threshold):
+    '''Print measurements next to the previous run, return the list of
+    regressions beyond threshold percent'''
+    regressions = []
+    for stage, result in stages.items():
+        before = previous['stages'].get(stage) if previous else None
+        line = '{0:9} {1:10.3f}s {2:8.1f} MiB'.format(
+            stage, result['seconds'], result['max_rss_kb'] / 1024.0)
+        for counter in ('keys', 'errors', 'queries'):
+            if counter in result:
+                line += '  {0} {1}'.format(counter, result[counter])
+        if before:
+            line += '  time {0:+.1f}%  memory {1:+.1f}%'.format(
+                change(result['seconds'], before['seconds']),
+                change(result['max_rss_kb'], before['max_rss_kb']))
+            for metric in ('seconds', 'max_rss_kb'):
+                if change(result[metric], before[metric]) > threshold:
+                    regressions.append(stage + ' ' + metric)
+            for tool, count in result['subprocesses'].items():
+                if count > before['subprocesses'].get(tool, 0):
+                    regressions.append(stage + ' ' + tool + ' calls')
+            if result.get('queries', 0) > before.get('queries', 0):
+                regressions.append(stage + ' queries')
+        print(line)
+        calls = ', '.join('{0} {1}'.format(x, y)
+                          for x, y in result['subprocesses'].items() if y)
+        print('{0:9} subprocesses: {1}'.format('', calls or 'none'))
+    return regressions
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(
+        description='Benchmark getkeys, rollovers and the key listing '
+        'on synthetic key directories with stub BIND tools')
+    argparser.add_argument(
+        '-z',
+        '--zones',
+        help='Number of zones to generate.',
+        type=int,
+        default=1000
+    )
+    argparser.add_argument(
+        '--zones-per-dir',
+        help='Number of zones per key directory.',
+        type=int,
+        default=1000
+    )
+    argparser.add_argument(
+        '--history',
+        help='Maximum number of retired keys per zone and key type, '
+        'zones get a random number up to it.',
+        type=int,
+        default=3
+    )
+    argparser.add_argument(
+        '--due',
+        help='Fraction of zones whose keys are due for rollover.',
+        type=float,
+        default=0.1
+    )
+    argparser.add_argument(
+        '--seed',
+        help='Seed of the key history generator.',
+        type=int,
+        default=1
+    )
+    argparser.add_argument(
+        '--latency',
+        help='Seconds every stub tool call takes.',
+        type=float,
+        default=0.0
+    )
+    argparser.add_argument(
+        '--tool-latency',
+        help='Latency of a single stub tool as tool=seconds, '
+        'e.g. dig=0.05. May be given multiple times.',
+        type=str,
+        action='append',
+        default=[]
+    )
+    argparser.add_argument(
+        '-a',
+        '--algorithm',
+        help='Algorithm of the zone list, the generated keys are '
+        + ALGORITHM_NAME + ', another one starts algorithm rollovers.',
+        type=str.upper,
+        choices=list(ALGORITHMS)
+    )
+    argparser.add_argument(
+        '-b',
+        '--bits',
+        help='Key size of the zone list for RSA algorithms.',
+        type=int
+    )
+    argparser.add_argument(
+        '-j',
+        '--jobs',
+        help='Number of zones processed concurrently.',
+        type=int,
+        default=1
+    )
+    argparser.add_argument(
+        '-s',
+        '--stages',
+        help='Comma separated stages to run.',
+        type=str,
+        default=','.join(STAGES)
+    )
+    argparser.add_argument(
+        '-w',
+        '--workdir',
+        help='Directory for the generated tree, reused by later runs '
+        'with the same generator parameters. '
+        'A temporary directory by default.',
+        type=str
+    )
+    argparser.add_argument(
+        '-r',
+        '--results',
+        help='JSON lines file the results are appended to.',
+        type=str,
+        default=os.path.join(BENCH_DIRECTORY, 'results.jsonl')
+    )
+    argparser.add_argument(
+        '--threshold',
+        help='Percentage of time or memory growth over the last run with '
+        'the same parameters reported as regression, any growth of '
+        'subprocess calls or DNS queries is.',
+        type=float,
+        default=10.0
+    )
+    argparser.add_argument(
+        '--stage',
+        help=argparse.SUPPRESS,
+        choices=list(STAGES)
+    )
+    argparser.add_argument(
+        '--keys',
+        help=argparse.SUPPRESS
+    )
+    args = argparser.parse_args()
+
+    if args.stage:
+        run_stage(args.stage, args.workdir, args.keys, args.jobs,
+                  args.algorithm, args.bits)
+        sys.exit()
+
+    stages = args.stages.split(',')
+    for stage in stages:
+        if stage not in STAGES:
+            argparser.error('unknown stage ' + stage)
+    latencies = {}
+    for tool_latency in args.tool_latency:
+        tool, _, seconds = tool_latency.partition('=')
+        if tool not in STUB_TOOLS:
+            argparser.error('unknown tool ' + tool)
+        latencies[tool] = float(seconds)
+    generator = dict(
+        zones=args.zones,
+        zones_per_dir=args.zones_per_dir,
+        history=args.history,
+        due=args.due,
+        seed=args.seed)
+    parameters = dict(
+        generator,
+        latency=args.latency,
+        tool_latency=latencies,
+        algorithm=args.algorithm,
+        bits=args.bits,
+        jobs=args.jobs)
+
+    temporary = None
+    workdir = args.workdir
+    if not workdir:
+        temporary = tempfile.TemporaryDirectory()
+        workdir = temporary.name
+    workdir = os.path.abspath(workdir)
+    generator_file = os.path.join(workdir, 'generator.json')
+    try:
+        with open(generator_file) as filedesc:
+            generated = json.load(filedesc) == generator
+    except (OSError, ValueError):
+        generated = False
+    if not generated:
+        for name in ('keys', 'answers', 'zones.txt', 'generator.json'):
+            path = os.path.join(workdir, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.remove(path)
+        start = time.perf_counter()
+        keys = generate(workdir, args.zones, args.zones_per_dir,
+                        args.history, args.due, args.seed)
+        with open(generator_file, 'w') as filedesc:
+            json.dump(generator, filedesc)
+        print('generated {0} keys of {1} zones in {2:.1f}s'.format(
+            keys, args.zones, time.perf_counter() - start))
+    install_stubs(os.path.join(workdir, 'bin'))
+
+    environment = dict(os.environ)
+    environment['PATH'] = os.path.join(workdir, 'bin') + os.pathsep + \
+        environment.get('PATH', '')
+    environment['BENCH_WORKDIR'] = workdir
+    environment['BENCH_CALL_LOG'] = os.path.join(workdir, 'calls.log')
+    environment['BENCH_LATENCY'] = str(args.latency)
+    for tool, seconds in latencies.items():
+        environment['BENCH_LATENCY_' + tool.upper().replace('-', '_')] = \
+            str(seconds)
+
+    servers = None
+    if set(stages) & set(DNS_STAGES):
+        servers = StandInServers(workdir)
+        environment['BENCH_DNS_PORT'] = str(servers.port)
+
+    results = {}
+    shutil.rmtree(os.path.join(workdir, 'state'), ignore_errors=True)
+    try:
+        for stage in stages:
+            results[stage] = measure(stage, workdir, args.jobs, environment,
+                                     args.algorithm, args.bits, servers)
+    finally:
+        if servers:
+            servers.close()
+        if temporary:
+            temporary.cleanup()
+
+    previous = previous_result(args.results, parameters)
+    regressions = report(results, previous, args.threshold)
+    with open(args.results, 'a') as filedesc:
+        filedesc.write(json.dumps({
+            'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'commit': git_commit(),
+            'python': sys.version.split()[0],
+            'parameters': parameters,
+            'stages': results
+        }) + '\n')
+    if regressions:
+        print('regressions: ' + ', '.join(regressions))
+        sys.exit(1)
@@ -19,11 +19,34 @@ __version__    = '1.0'
 
 import sys
 import argparse
+from array import array
+import asyncio
+import csv
+import ctypes
+import ctypes.util
 import errno
+import fcntl
+import hashlib
+import heapq
+import json
 import os
+import random
 import re
+import select
+import signal
+import smtplib
+import socket
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+import weakref
 from pathlib import Path
 from datetime import datetime, timedelta
+import base64
+import binascii
+import calendar
 import locale
 from subprocess import (
     call,
@@ -33,23 +56,951 @@ from subprocess import (
     DEVNULL,
     CalledProcessError
 )
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.text import MIMEText
 from pwd import getpwnam
 
+ROOT_HINTS = [
+    '198.41.0.4',
+    '170.247.170.2',
+    '192.33.4.12',
+    '199.7.91.13',
+    '192.203.230.10',
+    '192.5.5.241',
+    '192.112.36.4',
+    '198.97.190.53',
+    '192.36.148.17',
+    '192.58.128.30',
+    '193.0.14.129',
+    '199.7.83.42',
+    '202.12.27.33'
+]
+
+RR_TYPES = {
+    'A': 1,
+    'NS': 2,
+    'CNAME': 5,
+    'SOA': 6,
+    'AAAA': 28,
+    'OPT': 41,
+    'DS': 43,
+    'DNSKEY': 48
+}
+RR_TYPE_NAMES = dict((value, key) for key, value in RR_TYPES.items())
+
+RCODE_NOERROR  = 0
+RCODE_FORMERR  = 1
+RCODE_NXDOMAIN = 3
+
+class DNSError(Exception):
+    '''DNS lookup failed'''
+
+class DNSRecord:
+    '''Resource record in presentation format'''
+    name  = None
+    ttl   = None
+    rtype = None
+    rdata = None
+
+    def __init__(self, name, ttl, rtype, rdata):
+        self.name = name
+        self.ttl = ttl
+        self.rtype = rtype
+        self.rdata = rdata
+    def fields(self):
+        '''Return RDATA fields'''
+        return self.rdata.split()
+    def __str__(self):
+        '''Return record like dig +nosplit prints it'''
+        return '{0.name} {0.ttl} IN {0.rtype} {0.rdata}'.format(self)
+
+class DNSMessage:
+    '''Decoded DNS message'''
+    msgid      = None
+    flags      = 0
+    question   = None
+    answer     = []
+    authority  = []
+    additional = []
+
+    def __init__(self, wire):
+        self.wire = wire
+        (self.msgid, self.flags, qdcount, ancount,
+            nscount, arcount) = struct.unpack_from('!HHHHHH', wire)
+        offset = 12
+        for _ in range(qdcount):
+            qname, offset = self.read_name(wire, offset)
+            qtype = struct.unpack_from('!H', wire, offset)[0]
+            offset += 4
+            self.question = (qname, RR_TYPE_NAMES.get(qtype, str(qtype)))
+        self.answer, offset = self._read_records(wire, offset, ancount)
+        self.authority, offset = self._read_records(wire, offset, nscount)
+        self.additional, offset = self._read_records(wire, offset, arcount)
+    @property
+    def rcode(self):
+        return self.flags & 0x000f
+    @property
+    def authoritative(self):
+        return bool(self.flags & 0x0400)
+    @property
+    def truncated(self):
+        return bool(self.flags & 0x0200)
+    def min_ttl(self):
+        '''Return lowest TTL of the message, negative caching TTL
+        of the SOA record for empty responses (RFC 2308)'''
+        ttls = [
+            x.ttl for x in self.answer + self.authority + self.additional
+        ]
+        ttls += [
+            int(x.fields()[-1]) for x in self.authority if x.rtype == 'SOA'
+        ]
+        if ttls:
+            return min(ttls)
+    @staticmethod
+    def read_name(wire, offset):
+        '''Read a possibly compressed domain name, return name and offset
+        behind it'''
+        labels = []
+        end = None
+        jumps = 0
+        while True:
+            length = wire[offset]
+            if length & 0xc0 == 0xc0:
+                if end is None:
+                    end = offset + 2
+                jumps += 1
+                if jumps > 63:
+                    raise DNSError('Compression loop in DNS message')
+                offset = struct.unpack_from('!H', wire, offset)[0] & 0x3fff
+                continue
+            offset += 1
+            if not length:
+                break
+            labels.append(wire[offset:offset + length].decode('ascii'))
+            offset += length
+        return '.'.join(labels) + '.', end if end is not None else offset
+    def _read_records(self, wire, offset, count):
+        records = []
+        for _ in range(count):
+            name, offset = self.read_name(wire, offset)
+            rtype, _rclass, ttl, rdlength = struct.unpack_from(
+                '!HHIH', wire, offset)
+            offset += 10
+            if rtype != RR_TYPES['OPT']:
+                records.append(DNSRecord(
+                    name,
+                    ttl,
+                    RR_TYPE_NAMES.get(rtype, 'TYPE' + str(rtype)),
+                    self._read_rdata(wire, offset, rtype, rdlength)))
+            offset += rdlength
+        return records, offset
+    def _read_rdata(self, wire, offset, rtype, rdlength):
+        rdata = wire[offset:offset + rdlength]
+        if rtype == RR_TYPES['A']:
+            return socket.inet_ntop(socket.AF_INET, rdata)
+        if rtype == RR_TYPES['AAAA']:
+            return socket.inet_ntop(socket.AF_INET6, rdata)
+        if rtype in (RR_TYPES['NS'], RR_TYPES['CNAME']):
+            return self.read_name(wire, offset)[0]
+        if rtype == RR_TYPES['SOA']:
+            mname, soa_offset = self.read_name(wire, offset)
+            rname, soa_offset = self.read_name(wire, soa_offset)
+            return ' '.join([mname, rname] + [
+                str(x) for x in struct.unpack_from('!IIIII', wire, soa_offset)
+            ])
+        if rtype == RR_TYPES['DS']:
+            keytag, algorithm, digest_type = struct.unpack_from(
+                '!HBB', rdata)
+            return '{0} {1} {2} {3}'.format(
+                keytag, algorithm, digest_type, rdata[4:].hex().upper())
+        return '\\# {0} {1}'.format(rdlength, rdata.hex().upper())
+
+def encode_name(name):
+    '''Encode domain name in wire format'''
+    wire = b''
+    for label in name.rstrip('.').split('.'):
+        if label:
+            wire += bytes([len(label)]) + label.encode('ascii')
+    return wire + b'\0'
+
+def make_query(name, rtype, edns = True):
+    '''Build a non-recursive query, return message id and wire data'''
+    msgid = random.getrandbits(16)
+    wire = struct.pack('!HHHHHH', msgid, 0, 1, 0, 0, 1 if edns else 0)
+    wire += encode_name(name) + struct.pack('!HH', RR_TYPES[rtype], 1)
+    if edns:
+        wire += b'\0' + struct.pack(
+            '!HHIH', RR_TYPES['OPT'], DNSResolver.udp_payload, 0, 0)
+    return msgid, wire
+
+def parent_names(name):
+    '''Return name and all its ancestors, closest first'''
+    labels = [x for x in name.split('.') if x]
+    return ['.'.join(labels[x:]) + '.' for x in range(len(labels))] + ['.']
+
+def is_subdomain(name, zone):
+    '''Check whether name is equal to or below zone'''
+    return zone == '.' or name == zone or name.endswith('.' + zone)
+
+class DatagramQuery(asyncio.DatagramProtocol):
+    '''Wait for the UDP response to a query'''
+    def __init__(self, msgid):
+        self.msgid = msgid
+        self.response = asyncio.get_running_loop().create_future()
+    def datagram_received(self, data, addr):
+        try:
+            response = DNSMessage(data)
+        except (IndexError, struct.error, UnicodeDecodeError, DNSError):
+            return
+        if response.msgid == self.msgid and not self.response.done():
+            self.response.set_result(response)
+    def error_received(self, exc):
+        if not self.response.done():
+            self.response.set_exception(exc)
+
+class DNSResolver:
+    '''Iterative resolver walking down from the root like dig +trace'''
+    timeout        = 3
+    udp_payload    = 1232
+    max_referrals  = 32
+    max_depth      = 4
+    retries        = 2
+    max_per_server = 8
+    answer_cache   = None
+
+    def __init__(self, nameservers = None, port = 53):
+        '''Start iterations at nameservers, root servers by default'''
+        self.nameservers = list(nameservers or ROOT_HINTS)
+        self.port = port
+        self.delegations = {}
+        self.server_slots = weakref.WeakKeyDictionary()
+    def query(self, name, rtype):
+        '''Return answer records, empty list if name or type does not
+        exist. Raise DNSError if no server gave a usable response.'''
+        iteration = self._iterate(name, rtype)
+        response = None
+        try:
+            while True:
+                server, qname, qtype = iteration.send(response)
+                response = self._exchange(server, qname, qtype)
+        except StopIteration as stop:
+            return stop.value
+    async def query_async(self, name, rtype):
+        '''Coroutine version of query'''
+        iteration = self._iterate(name, rtype)
+        response = None
+        try:
+            while True:
+                server, qname, qtype = iteration.send(response)
+                response = await self._exchange_async(server, qname, qtype)
+        except StopIteration as stop:
+            return stop.value
+    def _iterate(self, name, rtype, depth = 0):
+        '''Resolution state machine. Yields (server, name, type) to query
+        and expects the DNSMessage received or None in return.'''
+        name = name.lower()
+        if not name.endswith('.'):
+            name += '.'
+        zone, servers = self._closest_delegation(name, rtype)
+        for _ in range(self.max_referrals):
+            referral = None
+            for server in servers:
+                response = yield server, name, rtype
+                if response is None or response.rcode not in (
+                        RCODE_NOERROR, RCODE_NXDOMAIN):
+                    continue
+                if response.rcode == RCODE_NXDOMAIN:
+                    return []
+                answer = [
+                    x for x in response.answer
+                    if x.name.lower() == name and x.rtype == rtype
+                ]
+                if answer:
+                    return answer
+                referral = self._referral(response, name, rtype, zone)
+                if referral:
+                    break
+                if response.authoritative:
+                    return []
+            else:
+                raise DNSError(
+                    'No usable answer from servers of ' + zone +
+                    ' for ' + name + ' ' + rtype)
+            zone, nsnames, addresses = referral
+            if not addresses:
+                if depth >= self.max_depth:
+                    raise DNSError('Too deep glueless delegation at ' + zone)
+                addresses = yield from self._nameserver_addresses(
+                    nsnames, depth + 1)
+                if not addresses:
+                    raise DNSError('Unable to resolve nameservers of ' + zone)
+            self.delegations[zone] = addresses
+            servers = addresses
+        raise DNSError('Too many referrals for ' + name + ' ' + rtype)
+    def _nameserver_addresses(self, nsnames, depth):
+        '''Resolve addresses of the first resolvable nameserver, IPv6
+        only if it has no IPv4 address'''
+        for nsname in nsnames:
+            for rtype in ('A', 'AAAA'):
+                try:
+                    nsaddresses = yield from self._iterate(
+                        nsname, rtype, depth)
+                except DNSError:
+                    continue
+                if nsaddresses:
+                    return [x.rdata for x in nsaddresses]
+        return []
+    def _closest_delegation(self, name, rtype):
+        '''Return closest known zone cut, DS is asked at the parent'''
+        for zone in parent_names(name):
+            if rtype == 'DS' and zone == name:
+                continue
+            if zone in self.delegations:
+                return zone, self.delegations[zone]
+        return '.', self.nameservers
+    @staticmethod
+    def _referral(response, name, rtype, zone):
+        '''Return (zone cut, NS names, glue addresses) of a downward
+        referral in response'''
+        cut = None
+        nsnames = []
+        for record in response.authority:
+            owner = record.name.lower()
+            if record.rtype != 'NS' or owner == zone or \
+                    not is_subdomain(owner, zone) or \
+                    not is_subdomain(name, owner) or \
+                    (rtype == 'DS' and owner == name):
+                continue
+            if cut is None:
+                cut = owner
+            if owner == cut:
+                nsnames.append(record.rdata.lower())
+        if cut is None:
+            return
+        glue = [
+            x for x in response.additional
+            if x.rtype in ('A', 'AAAA') and x.name.lower() in nsnames
+        ]
+        # IPv4 first, IPv6 servers are tried if those fail
+        addresses = [x.rdata for x in glue if x.rtype == 'A'] + \
+            [x.rdata for x in glue if x.rtype == 'AAAA']
+        return cut, nsnames, addresses
+    def _exchange(self, server, name, rtype):
+        '''Query server, return DNSMessage or None'''
+        response = self._cached(server, name, rtype)
+        if response is None:
+            response = self._exchange_network(server, name, rtype)
+            self._cache(server, name, rtype, response)
+        return response
+    async def _exchange_async(self, server, name, rtype):
+        '''Coroutine version of _exchange'''
+        response = self._cached(server, name, rtype)
+        if response is None:
+            response = await self._exchange_network_async(
+                server, name, rtype)
+            self._cache(server, name, rtype, response)
+        return response
+    def _cached(self, server, name, rtype):
+        if self.answer_cache:
+            wire = self.answer_cache.get(
+                name, rtype, server + '#' + str(self.port))
+            if wire:
+                return DNSMessage(wire)
+    def _cache(self, server, name, rtype, response):
+        if self.answer_cache and response and response.rcode in (
+                RCODE_NOERROR, RCODE_NXDOMAIN):
+            self.answer_cache.put(
+                name,
+                rtype,
+                server + '#' + str(self.port),
+                response.wire,
+                response.min_ttl())
+    def _exchange_network(self, server, name, rtype):
+        '''Query server over UDP with TCP fallback on truncation,
+        return DNSMessage or None'''
+        edns = True
+        while True:
+            msgid, wire = make_query(name, rtype, edns)
+            try:
+                response = self._exchange_udp(server, msgid, wire)
+                if response.truncated:
+                    response = self._exchange_tcp(server, msgid, wire)
+            except (OSError, IndexError, struct.error,
+                    UnicodeDecodeError, DNSError):
+                return
+            if response.rcode == RCODE_FORMERR and edns:
+                edns = False
+                continue
+            return response
+    async def _exchange_network_async(self, server, name, rtype):
+        '''Coroutine version of _exchange_network, retrying on timeouts
+        and limiting the queries in flight to a server'''
+        loop = asyncio.get_running_loop()
+        slots = self.server_slots.setdefault(loop, {})
+        if server not in slots:
+            slots[server] = asyncio.Semaphore(self.max_per_server)
+        async with slots[server]:
+            edns = True
+            attempts = 0
+            while attempts <= self.retries:
+                msgid, wire = make_query(name, rtype, edns)
+                try:
+                    response = await asyncio.wait_for(
+                        self._exchange_udp_async(server, msgid, wire),
+                        self.timeout)
+                    if response.truncated:
+                        response = await asyncio.wait_for(
+                            self._exchange_tcp_async(server, msgid, wire),
+                            self.timeout)
+                except asyncio.TimeoutError:
+                    attempts += 1
+                    continue
+                except (OSError, EOFError, IndexError, struct.error,
+                        UnicodeDecodeError, DNSError):
+                    return
+                if response.rcode == RCODE_FORMERR and edns:
+                    edns = False
+                    continue
+                return response
+    async def _exchange_udp_async(self, server, msgid, wire):
+        transport, protocol = \
+            await asyncio.get_running_loop().create_datagram_endpoint(
+                lambda: DatagramQuery(msgid),
+                remote_addr=(server, self.port))
+        try:
+            transport.sendto(wire)
+            return await protocol.response
+        finally:
+            transport.close()
+    async def _exchange_tcp_async(self, server, msgid, wire):
+        reader, writer = await asyncio.open_connection(server, self.port)
+        try:
+            writer.write(struct.pack('!H', len(wire)) + wire)
+            await writer.drain()
+            length = struct.unpack('!H', await reader.readexactly(2))[0]
+            response = DNSMessage(await reader.readexactly(length))
+            if response.msgid != msgid:
+                raise DNSError('Message id mismatch')
+            return response
+        finally:
+            writer.close()
+    def _exchange_udp(self, server, msgid, wire):
+        family = socket.AF_INET6 if ':' in server else socket.AF_INET
+        with socket.socket(family, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect((server, self.port))
+            sock.send(wire)
+            while True:
+                response = DNSMessage(sock.recv(65535))
+                if response.msgid == msgid:
+                    return response
+    def _exchange_tcp(self, server, msgid, wire):
+        with socket.create_connection(
+                (server, self.port), self.timeout) as sock:
+            sock.sendall(struct.pack('!H', len(wire)) + wire)
+            length = struct.unpack('!H', self._recv_exactly(sock, 2))[0]
+            response = DNSMessage(self._recv_exactly(sock, length))
+            if response.msgid != msgid:
+                raise DNSError('Message id mismatch')
+            return response
+    @staticmethod
+    def _recv_exactly(sock, length):
+        data = b''
+        while len(data) < length:
+            chunk = sock.recv(length - len(data))
+            if not chunk:
+                raise DNSError('Connection closed by server')
+            data += chunk
+        return data
+
+class DigResolver:
+    '''Legacy resolver running dig +trace. dig prints no SOA for empty
+    answers, they are cached for negative_ttl seconds.'''
+    answer_cache = None
+    negative_ttl = 900
+
+    def query(self, name, rtype):
+        '''Return answer records printed by dig +trace'''
+        if self.answer_cache:
+            dig = self.answer_cache.get(name, rtype, 'dig+trace')
+            if dig is not None:
+                return self._records(dig, rtype)
+        try:
+            dig = check_output(
+                [
+                    'dig',
+                    '+trace',
+                    '+noall',
+                    '+nodnssec',
+                    '+noidentify',
+                    '+ttlid',
+                    '+nosplit',
+                    '+answer',
+                    rtype.lower(),
+                    name
+                ],
+                stderr=DEVNULL)
+        except (CalledProcessError, OSError) as e:
+            raise DNSError('dig failed for ' + name + ' ' + rtype) from e
+        records = self._records(dig, rtype)
+        if self.answer_cache:
+            self.answer_cache.put(
+                name, rtype, 'dig+trace', dig,
+                min(x.ttl for x in records) if records
+                else self.negative_ttl)
+        return records
+    @staticmethod
+    def _records(dig, rtype):
+        records = []
+        for digline in dig.decode(
+                locale.getpreferredencoding(False)).strip().split('\n'):
+            fields = digline.split()
+            if len(fields) > 4 and fields[3] == rtype:
+                records.append(DNSRecord(
+                    fields[0], int(fields[1]), rtype, ' '.join(fields[4:])))
+        return records
+    async def query_async(self, name, rtype):
+        '''Run query in a worker thread'''
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.query, name, rtype)
+
+class AnswerCache:
+    '''Persistent DNS answer cache shared by runs, keyed by name, type
+    and server. Entries expire after their TTL or max_age seconds,
+    whatever comes first. Runs sharing the cache wait busy_timeout
+    seconds for each other, database errors count as cache misses.'''
+    busy_timeout = 10
+
+    def __init__(self, path, max_age = None):
+        self.path = path
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            path, timeout=self.busy_timeout, check_same_thread=False)
+        try:
+            with self.lock, self.connection:
+                self.connection.execute(
+                    'CREATE TABLE IF NOT EXISTS answers ('
+                    'name TEXT, type TEXT, server TEXT, expires REAL, '
+                    'response BLOB, PRIMARY KEY (name, type, server))')
+                self.connection.execute(
+                    'DELETE FROM answers WHERE expires < ?', (time.time(),))
+        except sqlite3.OperationalError:
+            pass
+    def get(self, name, rtype, server):
+        '''Return cached response or None'''
+        if self.max_age == 0:
+            return
+        try:
+            with self.lock:
+                row = self.connection.execute(
+                    'SELECT response FROM answers WHERE name = ? AND '
+                    'type = ? AND server = ? AND expires > ?',
+                    (name.lower(), rtype, server, time.time())).fetchone()
+        except sqlite3.Error:
+            return
+        if row:
+            return row[0]
+    def put(self, name, rtype, server, response, ttl):
+        '''Store response for ttl seconds'''
+        if ttl is None:
+            return
+        if self.max_age is not None:
+            ttl = min(ttl, self.max_age)
+        try:
+            with self.lock, self.connection:
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?)',
+                    (name.lower(), rtype, server, time.time() + ttl,
+                     response))
+        except sqlite3.Error:
+            pass
+
+def soa_params(records):
+    '''Return [refresh, retry, expire] of SOA records'''
+    for record in records:
+        fields = record.fields()
+        if len(fields) == 7:
+            return [int(x) for x in fields[3:6]]
+
+DS_DIGESTS = {
+    1: 'sha1',
+    2: 'sha256',
+    4: 'sha384'
+}
+
+def key_tag(rdata):
+    '''Calculate key tag of DNSKEY RDATA (RFC 4034 Appendix B)'''
+    if rdata[3] == 1:
+        return struct.unpack('!H', rdata[-3:-1])[0]
+    accumulator = 0
+    for index, octet in enumerate(rdata):
+        accumulator += octet if index & 1 else octet << 8
+    accumulator += (accumulator >> 16) & 0xffff
+    return accumulator & 0xffff
+
+DNSSEC_ALGORITHMS = {
+    5: 'RSASHA1',
+    7: 'NSEC3RSASHA1',
+    8: 'RSASHA256',
+    10: 'RSASHA512',
+    13: 'ECDSAP256SHA256',
+    14: 'ECDSAP384SHA384',
+    15: 'ED25519',
+    16: 'ED448'
+}
+
+FIXED_KEY_SIZES = {
+    'ECDSAP256SHA256': 256,
+    'ECDSAP384SHA384': 384,
+    'ED25519': 256,
+    'ED448': 456
+}
+
+def key_bits(algorithm, bits = None):
+    '''Key size of algorithm, bits defaults to 2048 for RSA'''
+    return FIXED_KEY_SIZES.get(algorithm, bits or 2048)
+
+def algorithm_arguments(algorithm, bits = None):
+    '''dnssec-keygen arguments selecting algorithm and key size'''
+    if algorithm in FIXED_KEY_SIZES:
+        return ['-a', algorithm]
+    return ['-a', algorithm, '-b', str(key_bits(algorithm, bits))]
+
+def key_size(rdata):
+    '''Size in bits of the public key of DNSKEY RDATA as given to
+    dnssec-keygen -b, None if unknown'''
+    public_key = rdata[4:]
+    if rdata[3] in (5, 7, 8, 10):
+        if not public_key:
+            return None
+        if public_key[0]:
+            modulus = public_key[1 + public_key[0]:]
+        else:
+            modulus = public_key[
+                3 + struct.unpack('!H', public_key[1:3])[0]:]
+        return len(modulus) * 8
+    return FIXED_KEY_SIZES.get(DNSSEC_ALGORITHMS.get(rdata[3]))
+
+class DSResult:
+    '''State of a key's DS record in the parent zone'''
+    PRESENT = 'present'
+    ABSENT  = 'absent'
+    ERROR   = 'error'
+
+    def __init__(self, state, ttl = None):
+        self.state = state
+        self.ttl = ttl
+    def __bool__(self):
+        return self.state == self.PRESENT
+    def __str__(self):
+        return self.state
+
+class DSCache:
+    '''Parent DS lookups of a run. The DS RRset of every zone is
+    queried once and matched against each key once.'''
+    def __init__(self, resolver = None):
+        self.resolver = resolver
+        self.rrsets = {}
+        self.results = {}
+        self.lookups = 0
+        self.lock = threading.Lock()
+    def rrset(self, zone, resolver):
+        '''Return DS records of zone, raise DNSError on failure'''
+        zone = zone.lower().rstrip('.') + '.'
+        if zone not in self.rrsets:
+            try:
+                rrset = (self.resolver or resolver).query(zone, 'DS')
+            except DNSError as e:
+                rrset = e
+            with self.lock:
+                self.lookups += 1
+                self.rrsets[zone] = rrset
+        if isinstance(self.rrsets[zone], DNSError):
+            raise self.rrsets[zone]
+        return self.rrsets[zone]
+    async def rrset_async(self, zone, resolver):
+        '''Coroutine version of rrset'''
+        zone = zone.lower().rstrip('.') + '.'
+        if zone not in self.rrsets:
+            try:
+                rrset = await (self.resolver or resolver).query_async(
+                    zone, 'DS')
+            except DNSError as e:
+                rrset = e
+            with self.lock:
+                self.lookups += 1
+                self.rrsets[zone] = rrset
+        if isinstance(self.rrsets[zone], DNSError):
+            raise self.rrsets[zone]
+        return self.rrsets[zone]
+    def failed(self, dnssec_key):
+        '''Return whether a lookup of key in this run gave an error'''
+        result = self.results.get(dnssec_key.keyfile)
+        return result is not None and result.state == DSResult.ERROR
+    def lookup(self, dnssec_key):
+        '''Return DSResult of key'''
+        if dnssec_key.keyfile not in self.results:
+            self.results[dnssec_key.keyfile] = self._match(dnssec_key)
+        return self.results[dnssec_key.keyfile]
+    def _match(self, dnssec_key):
+        dsfromkey = dnssec_key.dsfromkey(DS_DIGESTS)
+        if not dsfromkey:
+            return DSResult(DSResult.ERROR)
+        try:
+            records = self.rrset(dnssec_key.key_name, dnssec_key.resolver)
+        except DNSError:
+            return DSResult(DSResult.ERROR)
+        dsfromkey = dsfromkey.lower().split('\n')
+        for record in records:
+            ds = ' '.join([record.name, 'IN', 'DS', record.rdata])
+            if ds.lower() in dsfromkey:
+                return DSResult(DSResult.PRESENT, record.ttl)
+        return DSResult(DSResult.ABSENT)
+
+class ZoneContext:
+    '''Zone data shared by the rollovers of a zone. SOA parameters are
+    looked up once and kept for the TTL of the SOA record, failed
+    lookups for negative_ttl seconds. algorithm and bits override the
+    key algorithm of the run for the zone.'''
+    negative_ttl = 60
+
+    def __init__(self, zone, resolver, algorithm = None, bits = None):
+        self.zone = zone
+        self.resolver = resolver
+        self.algorithm = algorithm
+        self.bits = bits
+        self.soa_lookups = 0
+        self._soa_params = None
+        self._soa_expires = 0
+    def _store_soa(self, records):
+        self._soa_params = soa_params(records or [])
+        self._soa_expires = time.monotonic() + (
+            min(x.ttl for x in records) if self._soa_params
+            else self.negative_ttl)
+    def soa_params(self):
+        '''Return SOA params of zone [refresh, retry, expire]'''
+        if time.monotonic() >= self._soa_expires:
+            self.soa_lookups += 1
+            try:
+                self._store_soa(self.resolver.query(self.zone, 'SOA'))
+            except DNSError:
+                self._store_soa(None)
+        return self._soa_params
+    async def soa_params_async(self):
+        '''Coroutine version of soa_params'''
+        if time.monotonic() >= self._soa_expires:
+            self.soa_lookups += 1
+            try:
+                self._store_soa(
+                    await self.resolver.query_async(self.zone, 'SOA'))
+            except DNSError:
+                self._store_soa(None)
+        return self._soa_params
+
+KEY_COMMENT = re.compile(
+    r'; (?:This is a (\w+)-signing key, keyid (\d+), for (.*)$'
+    r'|(Created|Publish|Activate|Revoke|Inactive|Delete): (\d{14}))')
+KEY_TIMING_TAGS = {
+    'Created': 'created',
+    'Publish': 'publish',
+    'Activate': 'activate',
+    'Revoke': 'revoke',
+    'Inactive': 'inactive',
+    'Delete': 'delete'
+}
+
+def parse_timestamp(timestamp):
+    '''Decode YYYYMMDDHHMMSS timestamp to epoch seconds'''
+    return calendar.timegm((
+        int(timestamp[0:4]),
+        int(timestamp[4:6]),
+        int(timestamp[6:8]),
+        int(timestamp[8:10]),
+        int(timestamp[10:12]),
+        int(timestamp[12:14])))
+
+EPOCH = datetime(1970, 1, 1)
+NO_TIMESTAMP = -2**63
+
+def to_datetime(timestamp):
+    '''Return naive datetime of epoch timestamp'''
+    if timestamp is not None:
+        return EPOCH + timedelta(seconds = timestamp)
+
+def to_timestamp(value):
+    '''Return epoch timestamp of naive datetime'''
+    if value is not None:
+        return calendar.timegm(value.timetuple())
+
+def timing_property(name):
+    '''Datetime view of a timing slot holding epoch seconds'''
+    slot = '_' + name
+    def getter(self):
+        return to_datetime(getattr(self, slot))
+    def setter(self, value):
+        setattr(self, slot, to_timestamp(value))
+    return property(getter, setter)
+
+KEY_STATUSES = (
+    ('delete', 'deleted'),
+    ('inactive', 'inactivated'),
+    ('revoke', 'revoked'),
+    ('activate', 'activated'),
+    ('publish', 'published'),
+    ('created', 'created')
+)
+
+def timing_status(current_time, timing):
+    '''Return key status at epoch current_time from a mapping of
+    timing names to epoch seconds or None'''
+    for name, status in KEY_STATUSES:
+        if timing[name] is not None and timing[name] < current_time:
+            return status
+
+SETTIME_OPTIONS = {
+    'publish': '-P',
+    'activate': '-A',
+    'revoke': '-R',
+    'inactive': '-I',
+    'delete': '-D'
+}
+
+def format_timestamp(timestamp):
+    '''Encode epoch seconds as YYYYMMDDHHMMSS'''
+    return time.strftime('%Y%m%d%H%M%S', time.gmtime(timestamp))
+
+def rewrite_timing(lines, changes, prefix):
+    '''Return lines of a key file (prefix '; ') or private key file
+    (prefix '') with timing metadata changed the way dnssec-settime
+    does it. changes maps timing names to epoch seconds, None removes
+    the entry.'''
+    tags = dict((x[1], x[0]) for x in KEY_TIMING_TAGS.items())
+    timing = {}
+    position = None
+    others = []
+    for line in lines:
+        tag = line[len(prefix):].split(':', 1)[0]
+        if line.startswith(prefix) and tag in KEY_TIMING_TAGS and \
+                line[len(prefix) + len(tag):].startswith(': '):
+            timing[KEY_TIMING_TAGS[tag]] = line
+            if position is None:
+                position = len(others)
+            continue
+        others.append(line)
+    if position is None:
+        position = 1 if prefix and others else len(others)
+    for name, timestamp in changes.items():
+        if timestamp is None:
+            timing.pop(name, None)
+            continue
+        timing[name] = prefix + tags[name] + ': ' + format_timestamp(timestamp)
+        if prefix:
+            timing[name] += ' (' + time.asctime(time.gmtime(timestamp)) + ')'
+        timing[name] += '\n'
+    return others[:position] + [
+        timing[x] for x in KEY_TIMING_TAGS.values() if x in timing
+    ] + others[position:]
+
+def write_replacement(path, content):
+    '''Write content to a temporary file next to path with the mode and
+    ownership of path, return the temporary file name'''
+    stat = os.stat(path)
+    filedesc, temporary = tempfile.mkstemp(
+        dir=os.path.dirname(path) or '.',
+        prefix='.' + os.path.basename(path) + '.')
+    try:
+        with os.fdopen(filedesc, 'w') as tempfile_desc:
+            tempfile_desc.write(content)
+            tempfile_desc.flush()
+            os.fchmod(tempfile_desc.fileno(), stat.st_mode & 0o7777)
+            try:
+                os.fchown(tempfile_desc.fileno(), stat.st_uid, stat.st_gid)
+            except PermissionError:
+                pass
+            os.fsync(tempfile_desc.fileno())
+    except BaseException:
+        try:
+            os.unlink(temporary)
+        except OSError:
+            pass
+        raise
+    return temporary
+
+def replace_files(contents):
+    '''Replace the content of files given as (path, content) pairs,
+    keeping mode and ownership. No file is changed unless all new
+    contents were written to disk.'''
+    temporaries = []
+    try:
+        for path, content in contents:
+            temporaries.append((write_replacement(path, content), path))
+    except BaseException:
+        for temporary, _path in temporaries:
+            try:
+                os.unlink(temporary)
+            except OSError:
+                pass
+        raise
+    for temporary, path in temporaries:
+        os.replace(temporary, path)
+    for directory in set(os.path.dirname(x[1]) or '.' for x in temporaries):
+        directory = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+def write_new_file(path, content, mode):
+    '''Create a file that must not exist yet and write content to disk'''
+    filedesc = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, mode)
+    with os.fdopen(filedesc, 'w') as newfile_desc:
+        newfile_desc.write(content)
+        newfile_desc.flush()
+        os.fsync(newfile_desc.fileno())
+
+def chown_file(path, uid, gid):
+    '''Change owner of a file unless it already has uid and gid. The
+    file is changed through a descriptor, symbolic links are not
+    followed. Return whether the owner was changed.'''
+    stat = os.lstat(path)
+    if (stat.st_uid, stat.st_gid) == (uid, gid):
+        return False
+    filedesc = os.open(path, os.O_RDONLY | os.O_NOFOLLOW | os.O_CLOEXEC)
+    try:
+        os.fchown(filedesc, uid, gid)
+    finally:
+        os.close(filedesc)
+    return True
+
 class DNSSECKey:
-    '''DNSSEC key object'''
-    created        = None
-    publish        = None
-    activate       = None
-    revoke         = None
-    inactive       = None
-    delete         = None
-    keyfile        = None
-    privatekeyfile = None
-    keytype        = None
-    keyid          = None
-    key_name       = None
-    ds_ttl         = None
+    '''DNSSEC key object. Timing metadata is kept as epoch seconds,
+    the attributes of the same name return datetime views.'''
+    __slots__ = (
+        'keyfile',
+        'keytype',
+        'keyid',
+        'key_name',
+        'owner',
+        'dnskey_rdata',
+        'ds_ttl',
+        '_created',
+        '_publish',
+        '_activate',
+        '_revoke',
+        '_inactive',
+        '_delete',
+        '_ds_records'
+    )
+    created        = timing_property('created')
+    publish        = timing_property('publish')
+    activate       = timing_property('activate')
+    revoke         = timing_property('revoke')
+    inactive       = timing_property('inactive')
+    delete         = timing_property('delete')
+    resolver       = DNSResolver()
+    ds_cache       = None
+    ds_digest_types = (1, 2)
 
     @staticmethod
     def rreplace(s, old, new, occurence):
@@ -63,157 +1014,227 @@ class DNSSECKey:
             return privatekeyfile
 
     def __init__(self, keyfile):
-        self.keyfile = str(keyfile)
+        self._clear(keyfile)
         self._readkey()
+    def _clear(self, keyfile):
+        self.keyfile = str(keyfile)
+        self.keytype = None
+        self.keyid = None
+        self.key_name = None
+        self.owner = None
+        self.dnskey_rdata = None
+        self.ds_ttl = None
+        self._created = None
+        self._publish = None
+        self._activate = None
+        self._revoke = None
+        self._inactive = None
+        self._delete = None
+        self._ds_records = {}
+    @classmethod
+    def from_fields(cls, keyfile, fields):
+        '''Create key from metadata exported by fields()'''
+        dnssec_key = cls.__new__(cls)
+        dnssec_key._clear(keyfile)
+        for name, value in fields.items():
+            if name in KEY_TIMING_TAGS.values():
+                name = '_' + name
+            elif name == 'dnskey_rdata':
+                value = base64.b64decode(value)
+            setattr(dnssec_key, name, value)
+        return dnssec_key
+    def fields(self):
+        '''Return metadata read from the key file as JSON serializable
+        dictionary, timing as epoch seconds'''
+        fields = {}
+        for name in ('keytype', 'keyid', 'key_name', 'owner'):
+            if getattr(self, name) is not None:
+                fields[name] = getattr(self, name)
+        for name in KEY_TIMING_TAGS.values():
+            if getattr(self, '_' + name) is not None:
+                fields[name] = getattr(self, '_' + name)
+        if self.dnskey_rdata:
+            fields['dnskey_rdata'] = base64.b64encode(
+                self.dnskey_rdata).decode('ascii')
+        return fields
+    def timing(self):
+        '''Return timing metadata as epoch seconds by name'''
+        return {
+            'created': self._created,
+            'publish': self._publish,
+            'activate': self._activate,
+            'revoke': self._revoke,
+            'inactive': self._inactive,
+            'delete': self._delete
+        }
     def _readkey(self):
-        '''Read key metadata'''
+        '''Read key metadata, stop at the DNSKEY record'''
         with open(self.keyfile) as filedesc:
             for line in filedesc:
-                matchresult = re.match(
-                    "^; This is a (\w+)-signing key, keyid (\d+), for (.*)$",
-                    line)
-                if matchresult:
+                if not line.startswith(';'):
+                    if line.strip():
+                        self._readrr(line)
+                        break
+                    continue
+                matchresult = KEY_COMMENT.match(line)
+                if not matchresult:
+                    continue
+                tag = matchresult.group(4)
+                if tag:
+                    setattr(
+                        self,
+                        '_' + KEY_TIMING_TAGS[tag],
+                        parse_timestamp(matchresult.group(5)))
+                else:
                     self.keytype = matchresult.group(1)
                     self.keyid = matchresult.group(2)
                     self.key_name = matchresult.group(3)
+    def _readrr(self, line):
+        '''Read owner and RDATA of the DNSKEY record'''
+        fields = line.split()
+        if 'DNSKEY' not in fields[1:4]:
+            return
+        rdata = fields[fields.index('DNSKEY') + 1:]
+        try:
+            self.dnskey_rdata = struct.pack(
+                '!HBB', int(rdata[0]), int(rdata[1]), int(rdata[2])
+                ) + base64.b64decode(''.join(rdata[3:]), validate=True)
+        except (IndexError, ValueError, struct.error, binascii.Error):
+            return
+        self.owner = fields[0]
+    @property
+    def algorithm(self):
+        '''Algorithm mnemonic of the key, None if unknown'''
+        if self.dnskey_rdata:
+            return DNSSEC_ALGORITHMS.get(self.dnskey_rdata[3])
+    def settime(self, **changes):
+        '''Set timing metadata given as epoch seconds, None removes it.
+        Rewrites key and private key file in-process unless the key has
+        a BIND key state file, which is left to dnssec-settime.
+        Return whether the change was written.'''
+        statefile = self.rreplace(self.keyfile, '.key', '.state', 1)
+        if os.path.exists(statefile):
+            return self._settime_command(changes)
+        contents = []
+        try:
+            for path, prefix in (
+                    (self.keyfile, '; '),
+                    (self.privatekeyfile, '')):
+                if not path:
                     continue
-                matchresult = re.match( "^; Created: (\d{14}).*", line)
-                if matchresult:
-                    self.created = datetime.strptime(
-                        matchresult.group(1),
-                        "%Y%m%d%H%M%S")
-                    continue
-                matchresult = re.match("^; Publish: (\d{14}).*", line)
-                if matchresult:
-                    self.publish = datetime.strptime(
-                        matchresult.group(1),
-                        "%Y%m%d%H%M%S")
-                    continue
-                matchresult = re.match("^; Activate: (\d{14}).*", line)
-                if matchresult:
-                    self.activate = datetime.strptime(
-                        matchresult.group(1),
-                        "%Y%m%d%H%M%S")
-                    continue
-                matchresult = re.match("^; Revoke: (\d{14}).*", line)
-                if matchresult:
-                    self.revoke = datetime.strptime(
-                        matchresult.group(1),
-                        "%Y%m%d%H%M%S")
-                    continue
-                matchresult = re.match("^; Inactive: (\d{14}).*", line)
-                if matchresult:
-                    self.inactive = datetime.strptime(
-                        matchresult.group(1),
-                        "%Y%m%d%H%M%S")
-                    continue
-                matchresult = re.match("^; Delete: (\d{14}).*", line)
-                if matchresult:
-                    self.delete = datetime.strptime(
-                        matchresult.group(1),
-                        "%Y%m%d%H%M%S")
-                    continue
-    def status(self):
-        '''Return key status'''
-        current_time = datetime.now()
-        if self.delete and self.delete < current_time:
-            return "deleted"
-        if self.inactive and self.inactive < current_time:
-            return "inactivated"
-        if self.revoke and self.revoke < current_time:
-            return "revoked"
-        if self.activate and self.activate < current_time:
-            return "activated"
-        if self.publish and self.publish < current_time:
-            return "published"
-        if self.created and self.created < current_time:
-            return "created"
-    def dsfromkey(self):
+                with open(path) as filedesc:
+                    lines = filedesc.readlines()
+                if lines and not lines[-1].endswith('\n'):
+                    lines[-1] += '\n'
+                contents.append(
+                    (path, ''.join(rewrite_timing(lines, changes, prefix))))
+            replace_files(contents)
+        except OSError:
+            return False
+        for name, timestamp in changes.items():
+            setattr(self, '_' + name, timestamp)
+        return True
+    def _settime_command(self, changes):
+        arguments = ['dnssec-settime']
+        for name, timestamp in changes.items():
+            arguments += [
+                SETTIME_OPTIONS[name],
+                format_timestamp(timestamp) if timestamp is not None
+                else 'none'
+            ]
+        if call(
+            arguments + [self.keyfile], stdout=DEVNULL, stderr=DEVNULL
+        ):
+            return False
+        for name, timestamp in changes.items():
+            setattr(self, '_' + name, timestamp)
+        return True
+    def status(self, current_time = None):
+        '''Return key status, at current_time if given'''
+        return timing_status(
+            to_timestamp(current_time or datetime.now()), self.timing())
+    def dsfromkey(self, digest_types = None):
         '''Get DS from key'''
-        if self.keytype == 'key':
-            try:
-                dnssec_dsfromkey = check_output(
-                    [
-                        'dnssec-dsfromkey',
-                        self.keyfile
-                    ],
-                    stderr=DEVNULL)
-                if dnssec_dsfromkey:
-                    return dnssec_dsfromkey.decode(
-                            locale.getpreferredencoding(False)).strip()
-            except CalledProcessError:
-                return
-    def check_ds(self):
+        if self.keytype == 'key' and self.dnskey_rdata:
+            digest_types = tuple(digest_types or self.ds_digest_types)
+            if digest_types not in self._ds_records:
+                self._ds_records[digest_types] = '\n'.join(
+                    self._ds_record(x) for x in digest_types)
+            return self._ds_records[digest_types]
+    def _ds_record(self, digest_type):
+        '''Calculate DS record of key with digest type'''
+        digest = hashlib.new(
+            DS_DIGESTS[digest_type],
+            encode_name(self.owner.lower()) + self.dnskey_rdata)
+        return '{0} IN DS {1} {2} {3} {4}'.format(
+            self.owner,
+            key_tag(self.dnskey_rdata),
+            self.dnskey_rdata[3],
+            digest_type,
+            digest.hexdigest().upper())
+    def ds_lookup(self, ds_cache = None):
+        '''Return DSResult of parent zone lookup'''
+        result = (ds_cache or self.ds_cache or DSCache()).lookup(self)
+        if result:
+            self.ds_ttl = result.ttl
+        return result
+    def check_ds(self, ds_cache = None):
         '''Check DS of key is in DNS'''
-        dsfromkey = self.dsfromkey()
-        if dsfromkey:
-            try:
-                dig = check_output(
-                    [
-                        'dig',
-                        '+trace',
-                        '+noall',
-                        '+nodnssec',
-                        '+noidentify',
-                        '+ttlid',
-                        '+nosplit',
-                        '+answer',
-                        'ds',
-                        self.key_name
-                    ],
-                    stderr=DEVNULL)
-                if dig:
-                    for digline in dig.decode(
-                            locale.getpreferredencoding(False)
-                            ).strip().split('\n'):
-                        fields = digline.split()
-                        if len(fields) > 3 and fields[3] == 'DS':
-                            ds_ttl = int(fields.pop(1))
-                            ds = ' '.join(fields)
-                            if ds in dsfromkey.split('\n'):
-                                self.ds_ttl = ds_ttl
-                                return True
-                return False
-            except CalledProcessError:
-                return
-    def get_ds_ttl(self):
+        if self.dsfromkey():
+            result = self.ds_lookup(ds_cache)
+            if result.state != DSResult.ERROR:
+                return bool(result)
+    def get_ds_ttl(self, ds_cache = None):
         '''Return DS TTL in DNS'''
         if self.ds_ttl:
             return self.ds_ttl
-        elif self.check_ds():
+        elif self.check_ds(ds_cache):
             if self.ds_ttl:
                 return self.ds_ttl
+    async def ds_lookup_async(self, ds_cache = None):
+        '''Coroutine version of ds_lookup'''
+        ds_cache = ds_cache or self.ds_cache or DSCache()
+        try:
+            await ds_cache.rrset_async(self.key_name, self.resolver)
+        except DNSError:
+            pass
+        return self.ds_lookup(ds_cache)
+    async def check_ds_async(self, ds_cache = None):
+        '''Coroutine version of check_ds'''
+        if self.dsfromkey():
+            result = await self.ds_lookup_async(ds_cache)
+            if result.state != DSResult.ERROR:
+                return bool(result)
     def get_soa_params(self):
         '''Get SOA params of zone in DNS [refresh, retry, expire]'''
         try:
-            dig = check_output(
-                [
-                    'dig',
-                    '+trace',
-                    '+noall',
-                    '+nodnssec',
-                    '+noidentify',
-                    '+ttlid',
-                    '+nosplit',
-                    '+answer',
-                    'soa',
-                    self.key_name
-                ],
-                stderr=DEVNULL)
-            if dig:
-                for dig in dig.decode(
-                        locale.getpreferredencoding(False)).split('\n'):
-                    matchresult = re.match(
-                        '^[^ ]*\s+\d+\s+IN\s+SOA'
-                        '\s+[^ ]*\s+[^ ]*\s+\d+\s+(\d+)\s+(\d+)\s+(\d+)\s+\d+',
-                        dig)
-                    if matchresult:
-                        return [int(matchresult.group(x)) for x in range(1,4)]
-        except CalledProcessError:
+            return soa_params(self.resolver.query(self.key_name, 'SOA'))
+        except DNSError:
+            return
+    async def get_soa_params_async(self):
+        '''Coroutine version of get_soa_params'''
+        try:
+            return soa_params(
+                await self.resolver.query_async(self.key_name, 'SOA'))
+        except DNSError:
             return
     def __str__(self):
         '''Return human readable key representation'''
-        dsfromkey = self.dsfromkey()
+        return self.display()
+    def display(self, current_time = None, enrich = ('ds', 'dns')):
+        '''Return human readable key representation. Only file metadata
+        unless enrich names "ds" for the DS records computed from KSKs,
+        "dns" for whether they are in the parent zone or "ttl" for
+        their TTL there.'''
+        dsfromkey = self.dsfromkey() if enrich else None
+        ds_state = ''
+        if dsfromkey and 'dns' in enrich:
+            ds_state += 'DSinDNS: ' + str(self.check_ds())
+        if dsfromkey and 'ttl' in enrich:
+            ds_state += (' ' if ds_state else '') + \
+                'DSTTL: ' + str(self.get_ds_ttl())
+        if 'ds' not in enrich:
+            dsfromkey = None
         return 'F:'  ' {0.keyfile}\n'  \
                'PF:' ' {0.privatekeyfile}\n' \
                'N:'  ' {0.key_name} '  \
@@ -225,18 +1246,157 @@ class DNSSECKey:
                'R:'  ' {0.revoke} '    \
                'I:'  ' {0.inactive} '  \
                'D:'  ' {0.delete}\n'   \
-               'S:'  ' {1} {2}{3}'.format(self, self.status(),
-               'DSinDNS: ' + str(
-                self.check_ds()) if dsfromkey else
-                '', '\n' + dsfromkey if dsfromkey else '')
+               'S:'  ' {1} {2}{3}'.format(self, self.status(current_time),
+               ds_state, '\n' + dsfromkey if dsfromkey else '')
+    def record(self, current_time = None, enrich = ()):
+        '''Return key metadata as a dict of JSON types. Only file
+        metadata unless enrich names "ds" for the DS records computed
+        from the key, "dns" for whether they are in the parent zone or
+        "ttl" for their TTL there.'''
+        record = {
+            'zone': self.key_name,
+            'keyid': int(self.keyid) if self.keyid else None,
+            'type': self.keytype,
+            'algorithm': self.algorithm,
+            'bits': key_size(self.dnskey_rdata) if self.dnskey_rdata
+                else None,
+            'status': self.status(current_time)
+        }
+        for name, timestamp in self.timing().items():
+            record[name] = None if timestamp is None else time.strftime(
+                '%Y-%m-%dT%H:%M:%SZ', time.gmtime(timestamp))
+        record['keyfile'] = self.keyfile
+        record['privatekeyfile'] = self.privatekeyfile
+        if 'ds' in enrich:
+            dsfromkey = self.dsfromkey()
+            record['ds'] = dsfromkey.split('\n') if dsfromkey else None
+        if 'dns' in enrich:
+            record['ds_in_dns'] = self.check_ds()
+        if 'ttl' in enrich:
+            record['ds_ttl'] = self.get_ds_ttl() if self.dsfromkey() \
+                else None
+        return record
     def __nonzero(self):
         '''Return whether key metadata was available'''
         return bool(self.keytype)
 
+KEY_TYPES = ('zone', 'key')
+
+class KeyTable:
+    '''Columnar collection of keys for bulk loads. Metadata is kept in
+    typed arrays and shared strings, DNSSECKey objects are only created
+    for rows being accessed.'''
+    def __init__(self, dnssec_keys = ()):
+        self.keyfiles = []
+        self.keytypes = array('b')
+        self.keyids = array('l')
+        self.key_names = []
+        self.owners = []
+        self.dnskey_rdata = []
+        self.timing = dict(
+            (x, array('q')) for x in KEY_TIMING_TAGS.values())
+        self.strings = {}
+        self.extend(dnssec_keys)
+    def _share(self, string):
+        if string is None:
+            return
+        return self.strings.setdefault(string, string)
+    def append(self, dnssec_key):
+        '''Add key as row'''
+        self.keyfiles.append(dnssec_key.keyfile)
+        self.keytypes.append(
+            KEY_TYPES.index(dnssec_key.keytype)
+            if dnssec_key.keytype in KEY_TYPES else -1)
+        self.keyids.append(
+            int(dnssec_key.keyid) if dnssec_key.keyid is not None else -1)
+        self.key_names.append(self._share(dnssec_key.key_name))
+        self.owners.append(self._share(dnssec_key.owner))
+        self.dnskey_rdata.append(dnssec_key.dnskey_rdata)
+        for name, timestamp in dnssec_key.timing().items():
+            self.timing[name].append(
+                timestamp if timestamp is not None else NO_TIMESTAMP)
+    def extend(self, dnssec_keys):
+        '''Add keys as rows'''
+        for dnssec_key in dnssec_keys:
+            self.append(dnssec_key)
+    def __len__(self):
+        return len(self.keyfiles)
+    def __getitem__(self, row):
+        '''Return DNSSECKey of row'''
+        dnssec_key = DNSSECKey.__new__(DNSSECKey)
+        dnssec_key._clear(self.keyfiles[row])
+        if self.keytypes[row] >= 0:
+            dnssec_key.keytype = KEY_TYPES[self.keytypes[row]]
+        if self.keyids[row] >= 0:
+            dnssec_key.keyid = str(self.keyids[row])
+        dnssec_key.key_name = self.key_names[row]
+        dnssec_key.owner = self.owners[row]
+        dnssec_key.dnskey_rdata = self.dnskey_rdata[row]
+        for name, column in self.timing.items():
+            if column[row] != NO_TIMESTAMP:
+                setattr(dnssec_key, '_' + name, column[row])
+        return dnssec_key
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+    def row_timing(self, row):
+        '''Return timing of row as epoch seconds by name'''
+        return dict(
+            (name, column[row] if column[row] != NO_TIMESTAMP else None)
+            for name, column in self.timing.items())
+    def column(self, field, current_time):
+        '''Return the sort values of field for all rows, current_time
+        in epoch seconds for the status'''
+        if field in self.timing:
+            return [max(x, 0) for x in self.timing[field]]
+        if field == 'type':
+            return [KEY_TYPES[x] if x >= 0 else '' for x in self.keytypes]
+        if field == 'status':
+            return [timing_status(current_time, self.row_timing(x)) or ''
+                    for x in range(len(self))]
+        if field == 'zone':
+            return [(x or '').lower().rstrip('.') for x in self.key_names]
+        if field == 'keyid':
+            return list(self.keyids)
+        if field == 'algorithm':
+            return [DNSSEC_ALGORITHMS.get(x[3], '') if x else ''
+                    for x in self.dnskey_rdata]
+        raise ValueError('unknown key field ' + field)
+    def select(self, selection, current_time = None):
+        '''Iterate over the keys matching a KeySelection in its order.
+        Each column used is computed once, not per comparison.'''
+        current_time = to_timestamp(current_time or datetime.now())
+        columns = {}
+        def column(field):
+            if field not in columns:
+                columns[field] = self.column(field, current_time)
+            return columns[field]
+        rows = range(len(self))
+        for field, values in selection.filters():
+            values_column = column(field)
+            rows = [x for x in rows if values_column[x] in values]
+        rows = list(rows)
+        if any(x[1] for x in selection.order):
+            # stable sorts from the last field on, for mixed directions
+            for field, descending in reversed(selection.order):
+                rows.sort(key = column(field).__getitem__,
+                          reverse = descending)
+        elif selection.order:
+            sort_columns = [column(x[0]) for x in selection.order]
+            rows.sort(key = lambda row: tuple(x[row] for x in sort_columns))
+        for row in rows:
+            yield self[row]
+
 class DNSSECRollover():
     '''Object to handle DNSSEC key rollovers'''
     dnssec_keys = []
     dnssec_keys_filtered_sorted = []
+    keygen_slots = None
+    key_pool = None
+    key_algorithm = None
+    key_bits = None
+    owners = {}
+    notifier = None
 
     def __init__(
         self,
@@ -246,9 +1406,18 @@ class DNSSECRollover():
         email_from,
         email_to,
         keyfileowner,
-        dnssec_keys = []
+        dnssec_keys = [],
+        ds_cache = None,
+        zone_context = None,
+        now = None
     ):
         '''Perform rollover'''
+        self.now = now or datetime.now()
+        self.ds_cache = ds_cache or DSCache()
+        self.zone_context = zone_context
+        if dnssec_keys and not zone_context:
+            self.zone_context = ZoneContext(
+                dnssec_keys[-1].key_name, dnssec_keys[-1].resolver)
         self.keytype = keytype
         self.interval = interval
         self.resign_interval = resign_interval
@@ -256,24 +1425,64 @@ class DNSSECRollover():
         self.email_from = email_from
         self.email_to = email_to
         self.keyfileowner = keyfileowner
+        self.new_keys = []
+        self.deleted_keys = []
+        self.notifications = []
+        self.index_keys()
+        self.algorithm, self.bits = self.new_key_algorithm()
+        if self.key_pool:
+            self.key_pool.register(self.algorithm, self.bits, keytype)
         if self.dnssec_keys:
             self.dnssec_keys_filtered_sorted = self.filter_sort_keys()
-            if self.check_new_key_generation():
+            algorithm_rollover = self.algorithm_rollover()
+            if not algorithm_rollover and self.check_new_key_generation():
                 self.generate_new_key()
                 self.chown()
             if self.keytype == 'key':
-                self.inactivate_delete_old_ksk()
+                if not algorithm_rollover:
+                    self.inactivate_delete_old_ksk()
                 self.check_ksk_ds_email()
             self.delete_deleted_keys()
+            if self.keytype == 'key':
+                self.keep_undetermined_notices()
+    def new_key_algorithm(self):
+        '''Return algorithm and size of new keys: those of the zone list,
+        else those of the run, else those of the newest key of the
+        rollover type, so that only an algorithm given for the zone or
+        the run starts an algorithm rollover'''
+        algorithm = self.key_algorithm
+        bits = self.key_bits
+        if self.zone_context and self.zone_context.algorithm:
+            algorithm = self.zone_context.algorithm
+            bits = self.zone_context.bits or self.key_bits
+        if not algorithm:
+            dnssec_keys = [
+                x for x in
+                self.filter_sort_keys('activated published created None')
+                if x.algorithm
+            ]
+            if dnssec_keys:
+                algorithm = dnssec_keys[-1].algorithm
+                bits = bits or key_size(dnssec_keys[-1].dnskey_rdata)
+            else:
+                algorithm = 'RSASHA256'
+        return algorithm, key_bits(algorithm, bits)
+    def next_key_generation(self):
+        '''Return when check_new_key_generation will require a new key,
+        None if unknown'''
+        prepublish_time = self.calculate_time()
+        dnssec_keys = self.filter_sort_keys('activated published created None')
+        if prepublish_time and dnssec_keys and dnssec_keys[-1].activate:
+            return dnssec_keys[-1].activate + prepublish_time
     def check_new_key_generation(self):
         '''Check whether a new key is required to be generated'''
         prepublish_time = self.calculate_time()
         dnssec_keys = self.filter_sort_keys('activated published created None')
         if self.keytype == 'zone' and prepublish_time:
-            if dnssec_keys[-1].activate + prepublish_time < datetime.now():
+            if dnssec_keys[-1].activate + prepublish_time < self.now:
                     return True
         elif self.keytype == 'key' and prepublish_time:
-            if dnssec_keys[-1].activate + prepublish_time < datetime.now():
+            if dnssec_keys[-1].activate + prepublish_time < self.now:
                 return True
     def generate_new_key(self):
         '''Generate a new key'''
@@ -291,26 +1500,51 @@ class DNSSECRollover():
                 self.dnssec_keys_filtered_sorted[-1].inactive and \
                 self.dnssec_keys_filtered_sorted[-1].delete
             ):
-                if call(
-                    [
-                        'dnssec-settime',
-                        '-I', '+' + str(int(prepublish_time.total_seconds())),
-                        '-D', '+' + str(int(postpublish_time.total_seconds())),
-                        self.dnssec_keys_filtered_sorted[-1].keyfile,
-                    ], stdout=DEVNULL, stderr=DEVNULL
+                current_time = int(time.time())
+                if not self.dnssec_keys_filtered_sorted[-1].settime(
+                    inactive = current_time +
+                        int(prepublish_time.total_seconds()),
+                    delete = current_time +
+                        int(postpublish_time.total_seconds())
                 ):
                     return
+            predecessor = self.dnssec_keys_filtered_sorted[-1]
+            activate = predecessor.timing()['inactive']
+            publish = activate - int(prepublish_interval.total_seconds())
+            if self.claim_pooled_key(self.algorithm, self.bits, {
+                    'publish': publish,
+                    'activate': activate
+                    }):
+                return
+            if predecessor.dnskey_rdata and \
+                    key_size(predecessor.dnskey_rdata) not in \
+                    (None, self.bits):
+                # a successor key (-S) keeps the size of its predecessor
+                arguments = [
+                    'dnssec-keygen',
+                    '-K',
+                    os.path.dirname(predecessor.keyfile),
+                    '-P',
+                    format_timestamp(publish),
+                    '-A',
+                    format_timestamp(activate),
+                    '-n',
+                    'ZONE',
+                ] + algorithm_arguments(self.algorithm, self.bits) + [
+                    predecessor.key_name,
+                ]
+            else:
+                arguments = [
+                    'dnssec-keygen',
+                    '-K',
+                    os.path.dirname(predecessor.keyfile),
+                    '-S',
+                    predecessor.keyfile,
+                    '-i',
+                    str(int(prepublish_interval.total_seconds())),
+                ]
             try:
-                newkey = check_output([
-                            'dnssec-keygen',
-                            '-K',
-                            os.path.dirname(
-                            self.dnssec_keys_filtered_sorted[-1].keyfile),
-                            '-S',
-                            self.dnssec_keys_filtered_sorted[-1].keyfile,
-                            '-i',
-                            str(int(prepublish_interval.total_seconds())),
-                        ], stderr=DEVNULL)
+                newkey = self.keygen(arguments)
                 if newkey:
                     newkey = newkey.decode(
                                 locale.getpreferredencoding(False)
@@ -320,28 +1554,23 @@ class DNSSECRollover():
                             self.dnssec_keys_filtered_sorted[-1].keyfile),
                             newkey + '.key')
                     if os.path.isfile(newkey_file):
-                        self.dnssec_keys.append(DNSSECKey(newkey_file))
+                        self.add_key(DNSSECKey(newkey_file))
                         return
-                call([
-                        'dnssec-settime',
-                        '-I',
-                        'none',
-                        '-D',
-                        'none',
-                        self.dnssec_keys_filtered_sorted[-1].keyfile,
-                    ], stdout=DEVNULL, stderr=DEVNULL)
+                self.dnssec_keys_filtered_sorted[-1].settime(
+                    inactive = None, delete = None)
             except CalledProcessError:
-                call([
-                        'dnssec-settime',
-                        '-I',
-                        'none',
-                        '-D',
-                        'none',
-                        self.dnssec_keys_filtered_sorted[-1].keyfile,
-                    ], stdout=DEVNULL, stderr=DEVNULL)
+                self.dnssec_keys_filtered_sorted[-1].settime(
+                    inactive = None, delete = None)
         elif self.keytype == 'key':
+            activate = int(time.time()) + self.interval
+            if self.claim_pooled_key(self.algorithm, self.bits, {
+                    'publish': activate -
+                        int(prepublish_interval.total_seconds()),
+                    'activate': activate
+                    }):
+                return
             try:
-                newkey = check_output([
+                newkey = self.keygen([
                                 'dnssec-keygen',
                                 '-K',
                                 os.path.dirname(
@@ -354,12 +1583,11 @@ class DNSSECRollover():
                                 'KSK',
                                 '-n',
                                 'ZONE',
-                                '-a',
-                                'RSASHA256',
-                                '-b',
-                                '2048',
+                            ] + algorithm_arguments(
+                                self.algorithm, self.bits
+                            ) + [
                                 self.dnssec_keys_filtered_sorted[-1].key_name,
-                            ], stderr=DEVNULL)
+                            ])
                 if newkey:
                     newkey = newkey.decode(
                                 locale.getpreferredencoding(False)
@@ -369,58 +1597,171 @@ class DNSSECRollover():
                             self.dnssec_keys_filtered_sorted[-1].keyfile),
                             newkey + '.key')
                     if os.path.isfile(newkey_file):
-                        self.dnssec_keys.append(DNSSECKey(newkey_file))
+                        self.add_key(DNSSECKey(newkey_file))
             except CalledProcessError:
                 return
+    def algorithm_rollover(self):
+        '''Move keys of the rollover type to the configured algorithm.
+        A key of the new algorithm is published and activated at once,
+        so the zone is signed with both algorithms. Keys of other
+        algorithms are retired once the parent zone has DS records of
+        new algorithm KSKs only. Return whether an algorithm rollover
+        is in progress.'''
+        dnssec_keys = self.filter_sort_keys('activated published created')
+        old_keys = [
+            x for x in dnssec_keys
+            if x.algorithm and x.algorithm != self.algorithm and
+            not (x.inactive and x.delete)
+        ]
+        if not old_keys:
+            return False
+        if not [x for x in dnssec_keys if x.algorithm == self.algorithm]:
+            self.generate_algorithm_key()
+            self.chown()
+            return True
+        ksks = [
+            x for x in self.dnssec_keys
+            if x.keytype == 'key' and not (x.inactive and x.delete)
+        ]
+        if not [
+            x for x in ksks if x.algorithm == self.algorithm and
+            x.ds_lookup(self.ds_cache).state == DSResult.PRESENT
+        ]:
+            return True
+        old_ksks_with_ds = [
+            x for x in ksks if x.algorithm != self.algorithm and
+            x.ds_lookup(self.ds_cache).state != DSResult.ABSENT
+        ]
+        if old_ksks_with_ds:
+            if self.keytype == 'key':
+                for dnssec_key in old_ksks_with_ds:
+                    if dnssec_key.ds_lookup(self.ds_cache):
+                        self.send_email(
+                            'DS record removal required',
+                            'DNSSEC algorithm rollover to ' +
+                            self.algorithm + ' in progress.\n'
+                            'Please remove following DS record of the '
+                            'old algorithm from the parent zone:\n\n' +
+                            dnssec_key.dsfromkey(),
+                            dnssec_key
+                            )
+            return True
+        prepublish_interval = self.calculate_time()
+        if not prepublish_interval:
+            return True
+        retire_time = int(time.time()) + \
+            int(prepublish_interval.total_seconds())
+        # keep the old keys published until signatures made with them
+        # have expired from caches, like a ZSK after its rollover
+        delete_time = retire_time + \
+            int(prepublish_interval.total_seconds()) + self.resign_interval
+        for dnssec_key in old_keys:
+            dnssec_key.settime(inactive = retire_time, delete = delete_time)
+        self.index_keys()
+        return True
+    def generate_algorithm_key(self):
+        '''Generate a key of the configured algorithm, published and
+        activated at once'''
+        current_time = int(time.time())
+        if self.claim_pooled_key(self.algorithm, self.bits, {
+                'publish': current_time,
+                'activate': current_time
+                }):
+            return
+        arguments = [
+            'dnssec-keygen',
+            '-K',
+            os.path.dirname(self.dnssec_keys_filtered_sorted[-1].keyfile),
+            '-n',
+            'ZONE',
+        ] + algorithm_arguments(self.algorithm, self.bits)
+        if self.keytype == 'key':
+            arguments += ['-f', 'KSK']
+        try:
+            newkey = self.keygen(
+                arguments + [self.dnssec_keys_filtered_sorted[-1].key_name])
+        except CalledProcessError:
+            return
+        if newkey:
+            newkey_file = os.path.join(
+                os.path.dirname(self.dnssec_keys_filtered_sorted[-1].keyfile),
+                newkey.decode(locale.getpreferredencoding(False)).strip() +
+                '.key')
+            if os.path.isfile(newkey_file):
+                self.add_key(DNSSECKey(newkey_file))
+    def claim_pooled_key(self, algorithm, bits, timing):
+        '''Take a key of algorithm and size from the key pool with
+        timing set, return whether the pool had one'''
+        if not (self.key_pool and algorithm and bits):
+            return False
+        keyfile = self.key_pool.claim(
+            algorithm,
+            bits,
+            self.keytype,
+            self.dnssec_keys_filtered_sorted[-1].key_name,
+            os.path.dirname(self.dnssec_keys_filtered_sorted[-1].keyfile),
+            timing)
+        if not keyfile:
+            return False
+        self.add_key(DNSSECKey(keyfile))
+        return True
+    @classmethod
+    def keygen(cls, arguments):
+        '''Run dnssec-keygen, waiting for a free slot if concurrent
+        key generations are limited'''
+        if cls.keygen_slots:
+            with cls.keygen_slots:
+                return check_output(arguments, stderr=DEVNULL)
+        return check_output(arguments, stderr=DEVNULL)
+    @classmethod
+    def owner_ids(cls, owner):
+        '''Return uid and gid of user owner, looked up once per run or
+        daemon pass'''
+        if owner not in cls.owners:
+            user = getpwnam(owner)
+            cls.owners[owner] = (user.pw_uid, user.pw_gid)
+        return cls.owners[owner]
     def chown(self):
-        for dnssec_key in self.dnssec_keys:
-            os.chown(
-                dnssec_key.keyfile,
-                getpwnam(self.keyfileowner).pw_uid,
-                getpwnam(self.keyfileowner).pw_gid
-            )
-            if dnssec_key.privatekeyfile:
-                os.chown(
-                    dnssec_key.privatekeyfile,
-                    getpwnam(self.keyfileowner).pw_uid,
-                    getpwnam(self.keyfileowner).pw_gid
-                )
+        '''Give the key files created in this rollover to the key file
+        owner, rewritten key files keep their owner'''
+        uid, gid = self.owner_ids(self.keyfileowner)
+        for dnssec_key in self.new_keys:
+            chown_file(dnssec_key.keyfile, uid, gid)
+            try:
+                chown_file(
+                    dnssec_key.rreplace(
+                        dnssec_key.keyfile, '.key', '.private', 1),
+                    uid,
+                    gid)
+            except FileNotFoundError:
+                pass
     def inactivate_delete_old_ksk(self):
         '''Set inactivation (prepublish_interval) and
         deletion (postpublish_interval) on old KSK if
         latest KSK has DS record in DNS.'''
         dnssec_keys = self.filter_sort_keys('activated published')
-        if dnssec_keys[-1].check_ds():
+        if dnssec_keys[-1].ds_lookup(self.ds_cache):
             if len(dnssec_keys) > 1:
                 prepublish_interval = self.calculate_time()
                 postpublish_interval = self.calculate_time(
                         wanted = 'post_publish',
                         current_ksk = dnssec_keys[-1])
+                current_time = int(time.time())
                 for dnssec_key in dnssec_keys[:-1]:
                     if not (dnssec_key.inactive and dnssec_key.delete):
-                        call([
-                                'dnssec-settime',
-                                '-I',
-                                '+' + str(
-                                        int(
-                                            prepublish_interval.total_seconds()
-                                        )
-                                    ),
-                                '-D',
-                                '+' + str(
-                                        int(
-                                            postpublish_interval.total_seconds()
-                                        )
-                                    ),
-                                dnssec_key.keyfile,
-                            ], stdout=DEVNULL, stderr=DEVNULL)
+                        dnssec_key.settime(
+                            inactive = current_time +
+                                int(prepublish_interval.total_seconds()),
+                            delete = current_time +
+                                int(postpublish_interval.total_seconds()))
     def check_ksk_ds_email(self):
         '''If DS of latest published KSK or active KSK
         is not in DNS, send a E-Mail.'''
         dnssec_keys_without_ds = [
                 x for x in self.filter_sort_keys(
                     'activated published'
-                    ) if not x.check_ds()
+                    ) if x.ds_lookup(self.ds_cache).state == DSResult.ABSENT
+                    and (x.algorithm == self.algorithm or not x.inactive)
                 ]
         for dnssec_key in dnssec_keys_without_ds:
             self.send_email(
@@ -430,19 +1771,22 @@ class DNSSECRollover():
                     '" found.\n'
                     'But DS record is not present in the parent zone.\n'
                     'Please insert following DS record into the parent zone:'
-                    '\n\n' + dnssec_key.dsfromkey()
+                    '\n\n' + dnssec_key.dsfromkey(),
+                    dnssec_key
                     )
     def delete_deleted_keys(self):
         '''Delete keys flagged as deleted not having DS in DNS.
         Send E-Mail of DS to remove if key is KSK and DS in DNS.'''
         dnssec_keys = self.filter_sort_keys('deleted')
         if self.keytype == 'key':
-            dnssec_keys_with_ds = [x for x in dnssec_keys if x.check_ds()]
+            ds_results = [(x, x.ds_lookup(self.ds_cache)) for x in dnssec_keys]
+            dnssec_keys_with_ds = [x for x, ds in ds_results if ds]
             dnssec_keys_without_ds = [
-                    x for x in dnssec_keys if not x.check_ds()
+                    x for x, ds in ds_results if ds.state == DSResult.ABSENT
                     ]
             for dnssec_key in dnssec_keys_without_ds:
                 os.unlink(dnssec_key.keyfile)
+                self.remove_key(dnssec_key)
                 if dnssec_key.privatekeyfile:
                     os.unlink(dnssec_key.privatekeyfile)
             for dnssec_key in dnssec_keys_with_ds:
@@ -451,36 +1795,75 @@ class DNSSECRollover():
                         'Deleted DNSSEC KSK has still a '
                         'DS record in the parent zone.\n'
                         'Please remove following DS record:\n\n'
-                        + dnssec_key.dsfromkey()
+                        + dnssec_key.dsfromkey(),
+                        dnssec_key
                         )
         elif self.keytype == 'zone':
             for dnssec_key in dnssec_keys:
                 os.unlink(dnssec_key.keyfile)
+                self.remove_key(dnssec_key)
                 if dnssec_key.privatekeyfile:
                     os.unlink(dnssec_key.privatekeyfile)
-    def send_email(self, subject, message):
-        '''Send notification E-Mail'''
+    def keep_undetermined_notices(self):
+        '''Keep stored notices about KSKs whose DS lookup failed, whether
+        their conditions persist is unknown in this run'''
+        if self.notifier and self.zone_context:
+            for dnssec_key in self.dnssec_keys:
+                if self.ds_cache.failed(dnssec_key):
+                    self.notifier.keep(
+                        self.zone_context.zone, dnssec_key.keyid)
+    def send_email(self, subject, message, dnssec_key = None):
+        '''Send notification E-Mail about dnssec_key, queued for a
+        digest if the run has a notifier. The notifier may skip
+        notices sent recently.'''
+        if self.notifier:
+            if self.notifier.add(
+                self.email_from,
+                self.email_to,
+                subject,
+                message,
+                self.zone_context.zone if self.zone_context else None,
+                dnssec_key.keyid if dnssec_key else None
+            ):
+                self.notifications.append(subject)
+            return
+        self.notifications.append(subject)
         msg = MIMEText(message)
         msg['From'] = self.email_from
         msg['To'] = self.email_to
         msg['Subject'] = subject
-        sendmail = Popen(
-            [
-                '/usr/sbin/sendmail',
-                '-t',
-                '-oi'
-            ], stdin = PIPE, stderr=DEVNULL)
-        sendmail.communicate(bytes(msg.as_string(), 'utf-8'))
+        Notifier.send_sendmail(msg)
+    def add_key(self, dnssec_key):
+        '''Add a newly generated key'''
+        self.dnssec_keys.append(dnssec_key)
+        self.new_keys.append(dnssec_key)
+        self.index_keys()
+    def remove_key(self, dnssec_key):
+        '''Forget a deleted key'''
+        self.dnssec_keys.remove(dnssec_key)
+        self.deleted_keys.append(dnssec_key)
+        self.index_keys()
+    def index_keys(self):
+        '''Sort keys of the rollover type by activation into lists per
+        status, all statuses taken at the same point in time'''
+        dnssec_keys = sorted(
+            (x for x in self.dnssec_keys if x.keytype == self.keytype),
+            key = lambda x: x._activate or 0)
+        self.status_index = {}
+        for position, dnssec_key in enumerate(dnssec_keys):
+            self.status_index.setdefault(
+                str(dnssec_key.status(self.now)), []
+            ).append((position, dnssec_key))
+        self.filtered_sorted = {}
     def filter_sort_keys(self, status = 'activated'):
         '''Filter and sort keys'''
-        dnssec_keys_filtered_sorted = [
-                x for x in self.dnssec_keys if (x.keytype == self.keytype) and
-                (str(x.status()) in status.split()) ]
-        dnssec_keys_filtered_sorted = sorted(
-            dnssec_keys_filtered_sorted,
-            key = lambda x: x.activate or datetime.fromtimestamp(0)
-        )
-        return dnssec_keys_filtered_sorted
+        if status not in self.filtered_sorted:
+            self.filtered_sorted[status] = [
+                x[1] for x in sorted(
+                    x for y in set(status.split())
+                    for x in self.status_index.get(y, []))
+            ]
+        return self.filtered_sorted[status]
     def calculate_time(
         self,
         calculate_timeoffset = False,
@@ -491,7 +1874,8 @@ class DNSSECRollover():
         dnssec_keys = [x for x in self.dnssec_keys
                 if x.keytype == self.keytype]
         try:
-            soa_refresh, soa_retry, soa_expire = dnssec_keys[-1].get_soa_params()
+            soa_refresh, soa_retry, soa_expire = \
+                self.zone_context.soa_params()
         except TypeError as e:
             return
         ds_ttl = 0
@@ -508,11 +1892,11 @@ class DNSSECRollover():
             if self.keytype == 'key':
                 if not current_ksk:
                     for key in dnssec_keys:
-                        ds_ttl = key.get_ds_ttl()
+                        ds_ttl = key.get_ds_ttl(self.ds_cache)
                         if ds_ttl:
                             break
                 else:
-                    ds_ttl = current_ksk.get_ds_ttl()
+                    ds_ttl = current_ksk.get_ds_ttl(self.ds_cache)
                 if not ds_ttl:
                     return timedelta(seconds = ds_ttl)
             if calculate_timeoffset:
@@ -526,6 +1910,160 @@ class DNSSECRollover():
                         self.resign_interval +
                         ds_ttl)
 
+class NoticeStore:
+    '''Notices sent in earlier runs, kept in a sqlite database. A notice
+    is repeated after renotify_interval seconds while its condition
+    persists, and sent right away if the condition went away and came
+    back.'''
+    def __init__(self, path, renotify_interval):
+        self.renotify_interval = renotify_interval
+        self.seen = set()
+        self.kept = set()
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS notices ('
+                'zone TEXT, keyid TEXT, notice TEXT, first_sent INTEGER, '
+                'last_sent INTEGER, PRIMARY KEY (zone, keyid, notice))')
+    def due(self, zone, keyid, notice):
+        '''Return whether notice about key keyid of zone is to be sent'''
+        with self.lock:
+            self.seen.add((zone, keyid, notice))
+            row = self.connection.execute(
+                'SELECT last_sent FROM notices WHERE zone = ? AND '
+                'keyid = ? AND notice = ?',
+                (zone, keyid, notice)).fetchone()
+        return not row or time.time() - row[0] >= self.renotify_interval
+    def sent(self, notices):
+        '''Record (zone, keyid, notice) notices as sent now'''
+        current_time = int(time.time())
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'INSERT INTO notices VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (zone, keyid, notice) DO UPDATE '
+                'SET last_sent = excluded.last_sent',
+                [x + (current_time, current_time) for x in notices])
+    def keep(self, zone, keyid):
+        '''Keep notices about key keyid of zone in the next prune'''
+        with self.lock:
+            self.kept.add((zone, keyid))
+    def prune(self, zones):
+        '''Forget notices of zones not raised again in this run, except
+        those of kept keys'''
+        with self.lock, self.connection:
+            for zone in zones:
+                for keyid, notice in self.connection.execute(
+                        'SELECT keyid, notice FROM notices WHERE zone = ?',
+                        (zone,)).fetchall():
+                    if (zone, keyid, notice) not in self.seen and \
+                            (zone, keyid) not in self.kept:
+                        self.connection.execute(
+                            'DELETE FROM notices WHERE zone = ? AND '
+                            'keyid = ? AND notice = ?',
+                            (zone, keyid, notice))
+            self.seen = set(x for x in self.seen if x[0] not in zones)
+            self.kept = set(x for x in self.kept if x[0] not in zones)
+
+class Notifier:
+    '''Notification E-Mails of a run, sent as one digest per sender and
+    recipient. Digests go out over a single SMTP connection to
+    smtp_server (host[:port]) or through sendmail. With a NoticeStore
+    notices sent recently are skipped.'''
+    sendmail = '/usr/sbin/sendmail'
+
+    def __init__(self, smtp_server = None, store = None):
+        self.smtp_server = smtp_server
+        self.store = store
+        self.notices = {}
+        self.lock = threading.Lock()
+    def add(
+        self,
+        email_from,
+        email_to,
+        subject,
+        message,
+        zone = None,
+        keyid = None
+    ):
+        '''Queue a notification, return False if it was skipped'''
+        if self.store and zone and keyid and \
+                not self.store.due(zone, keyid, subject):
+            return False
+        with self.lock:
+            self.notices.setdefault(
+                (email_from, email_to), []
+            ).append((zone, subject, message, keyid))
+        return True
+    def keep(self, zone, keyid):
+        '''Keep stored notices about key keyid of zone, e.g. while its
+        DS cannot be looked up'''
+        if self.store:
+            self.store.keep(zone, keyid)
+    @staticmethod
+    def digest(email_from, email_to, notices):
+        '''Return E-Mail of (zone, subject, message) notices, a single
+        notice is sent unchanged'''
+        if len(notices) == 1:
+            subject, text = notices[0][1], notices[0][2]
+        else:
+            counts = {}
+            for notice in notices:
+                counts[notice[1]] = counts.get(notice[1], 0) + 1
+            subject = 'DNSSEC: ' + ', '.join(
+                '{0} ({1})'.format(*x) for x in sorted(counts.items()))
+            text = '\n\n'.join(
+                '='*75 + '\n' + (zone + ': ' if zone else '') +
+                notice_subject + '\n\n' + message
+                for zone, notice_subject, message, _keyid in notices)
+        msg = MIMEText(text)
+        msg['From'] = email_from
+        msg['To'] = email_to
+        msg['Subject'] = subject
+        return msg
+    @classmethod
+    def send_sendmail(cls, msg):
+        '''Send E-Mail through sendmail'''
+        sendmail = Popen(
+            [
+                cls.sendmail,
+                '-t',
+                '-oi'
+            ], stdin = PIPE, stderr=DEVNULL)
+        sendmail.communicate(bytes(msg.as_string(), 'utf-8'))
+    def flush(self, zones = ()):
+        '''Send queued notifications, return number of E-Mails sent.
+        zones are the zones processed completely since the last flush,
+        stored notices of them not raised again are forgotten.'''
+        with self.lock:
+            notices, self.notices = self.notices, {}
+        if self.store:
+            self.store.prune(set(zones))
+        messages = [
+            self.digest(x[0][0], x[0][1], x[1])
+            for x in sorted(notices.items())
+        ]
+        if not messages:
+            return 0
+        try:
+            if self.smtp_server:
+                host, _separator, port = self.smtp_server.partition(':')
+                with smtplib.SMTP(host, int(port or 25)) as smtp:
+                    for msg in messages:
+                        smtp.send_message(msg)
+            else:
+                for msg in messages:
+                    self.send_sendmail(msg)
+        except (OSError, ValueError, smtplib.SMTPException) as e:
+            warning('Unable to send notifications: ' + str(e))
+            return 0
+        if self.store:
+            self.store.sent([
+                (x[0], x[3], x[1]) for y in notices.values() for x in y
+                if x[0] and x[3]
+            ])
+        return len(messages)
+
 def warning(message, errno = None):
     '''Print warning message'''
     if errno:
@@ -542,22 +2080,1023 @@ def error(message, errno = None):
         print("[error]: "+message, file=sys.stderr)
     sys.exit(1)
 
-def getkeys(path, zone):
+class KeyIndex:
+    '''Parsed metadata of the key files of a directory, kept in the
+    directory between runs. A key file is only parsed again if its
+    inode, size or modification time changed.'''
+    filename = '.dnssec-rollover-index.json'
+    version = 2
+    enabled = False
+    indexes = {}
+    indexes_lock = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path
+        self.indexfile = os.path.join(path, self.filename)
+        self.entries = {}
+        self.changed = False
+        self.lock = threading.Lock()
+        try:
+            with open(self.indexfile) as filedesc:
+                index = json.load(filedesc)
+            if index['version'] == self.version:
+                self.entries = index['keys']
+            else:
+                self.changed = True
+        except (OSError, ValueError, KeyError, TypeError):
+            self.changed = True
+    @classmethod
+    def open(cls, path):
+        '''Return index of directory, shared within the run'''
+        path = os.path.normpath(str(path))
+        with cls.indexes_lock:
+            if path not in cls.indexes:
+                cls.indexes[path] = cls(path)
+            return cls.indexes[path]
+    @classmethod
+    def save_all(cls):
+        '''Write all changed indexes'''
+        with cls.indexes_lock:
+            for key_index in cls.indexes.values():
+                try:
+                    key_index.save()
+                except OSError as e:
+                    warning('Unable to write ' + key_index.indexfile, e.errno)
+    def key(self, keyfile):
+        '''Return DNSSECKey of key file'''
+        stat = os.stat(keyfile)
+        signature = [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+        name = os.path.basename(keyfile)
+        with self.lock:
+            entry = self.entries.get(name)
+        if entry and entry[:3] == signature:
+            return DNSSECKey.from_fields(keyfile, entry[3])
+        dnssec_key = DNSSECKey(keyfile)
+        with self.lock:
+            self.entries[name] = signature + [dnssec_key.fields()]
+            self.changed = True
+        return dnssec_key
+    def save(self):
+        '''Write index if changed, forgetting vanished key files'''
+        with self.lock:
+            if not self.changed:
+                return
+            existing = set(os.listdir(self.path))
+            self.entries = dict(
+                x for x in self.entries.items() if x[0] in existing)
+            temporary = self.indexfile + '.tmp'
+            with open(temporary, 'w') as filedesc:
+                json.dump(
+                    {'version': self.version, 'keys': self.entries},
+                    filedesc)
+            os.replace(temporary, self.indexfile)
+            self.changed = False
+
+class KeyPool:
+    '''Keys generated ahead of time without timing metadata, one
+    subdirectory per algorithm, size and key type. A rollover claims
+    a pooled key for its zone instead of waiting for dnssec-keygen,
+    the pool is refilled in the background after the rollovers of a
+    run. One fill runs at a time, guarded by a lock file in the pool.'''
+    owner = 'pool.invalid.'
+    lock_name = '.fill.lock'
+    log_name = 'fill.log'
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.used = set()
+        self.lock = threading.Lock()
+        self.process = None
+    def directory(self, algorithm, bits, keytype):
+        '''Directory of pooled keys of a kind'''
+        return os.path.join(self.path, '{0}-{1}-{2}'.format(
+            algorithm, bits, 'KSK' if keytype == 'key' else 'ZSK'))
+    def register(self, algorithm, bits, keytype):
+        '''Keep keys of a kind in use by a rollover in the pool'''
+        with self.lock:
+            self.used.add((algorithm, str(bits), keytype))
+    def prepare(self):
+        '''Create the directories of the kinds in use, so that a fill in
+        another process keeps them filled'''
+        for algorithm, bits, keytype in sorted(self.used):
+            pool_directory = self.directory(algorithm, bits, keytype)
+            try:
+                os.makedirs(pool_directory, exist_ok=True)
+            except OSError as e:
+                warning('Unable to create ' + pool_directory, e.errno)
+    def fill_background(self, arguments):
+        '''Start a fill in a separate process running the tool with
+        arguments, its messages go to the fill log of the pool. Nothing
+        is started while the fill started before is still running.'''
+        if self.process and self.process.poll() is None:
+            return
+        self.prepare()
+        try:
+            with open(os.path.join(self.path, self.log_name), 'a') as log:
+                self.process = Popen(
+                    [sys.executable, os.path.abspath(__file__),
+                     '--fill-pool', '--key-pool', self.path,
+                     '--pool-size', str(self.size)] + arguments,
+                    stdin=DEVNULL, stdout=log, stderr=log,
+                    start_new_session=True)
+        except OSError as e:
+            warning('Unable to start refilling key pool ' + self.path +
+                    ': ' + str(e))
+    def kinds(self):
+        '''(algorithm, bits, keytype) of all kinds kept in the pool'''
+        kinds = set(self.used)
+        try:
+            for entry in os.scandir(self.path):
+                fields = entry.name.split('-')
+                if entry.is_dir() and len(fields) == 3 and \
+                        fields[2] in ('KSK', 'ZSK'):
+                    kinds.add((
+                        fields[0],
+                        fields[1],
+                        'key' if fields[2] == 'KSK' else 'zone'))
+        except OSError:
+            pass
+        return sorted(kinds)
+    def claim(self, algorithm, bits, keytype, zone, directory, timing):
+        '''Move a pooled key to the key directory of zone with timing
+        metadata set, return its key file or None if the pool has no
+        key of that kind'''
+        self.register(algorithm, bits, keytype)
+        pool_directory = self.directory(algorithm, bits, keytype)
+        try:
+            filenames = sorted(os.listdir(pool_directory))
+        except OSError:
+            return None
+        for filename in filenames:
+            matchresult = KEY_FILENAME.match(filename)
+            if not matchresult:
+                continue
+            basename = os.path.join(directory, 'K{0}+{1}+{2}'.format(
+                zone.rstrip('.') + '.',
+                matchresult.group(2),
+                matchresult.group(3)))
+            if os.path.exists(basename + '.key'):
+                continue
+            pooled = os.path.join(pool_directory, filename)
+            claimed = '{0}.{1}-{2}'.format(
+                pooled, os.getpid(), threading.get_ident())
+            try:
+                os.rename(pooled, claimed)
+            except OSError:
+                continue
+            try:
+                self.install(claimed, pooled, basename, zone, timing)
+            except OSError as e:
+                # its key material may have been copied, never hand it
+                # out again
+                warning('Unable to install pooled key ' + pooled +
+                        ' for ' + zone + ': ' + str(e))
+                self.discard(claimed, pooled)
+                continue
+            return basename + '.key'
+        return None
+    def install(self, claimed, pooled, basename, zone, timing):
+        '''Write claimed key as the key of zone, remove it from the pool.
+        If writing the key of zone fails, no copy is left behind.'''
+        privatekeyfile = pooled[:-len('.key')] + '.private'
+        with open(claimed) as filedesc:
+            key_lines = filedesc.readlines()
+        with open(privatekeyfile) as filedesc:
+            private_lines = filedesc.readlines()
+        owner = zone.rstrip('.') + '.'
+        for index, line in enumerate(key_lines):
+            if line.startswith('; This is a '):
+                key_lines[index] = line.rsplit(' for ', 1)[0] + \
+                    ' for ' + owner + '\n'
+            elif line.startswith(self.owner):
+                key_lines[index] = owner + line[len(self.owner):]
+        write_new_file(
+            basename + '.private',
+            ''.join(rewrite_timing(private_lines, timing, '')),
+            os.stat(privatekeyfile).st_mode & 0o777)
+        try:
+            write_new_file(
+                basename + '.key',
+                ''.join(rewrite_timing(key_lines, timing, '; ')),
+                os.stat(claimed).st_mode & 0o777)
+        except OSError:
+            os.unlink(basename + '.private')
+            raise
+        self.discard(claimed, pooled)
+    @staticmethod
+    def discard(claimed, pooled):
+        '''Remove a claimed key from the pool'''
+        for path in (claimed, pooled[:-len('.key')] + '.private'):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                warning('Unable to remove pooled key file ' + path +
+                        ': ' + str(e))
+    def spares(self, algorithm, bits, keytype):
+        '''Number of pooled keys of a kind'''
+        try:
+            return len([
+                x for x in os.listdir(
+                    self.directory(algorithm, bits, keytype))
+                if KEY_FILENAME.match(x)
+            ])
+        except OSError:
+            return 0
+    def fill(self, keygen, jobs = 1):
+        '''Generate keys until every kind has size spare keys, keygen
+        runs a dnssec-keygen command. Return number of keys generated,
+        0 if another fill is running.'''
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            lock = open(os.path.join(self.path, self.lock_name), 'a')
+        except OSError as e:
+            warning('Unable to lock key pool ' + self.path + ': ' + str(e))
+            return 0
+        with lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return 0
+            return self._fill(keygen, jobs)
+    def _fill(self, keygen, jobs):
+        commands = []
+        for algorithm, bits, keytype in self.kinds():
+            pool_directory = self.directory(algorithm, bits, keytype)
+            try:
+                os.makedirs(pool_directory, exist_ok=True)
+            except OSError as e:
+                warning('Unable to create ' + pool_directory, e.errno)
+                continue
+            arguments = [
+                'dnssec-keygen', '-K', pool_directory, '-G', '-n', 'ZONE'
+            ] + algorithm_arguments(algorithm, int(bits))
+            if keytype == 'key':
+                arguments += ['-f', 'KSK']
+            commands += [arguments + [self.owner]] * (
+                self.size - self.spares(algorithm, bits, keytype))
+        def generate(arguments):
+            try:
+                keygen(arguments)
+            except (CalledProcessError, OSError) as e:
+                warning('Unable to generate pool key in ' +
+                        arguments[2] + ': ' + str(e))
+                return 0
+            return 1
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            return sum(executor.map(generate, commands))
+
+class Inotify:
+    '''Minimal inotify binding through ctypes'''
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM  = 0x00000040
+    IN_MOVED_TO    = 0x00000080
+    IN_DELETE      = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF   = 0x00000800
+    IN_Q_OVERFLOW  = 0x00004000
+    IN_IGNORED     = 0x00008000
+    IN_NONBLOCK    = 0o4000
+    IN_CLOEXEC     = 0o2000000
+    event_header = struct.Struct('iIII')
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(
+            ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(
+            self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+    def add_watch(self, path, mask):
+        '''Watch path for events in mask, return watch descriptor'''
+        watch = self.libc.inotify_add_watch(
+            self.fd, os.fsencode(path), ctypes.c_uint32(mask))
+        if watch < 0:
+            error_number = ctypes.get_errno()
+            raise OSError(error_number, os.strerror(error_number), path)
+        return watch
+    def read(self):
+        '''List of pending (watch descriptor, mask, name) events'''
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                watch, mask, _cookie, length = \
+                    self.event_header.unpack_from(data, offset)
+                offset += self.event_header.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                events.append((watch, mask, os.fsdecode(name)))
+    def close(self):
+        os.close(self.fd)
+
+class KeyWatcher:
+    '''Key files of watched directories kept in memory. Changes are
+    picked up through inotify where available, otherwise directories
+    are rescanned every poll_interval seconds and once per pass when
+    their keys are requested. Keys are kept per directory in buckets by
+    zone. Changes are reported as (directory, zone) pairs, zone None
+    standing for all zones of the directory.'''
+    events = Inotify.IN_CLOSE_WRITE | Inotify.IN_MOVED_FROM | \
+        Inotify.IN_MOVED_TO | Inotify.IN_DELETE | \
+        Inotify.IN_DELETE_SELF | Inotify.IN_MOVE_SELF
+    current = None
+
+    def __init__(self, poll_interval = 60, use_inotify = True):
+        self.poll_interval = poll_interval
+        self.directories = {}
+        self.signatures = {}
+        self.watches = {}
+        self.polled = set()
+        self.scanned = set()
+        self.changed = set()
+        self.lock = threading.RLock()
+        self.inotify = None
+        if use_inotify:
+            try:
+                self.inotify = Inotify()
+            except (OSError, AttributeError, TypeError):
+                pass
+    def watch(self, directory):
+        '''Start keeping the key files of directory'''
+        directory = os.path.normpath(directory)
+        with self.lock:
+            if directory in self.directories:
+                return
+            self.directories[directory] = {}
+            self.signatures[directory] = {}
+            try:
+                self.watches[
+                    self.inotify.add_watch(directory, self.events)
+                ] = directory
+            except (AttributeError, OSError):
+                self.polled.add(directory)
+            self.scan(directory)
+    def keys(self, directory, zone):
+        '''Keys of zone in directory sorted by file name'''
+        directory = os.path.normpath(directory)
+        self.watch(directory)
+        self.apply()
+        with self.lock:
+            if directory in self.polled and directory not in self.scanned:
+                self.scanned.add(directory)
+                self.changed.update(self.scan(directory))
+            entries = self.directories[directory].get(
+                zone.rstrip('.').lower(), {})
+            return [entries[x] for x in sorted(entries)]
+    def new_pass(self):
+        '''Start a pass over the zones: polled directories are scanned
+        again when their keys are requested and DS TTLs are looked up
+        again'''
+        with self.lock:
+            self.scanned = set()
+            for buckets in self.directories.values():
+                for entries in buckets.values():
+                    for dnssec_key in entries.values():
+                        dnssec_key.ds_ttl = None
+    def scan(self, directory):
+        '''Bring the keys of directory up to date with a full directory
+        read, return the (directory, zone) pairs of changed key files'''
+        signatures = {}
+        try:
+            for entry in os.scandir(directory):
+                if entry.name.endswith('.key') and entry.is_file():
+                    stat = entry.stat()
+                    signatures[entry.name] = (
+                        stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            pass
+        with self.lock:
+            old_signatures = self.signatures[directory]
+            changed = set()
+            for name in set(old_signatures) | set(signatures):
+                if old_signatures.get(name) != signatures.get(name):
+                    self.update(directory, name)
+                    changed.add((directory, keyfile_zone(name)))
+            self.signatures[directory] = signatures
+            return changed
+    def update(self, directory, name):
+        '''Read key file name of directory again or forget it if gone'''
+        keyfile = os.path.join(directory, name)
+        dnssec_key = None
+        try:
+            if KeyIndex.enabled:
+                dnssec_key = KeyIndex.open(directory).key(keyfile)
+            else:
+                dnssec_key = DNSSECKey(keyfile)
+        except OSError:
+            pass
+        zone = keyfile_zone(name)
+        with self.lock:
+            buckets = self.directories[directory]
+            if dnssec_key:
+                buckets.setdefault(zone, {})[name] = dnssec_key
+            elif zone in buckets:
+                buckets[zone].pop(name, None)
+                if not buckets[zone]:
+                    del buckets[zone]
+    def apply(self):
+        '''Apply pending inotify events'''
+        if not self.inotify:
+            return
+        with self.lock:
+            for watch, mask, name in self.inotify.read():
+                directory = self.watches.get(watch)
+                if mask & Inotify.IN_Q_OVERFLOW:
+                    for scanned in list(self.directories):
+                        self.changed.update(self.scan(scanned))
+                elif directory and mask & (
+                        Inotify.IN_DELETE_SELF | Inotify.IN_MOVE_SELF |
+                        Inotify.IN_IGNORED):
+                    del self.watches[watch]
+                    self.polled.add(directory)
+                    self.changed.add((directory, None))
+                elif directory and name.endswith('.key'):
+                    self.update(directory, name)
+                    self.changed.add((directory, keyfile_zone(name)))
+    def changes(self):
+        '''Apply pending changes, return the (directory, zone) pairs of
+        key files changed since the last call'''
+        self.apply()
+        with self.lock:
+            for directory in self.polled:
+                self.changed.update(self.scan(directory))
+            changed = self.changed
+            self.changed = set()
+        return changed
+    def wait(self, timeout, interrupt = None):
+        '''Wait up to timeout seconds for key file changes, return the
+        changed (directory, zone) pairs. Returns early without changes
+        if the file descriptor interrupt becomes readable.'''
+        deadline = time.monotonic() + timeout
+        while True:
+            changed = self.changes()
+            remaining = deadline - time.monotonic()
+            if changed or remaining <= 0:
+                return changed
+            filedescs = [] if interrupt is None else [interrupt]
+            if self.inotify:
+                filedescs.append(self.inotify.fd)
+            if self.polled:
+                remaining = min(remaining, self.poll_interval)
+            readable = select.select(filedescs, [], [], remaining)[0]
+            if interrupt is not None and interrupt in readable:
+                while True:
+                    try:
+                        if not os.read(interrupt, 4096):
+                            break
+                    except BlockingIOError:
+                        break
+                return changed
+    def close(self):
+        '''Stop watching'''
+        if self.inotify:
+            self.inotify.close()
+            self.inotify = None
+
+def getkeys(path, zone, container = list):
     '''List of valid keys related to a zone from directory'''
-    requestedpath = Path(path)
-    keyfiles = sorted(requestedpath.glob("K"+zone+".*.key"))
-    dnssec_keys = []
-    if not keyfiles:
+    dnssec_keys = container(iterkeys(path, zone))
+    if not dnssec_keys:
         error(
             "Unable to get keys for zone "+zone+" in directory '"+path+"'",
             errno.ENOENT
         )
-    for keyfile in keyfiles:
-        dnssec_key = DNSSECKey(keyfile)
-        if dnssec_key:
-            dnssec_keys.append(dnssec_key)
     return dnssec_keys
 
+def iterkeys(path, zone):
+    '''Generate valid keys related to a zone from directory'''
+    if KeyWatcher.current:
+        for dnssec_key in KeyWatcher.current.keys(path, zone):
+            yield dnssec_key
+        return
+    key_index = KeyIndex.open(path) if KeyIndex.enabled else None
+    for keyfile in KeyScanner.keyfiles(path, zone):
+        if key_index:
+            dnssec_key = key_index.key(str(keyfile))
+        else:
+            dnssec_key = DNSSECKey(keyfile)
+        if dnssec_key:
+            yield dnssec_key
+
+def findkeys(path, zone):
+    '''List of valid keys related to a zone from directory,
+    empty if there are none'''
+    return list(iterkeys(path, zone))
+
+KEY_FILENAME = re.compile(r'^K(.+)\.\+(\d{3})\+(\d{5})\.key$')
+
+def keyfile_zone(filename):
+    '''Zone of a key file name in lower case, None if it is not the
+    name of a key file'''
+    matchresult = KEY_FILENAME.match(filename)
+    if matchresult:
+        return matchresult.group(1).lower()
+
+class KeyScanner:
+    '''Key file names of directories, read in one pass and bucketed by
+    zone. A directory is read again once its modification time changed,
+    i.e. after key files were added, renamed or removed. Modification
+    times are coarse, so the read of a directory changed within
+    mtime_granularity seconds before it is not kept.'''
+    scans = {}
+    lock = threading.Lock()
+    mtime_granularity = 2
+
+    @staticmethod
+    def scan(path):
+        '''Key file names of directory by lower case zone'''
+        buckets = {}
+        with os.scandir(path) as entries:
+            for entry in entries:
+                zone = keyfile_zone(entry.name)
+                if zone is not None:
+                    buckets.setdefault(zone, []).append(entry.name)
+        for filenames in buckets.values():
+            filenames.sort()
+        return buckets
+    @classmethod
+    def buckets(cls, path):
+        '''Key file names of directory by lower case zone, empty if
+        the directory is not readable'''
+        key = os.path.normpath(str(path))
+        try:
+            mtime = os.stat(key).st_mtime_ns
+        except OSError:
+            return {}
+        with cls.lock:
+            scan = cls.scans.get(key)
+        if not scan or scan[0] != mtime:
+            scan_time = time.time_ns()
+            try:
+                scan = (mtime, cls.scan(key))
+            except OSError:
+                return {}
+            with cls.lock:
+                # a file added in the same clock tick would not change
+                # the modification time again
+                if mtime < scan_time - cls.mtime_granularity * 10**9:
+                    cls.scans[key] = scan
+                else:
+                    cls.scans.pop(key, None)
+        return scan[1]
+    @classmethod
+    def keyfiles(cls, path, zone):
+        '''Sorted key files of zone in directory'''
+        return [
+            Path(path) / x
+            for x in cls.buckets(path).get(zone.rstrip('.').lower(), [])
+        ]
+
+def discover_zones(path):
+    '''List of (zone, directory) for every zone having key files
+    below path'''
+    zones = set()
+    for directory, _subdirectories, _filenames in os.walk(path):
+        for filenames in KeyScanner.buckets(directory).values():
+            zones.add((KEY_FILENAME.match(filenames[0]).group(1), directory))
+    return sorted(zones)
+
+def read_zone_list(filedesc, path):
+    '''List of (zone, directory, algorithm, bits) from lines
+    "zone [directory] [algorithm] [bits]", directory defaults to path,
+    algorithm and bits to those of the run'''
+    algorithms = set(DNSSEC_ALGORITHMS.values())
+    zones = []
+    for line in filedesc:
+        fields = line.split('#', 1)[0].split()
+        if not fields:
+            continue
+        directory = path
+        algorithm = None
+        bits = None
+        for field in fields[1:]:
+            if field.upper() in algorithms:
+                algorithm = field.upper()
+            elif field.isdigit():
+                bits = int(field)
+            else:
+                directory = field
+        if not directory:
+            error('No key directory for zone ' + fields[0])
+        if bits and not algorithm:
+            error('Key size without algorithm for zone ' + fields[0])
+        zones.append((fields[0].rstrip('.'), directory, algorithm, bits))
+    return zones
+
+class ZoneReport:
+    '''Outcome of processing a zone in a run'''
+    def __init__(self, zone, directory):
+        self.zone = zone
+        self.directory = directory
+        self.keys = 0
+        self.new_keys = []
+        self.deleted_keys = []
+        self.notifications = []
+        self.error = None
+        self.next_event = None
+    def add(self, dnssec_rollover):
+        '''Collect actions of a rollover'''
+        self.new_keys += dnssec_rollover.new_keys
+        self.deleted_keys += dnssec_rollover.deleted_keys
+        self.notifications += dnssec_rollover.notifications
+        if dnssec_rollover.dnssec_keys:
+            deadline = to_timestamp(dnssec_rollover.next_key_generation())
+            # a deadline already passed means the key generation failed
+            # or waits for something, retry after max_sleep
+            if deadline is not None and \
+                    deadline > to_timestamp(dnssec_rollover.now):
+                self.add_event(deadline)
+    def add_event(self, timestamp):
+        '''Note an upcoming event of the zone at epoch timestamp'''
+        if timestamp is not None and (
+                self.next_event is None or timestamp < self.next_event):
+            self.next_event = timestamp
+    def add_transitions(self, dnssec_keys, now):
+        '''Note the next timing event of the keys after now'''
+        current_time = to_timestamp(now)
+        for dnssec_key in dnssec_keys:
+            for timestamp in dnssec_key.timing().values():
+                if timestamp is not None and timestamp > current_time:
+                    self.add_event(timestamp)
+    def __str__(self):
+        if self.error:
+            return '{0.zone}: error: {0.error}'.format(self)
+        return '{0.zone}: {0.keys} keys, {1} generated, {2} deleted, ' \
+            '{3} notifications'.format(
+                self,
+                len(self.new_keys),
+                len(self.deleted_keys),
+                len(self.notifications))
+
+async def prefetch(zone_contexts, ds_cache, ds = True, soa = True):
+    '''Look up DS and SOA records of all zones concurrently. DS records
+    go to ds_cache, SOA params to the zone contexts.'''
+    lookups = []
+    if ds:
+        lookups += [
+            ds_cache.rrset_async(x.zone, x.resolver) for x in zone_contexts
+        ]
+    if soa:
+        lookups += [x.soa_params_async() for x in zone_contexts]
+    await asyncio.gather(*lookups, return_exceptions=True)
+
+def rollover_zone(args, zone_context, directory, dnssec_keys, now = None):
+    '''Perform the requested rollovers on keys of a zone'''
+    report = ZoneReport(zone_context.zone, directory)
+    report.keys = len(dnssec_keys)
+    email_from, email_to = args.email or (None, None)
+    if args.zskroll:
+        report.add(DNSSECRollover(
+            'zone',
+            args.zskroll[0],
+            args.zskroll[1],
+            email_from,
+            email_to,
+            args.owner,
+            dnssec_keys,
+            DNSSECKey.ds_cache,
+            zone_context,
+            now))
+    if args.kskroll:
+        report.add(DNSSECRollover(
+            'key',
+            args.kskroll[0],
+            args.kskroll[1],
+            email_from,
+            email_to,
+            args.owner,
+            dnssec_keys,
+            DNSSECKey.ds_cache,
+            zone_context,
+            now))
+    return report
+
+SORT_ATTRIBUTES = {
+    'C': 'created',
+    'P': 'publish',
+    'A': 'activate',
+    'R': 'revoke',
+    'I': 'inactive',
+    'D': 'delete'
+}
+
+SORT_FIELDS = tuple(SORT_ATTRIBUTES.values()) + (
+    'type', 'status', 'zone', 'keyid', 'algorithm')
+
+def sort_order(value):
+    '''Parse a comma separated list of sort fields, a leading - sorts
+    descending. Timing fields may be given by their -p letter.'''
+    order = []
+    for field in value.split(','):
+        descending = field.startswith('-')
+        field = field.lstrip('-').strip()
+        field = SORT_ATTRIBUTES.get(field, field)
+        if field not in SORT_FIELDS:
+            raise argparse.ArgumentTypeError(
+                "unknown sort field '" + field + "', fields are " +
+                ', '.join(SORT_FIELDS))
+        order.append((field, descending))
+    return order
+
+class KeySelection:
+    '''Order of a key listing as a list of (field, descending) and the
+    accepted statuses, key types and zones, all keys if None'''
+    def __init__(self, order = (), statuses = None, keytypes = None,
+                 zones = None):
+        self.order = list(order or ())
+        self.statuses = set(statuses) if statuses else None
+        self.keytypes = set(keytypes) if keytypes else None
+        self.zones = set(x.lower().rstrip('.') for x in zones) \
+            if zones else None
+    @classmethod
+    def from_arguments(cls, args):
+        '''Selection of the command line. -p sorts by a timing field,
+        then key type and status. Text listings default to -p P.'''
+        order = args.sort
+        if not order and (args.print or args.format == 'text'):
+            order = [(SORT_ATTRIBUTES[args.print or 'P'], False),
+                     ('type', False), ('status', False)]
+        return cls(order, args.status, args.type, args.zone)
+    def filters(self):
+        '''(field, accepted values) of the filters in use'''
+        return [x for x in (('zone', self.zones),
+                            ('type', self.keytypes),
+                            ('status', self.statuses)) if x[1]]
+    def includes_zone(self, zone):
+        '''Return whether keys of zone may be selected'''
+        return not self.zones or zone.lower().rstrip('.') in self.zones
+    def matches(self, dnssec_key, current_time = None):
+        '''Return whether a key passes the filters'''
+        return self.includes_zone(dnssec_key.key_name or '') and \
+            (not self.keytypes or dnssec_key.keytype in self.keytypes) and \
+            (not self.statuses or
+             dnssec_key.status(current_time) in self.statuses)
+    def apply(self, dnssec_keys, current_time = None):
+        '''Iterate over the selected keys in order. Without an order keys
+        stream through in the order they are read, otherwise they are
+        collected in a KeyTable.'''
+        if self.order:
+            if not isinstance(dnssec_keys, KeyTable):
+                dnssec_keys = KeyTable(dnssec_keys)
+            return dnssec_keys.select(self, current_time)
+        return (x for x in dnssec_keys if self.matches(x, current_time))
+
+def format_keys(dnssec_keys, selection, now = None, enrich = ('ds', 'dns')):
+    '''Return the keys of a KeySelection for display'''
+    output = ''
+    for dnssec_key in selection.apply(dnssec_keys, now):
+        output += '-'*75 + '\n' + dnssec_key.display(
+            current_time = now, enrich = enrich) + '\n'
+    return output + '-'*75 + '\n'
+
+KEY_RECORD_FIELDS = (
+    'zone', 'keyid', 'type', 'algorithm', 'bits', 'status',
+    'created', 'publish', 'activate', 'revoke', 'inactive', 'delete',
+    'keyfile', 'privatekeyfile', 'ds', 'ds_in_dns', 'ds_ttl'
+)
+
+class KeyWriter:
+    '''Write key records to stream as they come, as a JSON array, one
+    JSON object per line (ndjson) or CSV with a header line. CSV fields
+    holding a list, e.g. the DS records of a KSK, are joined with ";".'''
+    def __init__(self, output_format, stream = None):
+        self.output_format = output_format
+        self.stream = stream or sys.stdout
+        self.records = 0
+        if output_format == 'csv':
+            self.csv_writer = csv.DictWriter(
+                self.stream, KEY_RECORD_FIELDS, extrasaction='ignore')
+    def write(self, record):
+        '''Write a record'''
+        if self.output_format == 'json':
+            self.stream.write(
+                (',\n' if self.records else '[\n') + json.dumps(record))
+        elif self.output_format == 'ndjson':
+            self.stream.write(json.dumps(record) + '\n')
+        elif self.output_format == 'csv':
+            if not self.records:
+                self.csv_writer.writeheader()
+            self.csv_writer.writerow(dict(
+                (x, ';'.join(y) if isinstance(y, list) else y)
+                for x, y in record.items()))
+        self.records += 1
+    def close(self):
+        '''Finish the output'''
+        if self.output_format == 'json':
+            self.stream.write('\n]\n' if self.records else '[]\n')
+        self.stream.flush()
+
+def key_records(dnssec_keys, selection = None, now = None, enrich = ()):
+    '''Generate records of the keys of a KeySelection, all keys in the
+    order they are read without one'''
+    if selection:
+        dnssec_keys = selection.apply(dnssec_keys, now)
+    for dnssec_key in dnssec_keys:
+        yield dnssec_key.record(now, enrich)
+
+def process_zone(args, zone_context, directory, now = None):
+    '''Process a zone of a batch run, return report and key display,
+    a list of key records for structured output formats'''
+    zone = zone_context.zone
+    report = ZoneReport(zone, directory)
+    output = ''
+    try:
+        dnssec_keys = findkeys(directory, zone)
+        if not dnssec_keys:
+            report.error = "no keys in directory '" + directory + "'"
+            return report, output
+        if(args.zskroll or args.kskroll):
+            report = rollover_zone(
+                args, zone_context, directory, dnssec_keys, now)
+        report.add_transitions(dnssec_keys, now or datetime.now())
+        listing = args.listing and args.selection.includes_zone(zone)
+        if(listing and args.format != 'text'):
+            output = list(key_records(
+                iterkeys(directory, zone),
+                args.selection,
+                now,
+                args.enrich))
+        elif(listing):
+            output = '='*75 + '\n' + zone + '\n' + format_keys(
+                iterkeys(directory, zone),
+                args.selection,
+                now,
+                args.enrich)
+    except Exception as e:
+        report.error = repr(e)
+    return report, output
+
+def process_zones(args, zones, zone_contexts, now):
+    '''Process (zone, directory) pairs with up to jobs zones at a time,
+    print key displays in zone order and return the zone reports'''
+    ds_lookups = bool(args.kskroll or args.enrich & {'dns', 'ttl'})
+    if(args.zskroll or ds_lookups):
+        asyncio.run(prefetch(
+            [zone_contexts[x[0]] for x in zones],
+            DNSSECKey.ds_cache,
+            ds_lookups,
+            bool(args.zskroll or args.kskroll)))
+    writer = KeyWriter(args.format) if args.format != 'text' else None
+    reports = []
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        for report, output in executor.map(
+                lambda x: process_zone(
+                    args, zone_contexts[x[0]], x[1], now),
+                zones):
+            if writer:
+                for record in output or []:
+                    writer.write(record)
+            else:
+                print(output, end='')
+            reports.append(report)
+    if writer:
+        writer.close()
+    KeyIndex.save_all()
+    return reports
+
+class TransitionScheduler:
+    '''Min-heap of the next key transition or rollover deadline of each
+    zone. Rescheduling a zone leaves its old entry in the heap, entries
+    not matching the zone's current time are skipped.'''
+    def __init__(self):
+        self.heap = []
+        self.scheduled = {}
+    def schedule(self, zone, timestamp):
+        '''Set the next event of zone to epoch timestamp'''
+        self.scheduled[zone] = timestamp
+        heapq.heappush(self.heap, (timestamp, zone))
+    def next_event(self):
+        '''Epoch timestamp of the earliest event, None if none'''
+        while self.heap and \
+                self.scheduled.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        if self.heap:
+            return self.heap[0][0]
+    def pop_due(self, timestamp):
+        '''Remove and return zones with an event up to timestamp'''
+        zones = []
+        while self.next_event() is not None and \
+                self.heap[0][0] <= timestamp:
+            zone = heapq.heappop(self.heap)[1]
+            del self.scheduled[zone]
+            zones.append(zone)
+        return zones
+
+def load_zones(args):
+    '''List of (zone, directory, algorithm, bits) selected by the
+    arguments, a zone list file is read again on every call'''
+    if(args.name):
+        return [(args.name, args.directory)]
+    if(args.discover):
+        return discover_zones(args.directory)
+    if args.batch is sys.stdin:
+        if not hasattr(args, 'batch_zones'):
+            args.batch_zones = read_zone_list(args.batch, args.directory)
+        return args.batch_zones
+    with open(args.batch.name) as filedesc:
+        return read_zone_list(filedesc, args.directory)
+
+def daemon(args):
+    '''Process the zones whenever one of them has a key transition or a
+    rollover deadline, after a change of its key files, on SIGHUP and
+    at least every max_sleep seconds. SIGHUP also reloads the zone
+    list. Key files are kept in memory by a KeyWatcher.'''
+    reload_requested = threading.Event()
+    reload_requested.set()
+    signal.signal(
+        signal.SIGHUP, lambda _signum, _frame: reload_requested.set())
+    wakeup_read, wakeup_write = os.pipe()
+    os.set_blocking(wakeup_read, False)
+    os.set_blocking(wakeup_write, False)
+    signal.set_wakeup_fd(wakeup_write)
+    changed = set()
+    while True:
+        current_time = to_timestamp(datetime.now())
+        if reload_requested.is_set():
+            reload_requested.clear()
+            if KeyWatcher.current:
+                KeyWatcher.current.close()
+            KeyWatcher.current = KeyWatcher(args.poll_interval)
+            zones = dict((x[0], x) for x in load_zones(args))
+            zone_contexts = dict(
+                (x[0], ZoneContext(x[0], DNSSECKey.resolver, *x[2:]))
+                for x in zones.values())
+            for zone in zones.values():
+                KeyWatcher.current.watch(zone[1])
+            scheduler = TransitionScheduler()
+            due = set(zones)
+        else:
+            due = set(scheduler.pop_due(current_time))
+            due.update(
+                x[0] for x in zones.values()
+                if (os.path.normpath(x[1]), None) in changed or
+                (os.path.normpath(x[1]), x[0].rstrip('.').lower())
+                in changed)
+        if due:
+            run_time = datetime.now()
+            DNSSECKey.ds_cache = DSCache()
+            DNSSECRollover.owners = {}
+            KeyWatcher.current.new_pass()
+            reports = process_zones(
+                args,
+                [zones[x] for x in sorted(due) if x in zones],
+                zone_contexts,
+                run_time)
+            for report in reports:
+                if(args.zskroll or args.kskroll):
+                    print(report, file=summary_file(args))
+                next_event = to_timestamp(run_time) + args.max_sleep
+                if report.next_event is not None and not report.error:
+                    next_event = min(next_event, report.next_event)
+                scheduler.schedule(report.zone, next_event)
+            sys.stdout.flush()
+            DNSSECRollover.notifier.flush(
+                [x.zone for x in reports if not x.error]
+                if args.kskroll else [])
+            fill_pool(args)
+            KeyWatcher.current.changes()
+        next_event = scheduler.next_event()
+        changed = KeyWatcher.current.wait(
+            args.max_sleep if next_event is None else
+            max(0, next_event - to_timestamp(datetime.now())),
+            wakeup_read)
+
+def fill_pool(args):
+    '''Refill the key pool, if any: in this process if asked to with
+    --fill-pool, running up to jobs key generations concurrently, in a
+    separate process after rollovers'''
+    if not DNSSECRollover.key_pool:
+        return
+    if args.fill_pool:
+        DNSSECRollover.key_pool.fill(DNSSECRollover.keygen, args.jobs)
+    elif args.zskroll or args.kskroll:
+        arguments = ['--jobs', str(args.jobs)]
+        if args.max_keygens:
+            arguments += ['--max-keygens', str(args.max_keygens)]
+        DNSSECRollover.key_pool.fill_background(arguments)
+
+def summary_file(args):
+    '''File for rollover reports: stderr when stdout carries a key
+    listing in a structured format'''
+    if args.listing and args.format != 'text':
+        return sys.stderr
+    return sys.stdout
+
+def positive_int(value):
+    '''argparse type of counts of at least one'''
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(
+            "'" + value + "' is not a positive number")
+    return number
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description='Helps you with handling key rollovers',
@@ -569,17 +3108,33 @@ if __name__ == '__main__':
         'Good generic parameters for rollovers are: '
         'ZSK -> 2592000 432000 KSK -> 15552000 432000'
     )
-    parser.add_argument(
+    zone_selection = parser.add_mutually_exclusive_group(required=True)
+    zone_selection.add_argument(
         '-n',
         '--name',
-        help='Name of the zone for which we will analyse keys.',
-        required=True
+        help='Name of the zone for which we will analyse keys.'
+    )
+    zone_selection.add_argument(
+        '-b',
+        '--batch',
+        help='Process all zones listed in file, - for stdin. '
+        'One zone per line, optionally followed by its key directory.',
+        type=argparse.FileType('r')
+    )
+    zone_selection.add_argument(
+        '--discover',
+        help='Process every zone having key files in the directory tree.',
+        action='store_true'
+    )
+    zone_selection.add_argument(
+        '--fill-pool',
+        help='Only generate keys until the key pool is full.',
+        action='store_true'
     )
     parser.add_argument(
         '-d',
         '--directory',
-        help='Directory where the key files reside.',
-        required=True
+        help='Directory where the key files reside.'
     )
     parser.add_argument(
         '-z',
@@ -621,51 +3176,309 @@ if __name__ == '__main__':
         type=str,
         choices =['C', 'P', 'A', 'R', 'I', 'D']
     )
+    parser.add_argument(
+        '--sort',
+        help='Display the keys ordered by a comma separated list of '
+        'fields: ' + ', '.join(SORT_FIELDS) + ' or the -p letters. '
+        'A leading - sorts descending, e.g. zone,-activate.',
+        type=sort_order
+    )
+    parser.add_argument(
+        '--status',
+        help='Only list keys of this status. '
+        'May be given multiple times.',
+        type=str,
+        choices=[x[1] for x in KEY_STATUSES],
+        action='append'
+    )
+    parser.add_argument(
+        '--type',
+        help='Only list zone signing (zone) or key signing (key) keys.',
+        type=str,
+        choices=list(KEY_TYPES),
+        action='append'
+    )
+    parser.add_argument(
+        '--zone',
+        help='Only list keys of this zone. May be given multiple times.',
+        type=str,
+        action='append'
+    )
+    parser.add_argument(
+        '-f',
+        '--format',
+        help='Output format of the key listing. json, ndjson and csv '
+        'list the keys in the order they are read unless -p or --sort '
+        'is given '
+        'and contain file metadata only, see --enrich.',
+        type=str,
+        choices=['text', 'json', 'ndjson', 'csv'],
+        default='text'
+    )
+    parser.add_argument(
+        '--enrich',
+        help='Add to the key listing: ds the DS records of KSKs, dns '
+        'whether they are in the parent zone, ttl their TTL there. '
+        'May be given multiple times. The text listing has ds and dns '
+        'by default, the other formats none.',
+        type=str,
+        choices=['ds', 'dns', 'ttl'],
+        action='append'
+    )
+    parser.add_argument(
+        '--offline',
+        help='List keys from file metadata only, without DNS lookups.',
+        action='store_true'
+    )
+    parser.add_argument(
+        '-v',
+        '--verbose',
+        help='Print the rollover summary and lookup counts of a single '
+        'zone, batch runs always print them.',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--smtp',
+        help='Send notifications to this SMTP server (host[:port]) '
+        'instead of running sendmail.',
+        type=str
+    )
+    parser.add_argument(
+        '-r',
+        '--resolver',
+        help='DNS lookup backend. native (default) walks down from the '
+        'root servers in-process, dig runs dig +trace for every lookup.',
+        type=str,
+        choices=['native', 'dig'],
+        default='native'
+    )
+    parser.add_argument(
+        '--nameserver',
+        help='Start native lookups at this server instead of the root '
+        'servers. May be given multiple times.',
+        type=str,
+        action='append'
+    )
+    parser.add_argument(
+        '--dns-port',
+        help='Port of the servers queried by the native resolver.',
+        type=int,
+        default=53
+    )
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        help='Number of zones processed concurrently in batch mode.',
+        type=positive_int,
+        default=1
+    )
+    parser.add_argument(
+        '--max-keygens',
+        help='Maximum number of concurrent dnssec-keygen runs, '
+        'unlimited by default.',
+        type=positive_int
+    )
+    parser.add_argument(
+        '--state-dir',
+        help='Directory to keep state between runs in, '
+        'enables the persistent DNS answer cache.',
+        type=str
+    )
+    parser.add_argument(
+        '--renotify-interval',
+        help='With --state-dir, seconds before a notification about a '
+        'key is sent again while its cause persists. Default 86400.',
+        type=int,
+        default=86400
+    )
+    parser.add_argument(
+        '--cache-max-age',
+        help='Maximum seconds to use a cached DNS answer, '
+        'even if its TTL is longer. 0 disables cache lookups.',
+        type=int
+    )
+    parser.add_argument(
+        '--key-index',
+        help='Keep parsed key metadata in an index file in each key '
+        'directory and only parse key files changed since the last run.',
+        action='store_true'
+    )
+    parser.add_argument(
+        '-a',
+        '--algorithm',
+        help='Algorithm of new keys, by default that of the current '
+        'keys of the zone. If the keys of a zone use another algorithm, '
+        'an algorithm rollover is done.',
+        type=str.upper,
+        choices=sorted(set(DNSSEC_ALGORITHMS.values()))
+    )
+    parser.add_argument(
+        '--bits',
+        help='Key size of new RSA keys, by default that of the current '
+        'keys, 2048 for a new algorithm.',
+        type=int
+    )
+    parser.add_argument(
+        '--daemon',
+        help='Keep running and process zones whenever a key transition '
+        'or rollover is due, a key directory changes or on SIGHUP, '
+        'which also reloads the zone list.',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--max-sleep',
+        help='Maximum seconds the daemon waits between runs of a zone, '
+        'e.g. to notice DS changes in the parent zone. Default 3600.',
+        type=int,
+        default=3600
+    )
+    parser.add_argument(
+        '--poll-interval',
+        help='Seconds between rescans of key directories in daemon mode '
+        'where inotify is unavailable. Default 60.',
+        type=int,
+        default=60
+    )
+    parser.add_argument(
+        '--key-pool',
+        help='Directory of keys generated ahead of time. Rollovers take '
+        'new keys from it and it is refilled in the background after '
+        'the run.',
+        type=str
+    )
+    parser.add_argument(
+        '--pool-size',
+        help='Number of spare keys kept in the key pool for every '
+        'algorithm, size and key type in use.',
+        type=int,
+        default=2
+    )
     args=parser.parse_args()
+    args.listing = bool(args.print or args.sort or args.status or
+                        args.type or args.zone or args.format != 'text')
+    if args.offline:
+        if args.zskroll or args.kskroll:
+            error('Rollovers need DNS lookups, not possible with --offline')
+        if args.enrich and set(args.enrich) & {'dns', 'ttl'}:
+            error('DNS enrichment not possible with --offline')
+    elif args.listing and args.format == 'text' and not args.enrich:
+        args.enrich = ['ds', 'dns']
+    args.enrich = set(args.enrich or ())
+    args.selection = KeySelection.from_arguments(args)
+
+    if args.resolver == 'dig':
+        DNSSECKey.resolver = DigResolver()
+    else:
+        DNSSECKey.resolver = DNSResolver(args.nameserver, args.dns_port)
+    if args.state_dir:
+        try:
+            os.makedirs(args.state_dir, exist_ok=True)
+            DNSSECKey.resolver.answer_cache = AnswerCache(
+                os.path.join(args.state_dir, 'dns-cache.sqlite'),
+                args.cache_max_age)
+        except (OSError, sqlite3.Error) as e:
+            error('Unable to open DNS answer cache in ' + args.state_dir +
+                  ': ' + str(e))
+    DNSSECKey.ds_cache = DSCache()
 
+    if args.name or args.discover:
+        if not(args.directory):
+            error('No key directory specified')
     if(args.zskroll):
         if not(args.owner):
             error('No key file owner specified')
-        dnssec_rollover = DNSSECRollover(
-            'zone',
-            args.zskroll[0],
-            args.zskroll[1],
-            args.email[0],
-            args.email[1],
-            args.owner,
-            getkeys(args.directory, args.name))
-
     if(args.kskroll):
         if not(args.email):
             error('No e-mail addresses specified')
         if not(args.owner):
             error('No key file owner specified')
-        dnssec_rollover = DNSSECRollover(
-            'key',
-            args.kskroll[0],
-            args.kskroll[1],
-            args.email[0],
-            args.email[1],
-            args.owner,
-            getkeys(args.directory, args.name))
-    
-    if(args.print):
-        sort_arg = {
-            'C': 'created',
-            'P': 'publish',
-            'A': 'activate',
-            'R': 'revoke',
-            'I': 'inactive',
-            'D': 'delete'
-        }
-        sorting_key = sort_arg[args.print]
-        dnssec_keys = sorted(
-            getkeys(args.directory, args.name),
-            key = lambda x: (
-                eval('x.'+sorting_key) or datetime.fromtimestamp(0),
-                x.keytype,
-                x.status() or ''))
-        for dnssec_key in dnssec_keys:
-            print('-'*75)
-            print(dnssec_key)
-        print('-'*75)
+    if(args.owner):
+        try:
+            DNSSECRollover.owner_ids(args.owner)
+        except KeyError:
+            error('Unknown key file owner ' + args.owner)
+    KeyIndex.enabled = args.key_index
+    run_time = datetime.now()
+    if args.max_keygens:
+        DNSSECRollover.keygen_slots = threading.BoundedSemaphore(
+            args.max_keygens)
+    notice_store = None
+    if args.state_dir:
+        try:
+            notice_store = NoticeStore(
+                os.path.join(args.state_dir, 'notices.sqlite'),
+                args.renotify_interval)
+        except sqlite3.Error as e:
+            error('Unable to open notification state in ' + args.state_dir +
+                  ': ' + str(e))
+    DNSSECRollover.notifier = Notifier(args.smtp, notice_store)
+    DNSSECRollover.key_algorithm = args.algorithm
+    DNSSECRollover.key_bits = args.bits
+    if args.key_pool:
+        DNSSECRollover.key_pool = KeyPool(args.key_pool, args.pool_size)
+    elif args.fill_pool:
+        error('No key pool directory specified')
+
+    if(args.fill_pool):
+        fill_pool(args)
+        sys.exit()
+
+    if(args.daemon):
+        daemon(args)
+
+    if(args.name):
+        if(args.zskroll or args.kskroll):
+            dnssec_keys = getkeys(args.directory, args.name)
+            zone_context = ZoneContext(args.name, DNSSECKey.resolver)
+            asyncio.run(prefetch(
+                [zone_context], DNSSECKey.ds_cache, bool(args.kskroll)))
+            report = rollover_zone(
+                args,
+                zone_context,
+                args.directory,
+                dnssec_keys,
+                run_time)
+            DNSSECRollover.notifier.flush(
+                [args.name] if args.kskroll else [])
+            if(args.verbose):
+                print(report, file=summary_file(args))
+                print('{0} DS lookups, {1} SOA lookups'.format(
+                    DNSSECKey.ds_cache.lookups, zone_context.soa_lookups),
+                    file=summary_file(args))
+        if(args.listing and args.format != 'text'):
+            writer = KeyWriter(args.format)
+            for record in key_records(
+                    getkeys(args.directory, args.name),
+                    args.selection,
+                    run_time,
+                    args.enrich):
+                writer.write(record)
+            writer.close()
+        elif(args.listing):
+            print(format_keys(
+                getkeys(args.directory, args.name, KeyTable),
+                args.selection,
+                run_time,
+                args.enrich), end='')
+        KeyIndex.save_all()
+        fill_pool(args)
+        sys.exit()
+
+    zones = load_zones(args)
+    zone_contexts = dict(
+        (x[0], ZoneContext(x[0], DNSSECKey.resolver, *x[2:]))
+        for x in zones)
+    reports = process_zones(args, zones, zone_contexts, run_time)
+    DNSSECRollover.notifier.flush(
+        [x.zone for x in reports if not x.error] if args.kskroll else [])
+    if(args.zskroll or args.kskroll):
+        for report in reports:
+            print(report, file=summary_file(args))
+        print('{0} zones, {1} failed, {2} DS lookups, '
+            '{3} SOA lookups'.format(
+                len(reports),
+                len([x for x in reports if x.error]),
+                DNSSECKey.ds_cache.lookups,
+                sum(x.soa_lookups for x in zone_contexts.values())),
+            file=summary_file(args))
+    fill_pool(args)
@@ -0,0 +1,54 @@
+'''Known-answer tests of the in-process DS computation'''
+
+import base64
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from dnssec_rollover_tool import DNSSECKey, key_tag
+
+# DNSKEY of RFC 4034 section 5.4, also used by RFC 4509 section 2.3
+PUBLIC_KEY = (
+    'AQOeiiR0GOMYkDshWoSKz9XzfwJr1AYtsmx3TGkJaNXVbfi/2pHm822aJ5iI9BMz'
+    'NXxeYCmZDRD99WYwYqUSdjMmmAphXdvxegXd/M5+X7OrzKBaMbCVdFLUUh6Dhwe'
+    'JBjEVv5f2wwjM9XzcnOf+EPbtG9DMBmADjFDc2w/rljwvFw==')
+RDATA = struct.pack('!HBB', 256, 3, 5) + base64.b64decode(PUBLIC_KEY)
+SHA1_DS = 'dskey.example.com. IN DS 60485 5 1 ' \
+    '2BB183AF5F22588179A53B0A98631FAD1A292118'
+SHA256_DS = 'dskey.example.com. IN DS 60485 5 2 ' \
+    'D4B7D520E7BB5F0F67674A0CCEB1E3E0614B93C4F9E99B8383F6A1E4469DA50A'
+
+class TestDS(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.keyfile = os.path.join(
+            self.directory, 'Kdskey.example.com.+005+60485.key')
+        with open(self.keyfile, 'w') as filedesc:
+            filedesc.write(
+                '; This is a key-signing key, keyid 60485, for '
+                'dskey.example.com.\n'
+                'dskey.example.com. 86400 IN DNSKEY 256 3 5 ' +
+                PUBLIC_KEY + '\n')
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    def test_key_tag(self):
+        self.assertEqual(key_tag(RDATA), 60485)
+    def test_key_file_parsed(self):
+        dnssec_key = DNSSECKey(self.keyfile)
+        self.assertEqual(dnssec_key.dnskey_rdata, RDATA)
+    def test_sha1(self):
+        self.assertEqual(DNSSECKey(self.keyfile).dsfromkey([1]), SHA1_DS)
+    def test_sha256(self):
+        self.assertEqual(DNSSECKey(self.keyfile).dsfromkey([2]), SHA256_DS)
+    def test_default_digest_types(self):
+        self.assertEqual(
+            DNSSECKey(self.keyfile).dsfromkey(),
+            SHA1_DS + '\n' + SHA256_DS)
+
+if __name__ == '__main__':
+    unittest.main()
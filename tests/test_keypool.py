@@ -0,0 +1,53 @@
+'''Tests of the key pool refill'''
+
+import fcntl
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from dnssec_rollover_tool import KeyPool
+
+class TestKeyPoolFill(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.pool = KeyPool(self.directory, 2)
+        self.pool.register('ECDSAP256SHA256', 256, 'zone')
+        self.commands = []
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    def keygen(self, arguments):
+        '''Stand-in for dnssec-keygen writing a key pair'''
+        self.commands.append(arguments)
+        basename = os.path.join(
+            arguments[2], 'K{0}+013+{1:05d}'.format(
+                arguments[-1], len(self.commands)))
+        for suffix in ('.key', '.private'):
+            with open(basename + suffix, 'w'):
+                pass
+        return os.path.basename(basename).encode()
+    def test_fill(self):
+        self.assertEqual(self.pool.fill(self.keygen), 2)
+        self.assertEqual(self.pool.spares('ECDSAP256SHA256', 256, 'zone'), 2)
+        self.assertEqual(self.commands[0][:7], [
+            'dnssec-keygen', '-K',
+            os.path.join(self.directory, 'ECDSAP256SHA256-256-ZSK'),
+            '-G', '-n', 'ZONE', '-a'])
+        self.assertEqual(self.pool.fill(self.keygen), 0)
+    def test_fill_running_elsewhere(self):
+        with open(os.path.join(self.directory, KeyPool.lock_name), 'a') \
+                as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.assertEqual(self.pool.fill(self.keygen), 0)
+        self.assertEqual(self.commands, [])
+    def test_prepare_keeps_kinds_for_other_processes(self):
+        self.pool.prepare()
+        self.assertEqual(
+            KeyPool(self.directory, 2).kinds(),
+            [('ECDSAP256SHA256', '256', 'zone')])
+
+if __name__ == '__main__':
+    unittest.main()
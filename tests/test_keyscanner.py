@@ -0,0 +1,44 @@
+'''Tests of the cached key directory reads'''
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from dnssec_rollover_tool import KeyScanner
+
+class TestKeyScanner(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.add('Kexample.com.+013+12345.key')
+    def tearDown(self):
+        KeyScanner.scans.pop(self.directory, None)
+        shutil.rmtree(self.directory)
+    def add(self, name):
+        '''Create a file keeping the directory modification time, as if
+        it was created in the same clock tick as the last change'''
+        stat = os.stat(self.directory)
+        open(os.path.join(self.directory, name), 'w').close()
+        os.utime(self.directory, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    def names(self):
+        return KeyScanner.buckets(self.directory).get('example.com')
+    def test_file_added_in_same_tick(self):
+        self.assertEqual(self.names(), ['Kexample.com.+013+12345.key'])
+        self.add('Kexample.com.+013+54321.key')
+        self.assertEqual(self.names(), ['Kexample.com.+013+12345.key',
+                                        'Kexample.com.+013+54321.key'])
+    def test_settled_directory_read_once(self):
+        past = time.time() - 3600
+        os.utime(self.directory, (past, past))
+        self.assertEqual(self.names(), ['Kexample.com.+013+12345.key'])
+        self.add('Kexample.com.+013+54321.key')
+        self.assertEqual(self.names(), ['Kexample.com.+013+12345.key'])
+        os.utime(self.directory)
+        self.assertEqual(len(self.names()), 2)
+
+if __name__ == '__main__':
+    unittest.main()
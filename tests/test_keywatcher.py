@@ -0,0 +1,92 @@
+'''Tests of the in-memory key files of the daemon'''
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from dnssec_rollover_tool import KeyWatcher
+
+KEY = '''; This is a zone-signing key, keyid {1}, for {0}.
+; Created: 20230101000000 (Sun Jan  1 00:00:00 2023)
+{0}. IN DNSKEY 256 3 13 8NGUfdGe7jELzUEtZlgOEWMd3sLnA777v4IWFD9cn8ZK9u7lDGJX\
+grDO9PhLsnnso854xMZxxzHzU14eko8NPQ==
+'''
+
+class KeyWatcherTests:
+    '''Tests run with inotify and with polling'''
+    use_inotify = True
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.write_key('example.com', 12345)
+        self.write_key('example.org', 23456)
+        self.watcher = KeyWatcher(poll_interval=1,
+                                  use_inotify=self.use_inotify)
+        self.watcher.watch(self.directory)
+    def tearDown(self):
+        self.watcher.close()
+        shutil.rmtree(self.directory)
+    def write_key(self, zone, keyid):
+        path = os.path.join(
+            self.directory, 'K{0}.+013+{1}.key'.format(zone, keyid))
+        with open(path, 'w') as filedesc:
+            filedesc.write(KEY.format(zone, keyid))
+        return path
+    def test_change_maps_to_zone(self):
+        self.write_key('example.org', 34567)
+        changed = self.watcher.wait(5)
+        self.assertEqual(changed, {(self.directory, 'example.org')})
+        dnssec_keys = self.watcher.keys(self.directory, 'example.org')
+        self.assertEqual([x.keyid for x in dnssec_keys], ['23456', '34567'])
+    def test_deleted_key_forgotten(self):
+        os.unlink(self.write_key('example.org', 34567))
+        os.unlink(os.path.join(
+            self.directory, 'Kexample.org.+013+23456.key'))
+        self.watcher.wait(5)
+        self.watcher.new_pass()
+        self.assertEqual(self.watcher.keys(self.directory, 'example.org'), [])
+        self.assertEqual(
+            len(self.watcher.keys(self.directory, 'Example.COM.')), 1)
+    def test_ds_ttl_cleared_per_pass(self):
+        dnssec_key = self.watcher.keys(self.directory, 'example.com')[0]
+        dnssec_key.ds_ttl = 3600
+        self.watcher.new_pass()
+        self.assertIsNone(dnssec_key.ds_ttl)
+
+class TestKeyWatcherInotify(KeyWatcherTests, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        if not self.watcher.inotify:
+            self.tearDown()
+            self.skipTest('needs inotify')
+
+class TestKeyWatcherPolling(KeyWatcherTests, unittest.TestCase):
+    use_inotify = False
+    def test_scanned_once_per_pass(self):
+        self.watcher.new_pass()
+        with mock.patch.object(
+                self.watcher, 'scan', wraps=self.watcher.scan) as scan:
+            self.watcher.keys(self.directory, 'example.com')
+            self.watcher.keys(self.directory, 'example.org')
+            self.assertEqual(scan.call_count, 1)
+            self.watcher.new_pass()
+            self.watcher.keys(self.directory, 'example.com')
+            self.assertEqual(scan.call_count, 2)
+    def test_new_key_seen_in_next_pass(self):
+        self.watcher.new_pass()
+        self.watcher.keys(self.directory, 'example.com')
+        time.sleep(0.01)
+        self.write_key('example.com', 45678)
+        self.watcher.new_pass()
+        self.assertEqual(
+            len(self.watcher.keys(self.directory, 'example.com')), 2)
+        self.assertEqual(
+            self.watcher.changes(), {(self.directory, 'example.com')})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+'''Tests of the key listings'''
+
+import csv
+import io
+import os
+import sys
+import unittest
+from datetime import datetime
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from dnssec_rollover_tool import (
+    DNSSECKey,
+    KeySelection,
+    KeyWriter,
+    format_keys,
+    key_records
+)
+
+DATA = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'data', 'settime', 'after')
+ZSK = os.path.join(DATA, 'Kexample.com.+013+12345.key')
+KSK = os.path.join(DATA, 'Kexample.com.+013+54321.key')
+
+class TestFormatKeys(unittest.TestCase):
+    def test_status_of_snapshot_time(self):
+        '''The ZSK is inactive from 2023-02-01 on, a listing as of
+        January selects and shows it as active'''
+        now = datetime(2023, 1, 15)
+        output = format_keys(
+            [DNSSECKey(ZSK)], KeySelection(statuses=['activated']), now, ())
+        self.assertIn(' activated', output)
+        self.assertNotIn('inactivated', output)
+
+class TestKeyWriter(unittest.TestCase):
+    def test_csv_ds_records_separable(self):
+        dnssec_key = DNSSECKey(KSK)
+        stream = io.StringIO()
+        writer = KeyWriter('csv', stream)
+        for record in key_records([dnssec_key], enrich={'ds'}):
+            writer.write(record)
+        writer.close()
+        stream.seek(0)
+        rows = list(csv.DictReader(stream))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['ds'].split(';'),
+                         dnssec_key.dsfromkey().split('\n'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+'''Tests of the notices remembered between runs'''
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from dnssec_rollover_tool import NoticeStore
+
+NOTICE = 'DS record insertion required'
+
+class TestNoticeStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'notices.sqlite')
+        store = NoticeStore(self.path, 86400)
+        store.sent([('example.com', '12345', NOTICE),
+                    ('example.com', '54321', NOTICE)])
+        self.store = NoticeStore(self.path, 86400)
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    def stored(self):
+        return sorted(x[0] for x in self.store.connection.execute(
+            'SELECT keyid FROM notices'))
+    def test_recent_notice_not_due(self):
+        self.assertFalse(self.store.due('example.com', '12345', NOTICE))
+        self.assertTrue(self.store.due('example.org', '12345', NOTICE))
+    def test_prune_forgets_notices_not_raised(self):
+        self.store.due('example.com', '12345', NOTICE)
+        self.store.prune({'example.com'})
+        self.assertEqual(self.stored(), ['12345'])
+    def test_prune_keeps_notices_of_kept_keys(self):
+        self.store.keep('example.com', '54321')
+        self.store.prune({'example.com'})
+        self.assertEqual(self.stored(), ['54321'])
+        self.store.prune({'example.com'})
+        self.assertEqual(self.stored(), [])
+    def test_prune_other_zones_untouched(self):
+        self.store.prune({'example.org'})
+        self.assertEqual(self.stored(), ['12345', '54321'])
+
+if __name__ == '__main__':
+    unittest.main()
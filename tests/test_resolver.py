@@ -0,0 +1,246 @@
+'''Tests of the DNS message parser and the iterative resolver against
+stand-in authoritative servers on loopback addresses'''
+
+import asyncio
+import os
+import socket
+import struct
+import sys
+import threading
+import unittest
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from dnssec_rollover_tool import (
+    DNSError,
+    DNSMessage,
+    DNSResolver,
+    RR_TYPES,
+    encode_name,
+    is_subdomain,
+    soa_params
+)
+
+SOA = 'ns.{0} hostmaster.{0} 1 7200 3600 1209600 300'
+
+def encode_rdata(rtype, rdata):
+    '''Wire format of RDATA in presentation format'''
+    if rtype == 'A':
+        return socket.inet_pton(socket.AF_INET, rdata)
+    if rtype == 'AAAA':
+        return socket.inet_pton(socket.AF_INET6, rdata)
+    if rtype == 'NS':
+        return encode_name(rdata)
+    if rtype == 'SOA':
+        fields = rdata.split()
+        return encode_name(fields[0]) + encode_name(fields[1]) + \
+            struct.pack('!IIIII', *[int(x) for x in fields[2:]])
+    if rtype == 'DS':
+        fields = rdata.split()
+        return struct.pack('!HBB', *[int(x) for x in fields[:3]]) + \
+            bytes.fromhex(fields[3])
+    raise ValueError(rtype)
+
+def encode_records(records):
+    '''Wire format of (name, rtype, ttl, rdata) records'''
+    wire = b''
+    for name, rtype, ttl, rdata in records:
+        encoded = encode_rdata(rtype, rdata)
+        wire += encode_name(name) + struct.pack(
+            '!HHIH', RR_TYPES[rtype], 1, ttl, len(encoded)) + encoded
+    return wire
+
+def encode_response(query, answer = (), authority = (), additional = (),
+                    authoritative = True):
+    '''Response to wire query with the question copied'''
+    msgid = struct.unpack_from('!H', query)[0]
+    question_end = 12
+    while query[question_end]:
+        question_end += query[question_end] + 1
+    question_end += 5
+    flags = 0x8000 | (0x0400 if authoritative else 0)
+    return struct.pack(
+        '!HHHHHH', msgid, flags, 1, len(answer), len(authority),
+        len(additional)) + query[12:question_end] + \
+        encode_records(answer) + encode_records(authority) + \
+        encode_records(additional)
+
+class Zone:
+    '''Records of an authoritative zone'''
+    def __init__(self, origin, records):
+        self.origin = origin
+        self.records = [(origin, 'SOA', 300, SOA.format(origin))] + records
+    def respond(self, query, qname, qtype):
+        '''Authoritative answer or referral'''
+        for owner in set(x[0] for x in self.records if x[1] == 'NS'):
+            if owner != self.origin and is_subdomain(qname, owner) and \
+                    not (qtype == 'DS' and qname == owner):
+                nsnames = [x[3] for x in self.records
+                           if x[0] == owner and x[1] == 'NS']
+                delegation = [x for x in self.records
+                              if x[0] == owner and x[1] == 'NS']
+                glue = [x for x in self.records
+                        if x[0] in nsnames and x[1] in ('A', 'AAAA') and
+                        is_subdomain(x[0], owner)]
+                return encode_response(
+                    query, authority=delegation, additional=glue,
+                    authoritative=False)
+        answer = [x for x in self.records
+                  if x[0] == qname and x[1] == qtype]
+        if answer:
+            return encode_response(query, answer=answer)
+        return encode_response(query, authority=self.records[:1])
+
+class AuthoritativeServers:
+    '''UDP servers on several loopback addresses sharing one port, each
+    serving some zones'''
+    def __init__(self, zones):
+        self.zones = zones
+        self.queries = []
+        self.sockets = []
+        self.port = 0
+        for address in zones:
+            family = socket.AF_INET6 if ':' in address else socket.AF_INET
+            sock = socket.socket(family, socket.SOCK_DGRAM)
+            sock.bind((address, self.port))
+            sock.settimeout(0.1)
+            self.port = sock.getsockname()[1]
+            self.sockets.append((address, sock))
+        self.stopped = threading.Event()
+        self.threads = [
+            threading.Thread(target=self.serve, args=x, daemon=True)
+            for x in self.sockets]
+        for thread in self.threads:
+            thread.start()
+    def serve(self, address, sock):
+        while not self.stopped.is_set():
+            try:
+                query, client = sock.recvfrom(65535)
+            except socket.timeout:
+                continue
+            message = DNSMessage(query)
+            qname, qtype = message.question
+            self.queries.append((address, qname, qtype))
+            candidates = [
+                x for x in self.zones[address]
+                if is_subdomain(qname, x.origin) and
+                not (qtype == 'DS' and qname == x.origin)]
+            zone = max(candidates, key=lambda x: len(x.origin))
+            sock.sendto(zone.respond(query, qname, qtype), client)
+    def close(self):
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join()
+        for _address, sock in self.sockets:
+            sock.close()
+
+DS_RDATA = '12345 13 2 ' + 'AB'*32
+
+def hierarchy():
+    '''Root at 127.0.0.1 delegating com. with glue, v6. with IPv6 glue
+    only and org. without glue to the IPv6-only ns.v6.'''
+    return {
+        '127.0.0.1': [Zone('.', [
+            ('com.', 'NS', 3600, 'ns.com.'),
+            ('ns.com.', 'A', 3600, '127.0.0.2'),
+            ('v6.', 'NS', 3600, 'ns.v6.'),
+            ('ns.v6.', 'AAAA', 3600, '::1'),
+            ('org.', 'NS', 3600, 'ns.v6.')
+        ])],
+        '127.0.0.2': [Zone('com.', [
+            ('example.com.', 'NS', 3600, 'ns.example.com.'),
+            ('ns.example.com.', 'A', 3600, '127.0.0.3'),
+            ('example.com.', 'DS', 3600, DS_RDATA),
+            ('unsigned.com.', 'NS', 3600, 'ns.example.com.')
+        ])],
+        '127.0.0.3': [Zone('example.com.', [])],
+        '::1': [
+            Zone('v6.', [('ns.v6.', 'AAAA', 3600, '::1')]),
+            Zone('org.', [])
+        ]
+    }
+
+class TestDNSMessage(unittest.TestCase):
+    def test_compressed_response(self):
+        query = struct.pack('!HHHHHH', 7, 0, 1, 0, 0, 0) + \
+            encode_name('example.com.') + struct.pack('!HH', 43, 1)
+        wire = struct.pack('!HHHHHH', 7, 0x8400, 1, 2, 1, 1) + query[12:]
+        # owner names point to the question name at offset 12
+        for rtype, rdata, ttl in (('DS', DS_RDATA, 3600),
+                                  ('DS', '12345 13 1 ' + 'CD'*20, 1800)):
+            encoded = encode_rdata(rtype, rdata)
+            wire += b'\xc0\x0c' + struct.pack(
+                '!HHIH', 43, 1, ttl, len(encoded)) + encoded
+        soa = b'\x02ns\xc0\x0c\x0ahostmaster\xc0\x0c' + \
+            struct.pack('!IIIII', 1, 7200, 3600, 1209600, 300)
+        wire += b'\xc0\x0c' + struct.pack('!HHIH', 6, 1, 600, len(soa)) + soa
+        wire += b'\x02ns\xc0\x0c' + struct.pack('!HHIH', 28, 1, 600, 16) + \
+            socket.inet_pton(socket.AF_INET6, '2001:db8::53')
+        message = DNSMessage(wire)
+        self.assertEqual(message.msgid, 7)
+        self.assertTrue(message.authoritative)
+        self.assertEqual(message.rcode, 0)
+        self.assertEqual(message.question, ('example.com.', 'DS'))
+        self.assertEqual(
+            [str(x) for x in message.answer],
+            ['example.com. 3600 IN DS ' + DS_RDATA,
+             'example.com. 1800 IN DS 12345 13 1 ' + 'CD'*20])
+        self.assertEqual(
+            message.authority[0].rdata,
+            'ns.example.com. hostmaster.example.com. 1 7200 3600 1209600 300')
+        self.assertEqual(soa_params(message.authority), [7200, 3600, 1209600])
+        self.assertEqual(message.additional[0].name, 'ns.example.com.')
+        self.assertEqual(message.additional[0].rdata, '2001:db8::53')
+        self.assertEqual(message.min_ttl(), 300)
+    def test_compression_loop(self):
+        wire = struct.pack('!HHHHHH', 1, 0, 1, 0, 0, 0) + b'\xc0\x0c'
+        with self.assertRaises(DNSError):
+            DNSMessage(wire)
+
+class TestDNSResolver(unittest.TestCase):
+    def setUp(self):
+        self.servers = AuthoritativeServers(hierarchy())
+        self.resolver = DNSResolver(['127.0.0.1'], self.servers.port)
+        self.resolver.timeout = 1
+    def tearDown(self):
+        self.servers.close()
+    def test_ds_at_parent(self):
+        records = self.resolver.query('example.com', 'DS')
+        self.assertEqual([x.rdata for x in records], [DS_RDATA])
+        self.assertEqual(records[0].ttl, 3600)
+        self.assertNotIn('127.0.0.3', [x[0] for x in self.servers.queries])
+    def test_soa_at_child(self):
+        records = self.resolver.query('example.com', 'SOA')
+        self.assertEqual(soa_params(records), [7200, 3600, 1209600])
+        self.assertEqual(self.servers.queries[-1][0], '127.0.0.3')
+    def test_no_ds(self):
+        self.assertEqual(self.resolver.query('unsigned.com', 'DS'), [])
+    def test_delegations_reused(self):
+        self.resolver.query('example.com', 'SOA')
+        queries = len(self.servers.queries)
+        self.resolver.query('example.com', 'DS')
+        self.assertEqual(len(self.servers.queries), queries + 1)
+    def test_ipv6_glue(self):
+        records = self.resolver.query('v6', 'SOA')
+        self.assertEqual(soa_params(records), [7200, 3600, 1209600])
+        self.assertEqual(self.servers.queries[-1][0], '::1')
+    def test_glueless_ipv6_only_nameserver(self):
+        records = self.resolver.query('org', 'SOA')
+        self.assertEqual(soa_params(records), [7200, 3600, 1209600])
+        self.assertIn(('::1', 'ns.v6.', 'AAAA'), self.servers.queries)
+    def test_async(self):
+        async def lookups():
+            return await asyncio.gather(
+                self.resolver.query_async('example.com', 'DS'),
+                self.resolver.query_async('org', 'SOA'))
+        ds, soa = asyncio.run(lookups())
+        self.assertEqual([x.rdata for x in ds], [DS_RDATA])
+        self.assertEqual(soa_params(soa), [7200, 3600, 1209600])
+    def test_unreachable(self):
+        self.servers.close()
+        self.resolver.retries = 0
+        with self.assertRaises(DNSError):
+            self.resolver.query('example.com', 'DS')
+
+if __name__ == '__main__':
+    unittest.main()
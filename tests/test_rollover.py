@@ -0,0 +1,251 @@
+'''Tests of the choice of key algorithm and size and of the algorithm
+rollover, with dnssec-keygen and the DNS replaced by stand-ins'''
+
+import base64
+import os
+import pwd
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from datetime import datetime
+from unittest import mock
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from dnssec_rollover_tool import (
+    DNSSEC_ALGORITHMS,
+    DNSSECKey,
+    DNSSECRollover,
+    DSCache,
+    DSResult,
+    Notifier,
+    ZoneContext,
+    format_timestamp,
+    iterkeys,
+    key_size
+)
+
+ZONE = 'example.com'
+DAY = 86400
+KSK_INTERVAL = 180*DAY
+ZSK_INTERVAL = 30*DAY
+RESIGN_INTERVAL = 5*DAY
+# refresh, retry, expire: keys are published 1209600 + 3*10800 seconds
+# ahead of their activation
+SOA_PARAMS = [7200, 3600, 1209600]
+PREPUBLISH = 1209600 + 3*10800
+ALGORITHM_NUMBERS = dict((y, x) for x, y in DNSSEC_ALGORITHMS.items())
+
+def public_key(algorithm, bits):
+    '''Made-up public key of algorithm and size'''
+    if algorithm.startswith('RSA') or algorithm == 'NSEC3RSASHA1':
+        return b'\x03\x01\x00\x01' + b'\xc5' * (bits // 8)
+    return b'\x5a' * 64
+
+def timing_line(name, timestamp):
+    return '; {0}: {1} ({2})\n'.format(
+        name, format_timestamp(timestamp),
+        time.strftime('%a %b %e %H:%M:%S %Y', time.gmtime(timestamp)))
+
+class KeyDirectory:
+    '''Key directory of a zone and a stand-in for dnssec-keygen writing
+    into it'''
+    def __init__(self):
+        self.path = tempfile.mkdtemp()
+        self.keygens = []
+        self.keyid = 1000
+    def write_key(self, keytype, algorithm, bits, publish, activate,
+                  inactive = None, delete = None):
+        self.keyid += 1
+        basename = 'K{0}.+{1:03d}+{2:05d}'.format(
+            ZONE, ALGORITHM_NUMBERS[algorithm], self.keyid)
+        timing = [('Created', publish), ('Publish', publish),
+                  ('Activate', activate), ('Inactive', inactive),
+                  ('Delete', delete)]
+        with open(os.path.join(self.path, basename + '.key'), 'w') as key:
+            key.write('; This is a {0}-signing key, keyid {1}, for {2}.\n'
+                      .format(keytype, self.keyid, ZONE))
+            for name, timestamp in timing:
+                if timestamp is not None:
+                    key.write(timing_line(name, timestamp))
+            key.write('{0}. IN DNSKEY {1} 3 {2} {3}\n'.format(
+                ZONE, 257 if keytype == 'key' else 256,
+                ALGORITHM_NUMBERS[algorithm],
+                base64.b64encode(public_key(algorithm, bits)).decode()))
+        with open(os.path.join(self.path, basename + '.private'), 'w') \
+                as private:
+            private.write('Private-key-format: v1.3\n')
+        return basename
+    def keygen(self, arguments):
+        '''dnssec-keygen with the options used by the tool'''
+        self.keygens.append(arguments)
+        options = dict(zip(arguments[1:-1], arguments[2:]))
+        # as if generated a minute ago, so that the key is active when the
+        # test looks at it
+        now = int(time.time()) - 60
+        if '-S' in options:
+            predecessor = DNSSECKey(options['-S'])
+            return self.write_key(
+                'zone', predecessor.algorithm,
+                key_size(predecessor.dnskey_rdata),
+                predecessor.timing()['inactive'] - int(options['-i']),
+                predecessor.timing()['inactive']).encode()
+        def timestamp(option):
+            value = options.get(option)
+            if value is None:
+                return now
+            if value.startswith('+'):
+                return now + int(value)
+            return int(datetime.strptime(value, '%Y%m%d%H%M%S')
+                       .timestamp() - time.timezone)
+        return self.write_key(
+            'key' if options.get('-f') == 'KSK' else 'zone',
+            options['-a'], int(options.get('-b', 256)),
+            timestamp('-P'), timestamp('-A')).encode()
+    def keys(self):
+        return list(iterkeys(self.path, ZONE))
+    def close(self):
+        shutil.rmtree(self.path)
+
+class StubDSCache(DSCache):
+    '''DS results set by the test, by key algorithm'''
+    def __init__(self, present):
+        super().__init__()
+        self.present = present
+    def lookup(self, dnssec_key):
+        if dnssec_key.algorithm in self.present:
+            return DSResult(DSResult.PRESENT, 3600)
+        return DSResult(DSResult.ABSENT)
+
+class RolloverTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = KeyDirectory()
+        self.owner = pwd.getpwuid(os.getuid()).pw_name
+        self.notifier = Notifier()
+        patches = [
+            mock.patch.object(DNSSECRollover, 'keygen',
+                              self.directory.keygen),
+            mock.patch.object(DNSSECRollover, 'notifier', self.notifier),
+            mock.patch.object(DNSSECRollover, 'key_algorithm', None),
+            mock.patch.object(DNSSECRollover, 'key_bits', None),
+            mock.patch.object(DNSSECRollover, 'key_pool', None),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(self.directory.close)
+        now = int(time.time())
+        self.old_ksk = self.directory.write_key(
+            'key', 'ECDSAP256SHA256', 256, now - 6*DAY, now - 5*DAY)
+        self.old_zsk = self.directory.write_key(
+            'zone', 'ECDSAP256SHA256', 256, now - 6*DAY, now - 5*DAY)
+    def rollover(self, keytype, present = ('ECDSAP256SHA256',),
+                 algorithm = None, bits = None):
+        zone_context = ZoneContext(ZONE, None, algorithm, bits)
+        zone_context._soa_params = SOA_PARAMS
+        zone_context._soa_expires = float('inf')
+        return DNSSECRollover(
+            keytype,
+            KSK_INTERVAL if keytype == 'key' else ZSK_INTERVAL,
+            RESIGN_INTERVAL,
+            'from@example.com',
+            'to@example.com',
+            self.owner,
+            self.directory.keys(),
+            StubDSCache(present),
+            zone_context)
+    def start_algorithm_rollover(self):
+        '''Runs of ZSK and KSK rollover to RSASHA256, forgetting their
+        notices'''
+        for keytype in ('zone', 'key'):
+            self.rollover(keytype, algorithm='RSASHA256')
+        self.notifier.notices = {}
+    def subjects(self):
+        return [x[1] for y in self.notifier.notices.values() for x in y]
+
+class TestKeyAlgorithm(RolloverTestCase):
+    def test_zone_algorithm_kept(self):
+        for keytype in ('zone', 'key'):
+            rollover = self.rollover(keytype)
+            self.assertEqual(rollover.algorithm, 'ECDSAP256SHA256')
+            self.assertEqual(rollover.bits, 256)
+        self.assertEqual(self.directory.keygens, [])
+    def test_zsk_size_of_zone_list(self):
+        now = int(time.time())
+        shutil.rmtree(self.directory.path)
+        os.mkdir(self.directory.path)
+        rsa_zsk = self.directory.write_key(
+            'zone', 'RSASHA256', 1024, now - 40*DAY, now - 39*DAY)
+        self.directory.write_key(
+            'key', 'RSASHA256', 2048, now - 6*DAY, now - 5*DAY)
+        rollover = self.rollover('zone', ('RSASHA256',), 'RSASHA256', 2048)
+        self.assertEqual(rollover.bits, 2048)
+        self.assertEqual(len(self.directory.keygens), 1)
+        arguments = self.directory.keygens[0]
+        self.assertNotIn('-S', arguments)
+        self.assertEqual(
+            arguments[arguments.index('-a'):arguments.index('-a') + 4],
+            ['-a', 'RSASHA256', '-b', '2048'])
+        predecessor = DNSSECKey(
+            os.path.join(self.directory.path, rsa_zsk + '.key'))
+        new_key = rollover.new_keys[0]
+        self.assertEqual(key_size(new_key.dnskey_rdata), 2048)
+        self.assertEqual(new_key.timing()['activate'],
+                         predecessor.timing()['inactive'])
+    def test_zsk_successor_of_same_size(self):
+        now = int(time.time())
+        shutil.rmtree(self.directory.path)
+        os.mkdir(self.directory.path)
+        self.directory.write_key(
+            'zone', 'RSASHA256', 1024, now - 40*DAY, now - 39*DAY)
+        self.directory.write_key(
+            'key', 'RSASHA256', 2048, now - 6*DAY, now - 5*DAY)
+        rollover = self.rollover('zone', ('RSASHA256',))
+        self.assertEqual(rollover.bits, 1024)
+        self.assertIn('-S', self.directory.keygens[0])
+
+class TestAlgorithmRollover(RolloverTestCase):
+    def test_new_algorithm_keys_published_and_activated(self):
+        self.start_algorithm_rollover()
+        self.assertEqual(len(self.directory.keygens), 2)
+        new_keys = [x for x in self.directory.keys()
+                    if x.algorithm == 'RSASHA256']
+        self.assertEqual(sorted(x.keytype for x in new_keys),
+                         ['key', 'zone'])
+        for dnssec_key in new_keys:
+            self.assertEqual(dnssec_key.status(), 'activated')
+        for dnssec_key in self.directory.keys():
+            self.assertIsNone(dnssec_key.inactive)
+    def test_continued_without_algorithm(self):
+        self.start_algorithm_rollover()
+        rollover = self.rollover('key')
+        self.assertEqual(rollover.algorithm, 'RSASHA256')
+        self.assertEqual(len(self.directory.keygens), 2)
+        self.assertEqual(self.subjects(), ['DS record insertion required'])
+    def test_old_ds_removal_requested(self):
+        self.start_algorithm_rollover()
+        for keytype in ('zone', 'key'):
+            self.rollover(
+                keytype, ('ECDSAP256SHA256', 'RSASHA256'), 'RSASHA256')
+        self.assertEqual(self.subjects(), ['DS record removal required'])
+        for dnssec_key in self.directory.keys():
+            self.assertIsNone(dnssec_key.inactive)
+    def test_old_keys_retired(self):
+        self.start_algorithm_rollover()
+        before = int(time.time())
+        for keytype in ('zone', 'key'):
+            self.rollover(keytype, ('RSASHA256',), 'RSASHA256')
+        self.assertEqual(len(self.directory.keygens), 2)
+        for dnssec_key in self.directory.keys():
+            timing = dnssec_key.timing()
+            if dnssec_key.algorithm == 'RSASHA256':
+                self.assertIsNone(timing['inactive'])
+                continue
+            self.assertGreaterEqual(timing['inactive'], before + PREPUBLISH)
+            self.assertEqual(timing['delete'] - timing['inactive'],
+                             PREPUBLISH + RESIGN_INTERVAL)
+
+if __name__ == '__main__':
+    unittest.main()
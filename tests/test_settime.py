@@ -0,0 +1,127 @@
+'''Tests of the in-process key timing writer against files in the
+layout dnssec-settime writes, and against dnssec-settime itself where
+it is installed'''
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import dnssec_rollover_tool
+from dnssec_rollover_tool import DNSSECKey, format_timestamp
+
+DATA = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'data', 'settime')
+ZSK = 'Kexample.com.+013+12345'
+KSK = 'Kexample.com.+013+54321'
+
+# epoch seconds of the timestamps in the fixtures
+JAN_2 = 1672617600
+FEB_1 = 1675209600
+MAR_5 = 1678019400
+
+# changes turning the files in before/ into those in after/
+CHANGES = {
+    ZSK: {'inactive': FEB_1, 'delete': MAR_5},
+    KSK: {'publish': JAN_2, 'activate': FEB_1}
+}
+
+def read(path):
+    with open(path) as filedesc:
+        return filedesc.read()
+
+class SettimeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for name in os.listdir(os.path.join(DATA, 'before')):
+            shutil.copy(os.path.join(DATA, 'before', name), self.directory)
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    def key(self, name):
+        return DNSSECKey(os.path.join(self.directory, name + '.key'))
+    def assertFilesEqual(self, name, state):
+        for suffix in ('.key', '.private'):
+            self.assertEqual(
+                read(os.path.join(self.directory, name + suffix)),
+                read(os.path.join(DATA, state, name + suffix)),
+                name + suffix)
+
+class TestSettime(SettimeTestCase):
+    def test_add_timing(self):
+        for name, changes in CHANGES.items():
+            dnssec_key = self.key(name)
+            self.assertTrue(dnssec_key.settime(**changes))
+            self.assertFilesEqual(name, 'after')
+            for attribute, timestamp in changes.items():
+                self.assertEqual(dnssec_key.timing()[attribute], timestamp)
+            self.assertEqual(self.key(name).timing(), dnssec_key.timing())
+    def test_remove_timing(self):
+        for name in CHANGES:
+            for suffix in ('.key', '.private'):
+                shutil.copy(os.path.join(DATA, 'after', name + suffix),
+                            self.directory)
+        dnssec_key = self.key(ZSK)
+        self.assertTrue(dnssec_key.settime(inactive=None, delete=None))
+        self.assertFilesEqual(ZSK, 'before')
+        self.assertIsNone(dnssec_key.inactive)
+    def test_replace_timing(self):
+        dnssec_key = self.key(ZSK)
+        dnssec_key.settime(inactive=JAN_2, delete=JAN_2)
+        dnssec_key.settime(inactive=FEB_1, delete=MAR_5)
+        self.assertFilesEqual(ZSK, 'after')
+    def test_mode_kept(self):
+        path = os.path.join(self.directory, ZSK + '.private')
+        os.chmod(path, 0o600)
+        self.key(ZSK).settime(**CHANGES[ZSK])
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+    def test_private_key_write_fails(self):
+        writes = []
+        def write_replacement(path, content):
+            if path.endswith('.private'):
+                raise OSError('disk full')
+            temporary = real_write_replacement(path, content)
+            writes.append(temporary)
+            return temporary
+        real_write_replacement = dnssec_rollover_tool.write_replacement
+        dnssec_key = self.key(ZSK)
+        with mock.patch.object(
+                dnssec_rollover_tool, 'write_replacement',
+                write_replacement):
+            self.assertFalse(dnssec_key.settime(**CHANGES[ZSK]))
+        self.assertEqual(len(writes), 1)
+        self.assertFilesEqual(ZSK, 'before')
+        self.assertIsNone(dnssec_key.inactive)
+        self.assertEqual(
+            sorted(os.listdir(self.directory)),
+            sorted(os.listdir(os.path.join(DATA, 'before'))))
+
+@unittest.skipUnless(shutil.which('dnssec-settime'), 'needs dnssec-settime')
+class TestSettimeCommand(SettimeTestCase):
+    '''Compare with the files dnssec-settime writes'''
+    def test_same_as_dnssec_settime(self):
+        command_directory = os.path.join(self.directory, 'command')
+        os.mkdir(command_directory)
+        for name, changes in CHANGES.items():
+            for suffix in ('.key', '.private'):
+                shutil.copy(os.path.join(self.directory, name + suffix),
+                            command_directory)
+            arguments = ['dnssec-settime', '-K', command_directory]
+            for attribute, timestamp in changes.items():
+                arguments += [dnssec_rollover_tool.SETTIME_OPTIONS[attribute],
+                              format_timestamp(timestamp)]
+            subprocess.check_call(
+                arguments + [name], stdout=subprocess.DEVNULL)
+            self.key(name).settime(**changes)
+            for suffix in ('.key', '.private'):
+                self.assertEqual(
+                    read(os.path.join(self.directory, name + suffix)),
+                    read(os.path.join(command_directory, name + suffix)),
+                    name + suffix)
+
+if __name__ == '__main__':
+    unittest.main()